@@ -1,3 +1,30 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+from products.models import Product, Variant
+
+
+class CartItem(models.Model):
+    """Строка корзины авторизованного пользователя (см. cart.storage)."""
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart_items')
+    # тот же ключ, что и в корзине сессии: variant_<id> / product_<id>
+    key = models.CharField(max_length=40)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    variant = models.ForeignKey(Variant, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    quantity = models.PositiveIntegerField('Количество', default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Позиция корзины'
+        verbose_name_plural = 'Корзины'
+        constraints = [
+            # индекс по (user, key): чтение корзины и upsert строки
+            models.UniqueConstraint(
+                fields=["user", "key"],
+                name="unique_cart_item"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} — {self.key} × {self.quantity}"
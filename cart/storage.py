@@ -0,0 +1,413 @@
+import json
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+from products import inventory
+from products.models import Product, Variant
+from .models import CartItem
+
+
+# ==============================
+# Хранилища корзины
+# ==============================
+#
+# Корзина — словарь {ключ позиции: {"product_id", "variant_id", "quantity"}},
+# ключ — "variant_<id>" или "product_<id>". Код корзины и оформления заказа
+# работает только через CartStore, бэкенд выбирается настройкой CART_STORE:
+#
+#   session — в сессии Django (по умолчанию),
+#   redis   — hash в Redis: изменение позиции — один HSET/HDEL,
+#   cookie  — подписанная cookie, без хранения на сервере.
+#
+# Корзина авторизованного пользователя всегда в БД (CartItem, строка на
+# позицию) — не теряется между устройствами и не раздувает сессии. При
+# входе анонимная корзина вливается в неё одним upsert (merge_on_login).
+#
+# Хранилище создаётся один раз на запрос (get_cart_store), CartMiddleware
+# после ответа вызывает commit() — cookie-бэкенду нужен ответ.
+
+# предел количества одной позиции
+MAX_QUANTITY = 100
+
+
+class CartStore:
+
+    def __init__(self, request):
+        self.request = request
+        self._items = None
+
+    # ----- чтение -----
+
+    def load(self):
+        raise NotImplementedError
+
+    def items(self):
+        """Все позиции (читаются из хранилища один раз за запрос)."""
+        if self._items is None:
+            self._items = self.load()
+        return self._items
+
+    def get(self, key):
+        return self.items().get(key)
+
+    def __contains__(self, key):
+        return key in self.items()
+
+    def __len__(self):
+        return len(self.items())
+
+    # ----- запись -----
+
+    def set(self, key, item):
+        self.items()[key] = item
+        self.write(key, item)
+
+    def remove(self, *keys):
+        keys = [key for key in keys if key in self.items()]
+        if not keys:
+            return
+
+        for key in keys:
+            del self.items()[key]
+        self.delete(keys)
+
+    def clear(self):
+        self._items = {}
+        self.flush()
+
+    def write(self, key, item):
+        raise NotImplementedError
+
+    def delete(self, keys):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def commit(self, response):
+        pass
+
+    def preloaded(self):
+        """(товары, варианты), загруженные вместе с корзиной, если есть."""
+        return None
+
+
+class SessionCartStore(CartStore):
+    session_key = "cart"
+
+    def load(self):
+        # чтение не помечает сессию изменённой
+        return dict(self.request.session.get(self.session_key) or {})
+
+    def _save(self):
+        self.request.session[self.session_key] = self.items()
+
+    def write(self, key, item):
+        self._save()
+
+    def delete(self, keys):
+        self._save()
+
+    def flush(self):
+        self._save()
+
+
+class TokenCartStore(CartStore):
+    """Корзина по случайному id из cookie."""
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.cart_id = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        self.new_id = False
+
+    def ensure_id(self):
+        if not self.cart_id:
+            self.cart_id = secrets.token_urlsafe(24)
+            self.new_id = True
+        return self.cart_id
+
+    def commit(self, response):
+        if self.new_id:
+            response.set_cookie(
+                settings.CART_COOKIE_NAME,
+                self.cart_id,
+                max_age=settings.CART_TTL,
+                httponly=True,
+                samesite="Lax",
+            )
+
+
+class RedisCartStore(TokenCartStore):
+    key_prefix = "cart:"
+
+    _client = None
+
+    @classmethod
+    def client(cls):
+        if cls._client is None:
+            import redis
+
+            cls._client = redis.Redis.from_url(settings.CART_REDIS_URL)
+        return cls._client
+
+    def redis_key(self):
+        return self.key_prefix + self.ensure_id()
+
+    def load(self):
+        if not self.cart_id:
+            return {}
+
+        return {
+            key.decode(): json.loads(value)
+            for key, value in self.client().hgetall(self.redis_key()).items()
+        }
+
+    def write(self, key, item):
+        pipe = self.client().pipeline()
+        pipe.hset(self.redis_key(), key, json.dumps(item, separators=(",", ":")))
+        pipe.expire(self.redis_key(), settings.CART_TTL)
+        pipe.execute()
+
+    def delete(self, keys):
+        self.client().hdel(self.redis_key(), *keys)
+
+    def flush(self):
+        if self.cart_id:
+            self.client().delete(self.redis_key())
+
+
+class SignedCookieCartStore(CartStore):
+    """Вся корзина в подписанной cookie (лимит браузера ~4 КБ)."""
+
+    salt = "cart.storage"
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.dirty = False
+
+    def load(self):
+        try:
+            value = self.request.get_signed_cookie(
+                settings.CART_COOKIE_NAME,
+                salt=self.salt,
+                max_age=settings.CART_TTL,
+            )
+            items = json.loads(value)
+        except (KeyError, signing.BadSignature, ValueError):
+            return {}
+
+        return items if isinstance(items, dict) else {}
+
+    def write(self, key, item):
+        self.dirty = True
+
+    def delete(self, keys):
+        self.dirty = True
+
+    def flush(self):
+        self.dirty = True
+
+    def commit(self, response):
+        if not self.dirty:
+            return
+
+        if not self.items():
+            response.delete_cookie(settings.CART_COOKIE_NAME)
+            return
+
+        response.set_signed_cookie(
+            settings.CART_COOKIE_NAME,
+            json.dumps(self.items(), separators=(",", ":")),
+            salt=self.salt,
+            max_age=settings.CART_TTL,
+            httponly=True,
+            samesite="Lax",
+        )
+
+
+class UserCartStore(CartStore):
+    """Корзина пользователя в CartItem: чтение — один запрос с товарами."""
+
+    def __init__(self, request, user=None):
+        super().__init__(request)
+        self.user = user or request.user
+        self._products = {}
+        self._variants = {}
+        self._added = False
+
+    def load(self):
+        rows = (
+            CartItem.objects
+            .filter(user=self.user)
+            .select_related(
+                "product__primary_image",
+                "variant__size",
+                "variant__color",
+            )
+            .annotate(variant_available=inventory.available_expression("variant__"))
+            .order_by("id")
+        )
+
+        items = {}
+        for row in rows:
+            items[row.key] = {
+                "product_id": row.product_id,
+                "variant_id": row.variant_id,
+                "quantity": row.quantity,
+            }
+            if row.product.is_active:
+                self._products[row.product_id] = row.product
+            if row.variant_id:
+                row.variant.available = row.variant_available
+                self._variants[row.variant_id] = row.variant
+
+        return items
+
+    def preloaded(self):
+        self.items()
+
+        # добавленных в этом запросе позиций среди загруженных нет
+        if self._added:
+            return None
+
+        return self._products, self._variants
+
+    def upsert(self, items):
+        CartItem.objects.bulk_create(
+            [
+                CartItem(
+                    user=self.user,
+                    key=key,
+                    product_id=item["product_id"],
+                    variant_id=item.get("variant_id"),
+                    quantity=item["quantity"],
+                )
+                for key, item in items.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "key"],
+            update_fields=["product", "variant", "quantity", "updated_at"],
+        )
+
+    def write(self, key, item):
+        self._added = True
+        self.upsert({key: item})
+
+    def delete(self, keys):
+        CartItem.objects.filter(user=self.user, key__in=keys).delete()
+
+    def flush(self):
+        CartItem.objects.filter(user=self.user).delete()
+
+
+BACKENDS = {
+    "session": SessionCartStore,
+    "redis": RedisCartStore,
+    "cookie": SignedCookieCartStore,
+}
+
+
+def anonymous_cart_store(request):
+    backend = settings.CART_STORE
+    store_class = BACKENDS.get(backend) or import_string(backend)
+    return store_class(request)
+
+
+def get_cart_store(request):
+    store = getattr(request, "_cart_store", None)
+
+    if store is None:
+        user = getattr(request, "user", None)
+
+        if user is not None and user.is_authenticated:
+            store = UserCartStore(request)
+        else:
+            store = anonymous_cart_store(request)
+
+        request._cart_store = store
+
+    return store
+
+
+def existing_items(items):
+    """Позиции, чьи товар/вариант ещё есть в каталоге (активные товары).
+
+    Анонимная корзина могла пролежать, пока вариант удалили, — upsert с
+    таким id упадёт на внешнем ключе и сломает вход.
+    """
+    variant_ids = {item["variant_id"] for item in items.values() if item.get("variant_id")}
+    product_ids = {item["product_id"] for item in items.values() if not item.get("variant_id")}
+
+    variants = set()
+    if variant_ids:
+        variants = set(
+            Variant.objects
+            .filter(id__in=variant_ids, product__is_active=True)
+            .values_list("id", "product_id")
+        )
+
+    products = set()
+    if product_ids:
+        products = set(
+            Product.objects
+            .filter(id__in=product_ids, is_active=True)
+            .values_list("id", flat=True)
+        )
+
+    return {
+        key: item
+        for key, item in items.items()
+        if (
+            (item["variant_id"], item["product_id"]) in variants
+            if item.get("variant_id")
+            else item["product_id"] in products
+        )
+    }
+
+
+def merge_on_login(request, user):
+    """Влить анонимную корзину в корзину пользователя: чтение + один upsert."""
+    anonymous = anonymous_cart_store(request)
+    items = anonymous.items()
+
+    if not items:
+        return
+
+    store = UserCartStore(request, user)
+    merged = {}
+
+    for key, item in existing_items(items).items():
+        current = store.get(key)
+        merged[key] = {
+            **item,
+            "quantity": min(
+                item["quantity"] + (current["quantity"] if current else 0),
+                MAX_QUANTITY,
+            ),
+        }
+
+    store.upsert(merged)
+    anonymous.clear()
+
+    # cookie анонимной корзины удаляется в CartMiddleware
+    request._anonymous_cart_store = anonymous
+    request._cart_store = None
+
+
+class CartMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        for attr in ("_anonymous_cart_store", "_cart_store"):
+            store = getattr(request, attr, None)
+            if store is not None:
+                store.commit(response)
+
+        return response
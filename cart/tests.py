@@ -1,12 +1,23 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from unittest.mock import patch
+
+from products import cache as catalog_cache
+from products import inventory
 from products.models import Product, Variant, Category
+from .models import CartItem
+from .storage import MAX_QUANTITY, RedisCartStore
 
 
 class CartTestCase(TestCase):
 
     def setUp(self):
         print("\n--- SETUP CART ---")
+        cache.clear()
 
         self.category = Category.objects.create(
             name="Test Category",
@@ -54,7 +65,7 @@ class CartTestCase(TestCase):
         )
 
         cart = self.client.session.get("cart")
-        self.assertEqual(cart, {})  # не добавилось
+        self.assertIsNone(cart)  # не добавилось, пустая корзина в сессию не пишется
 
     def test_add_inactive_product_blocked(self):
         print("Testing inactive product")
@@ -92,7 +103,7 @@ class CartTestCase(TestCase):
         )
 
         cart = self.client.session.get("cart")
-        self.assertEqual(cart, {})
+        self.assertIsNone(cart)
 
     # ==============================
     # CART CLEANING TESTS
@@ -292,9 +303,407 @@ class CartTestCase(TestCase):
             {"variant_id": self.variant.id, "quantity": 1}
         )
 
-        with self.assertNumQueries(4):
-            # 1 products
+        with self.assertNumQueries(3):
+            # 1 products (с главным фото)
             # 1 variants
-            # 1 images
             # 1 session
             self.client.get(reverse("cart_detail"))
+
+        with self.assertNumQueries(1):
+            # 1 session — товары не менялись, проверка из кэша
+            response = self.client.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 1)
+
+    def test_cart_revalidated_after_product_change(self):
+        self.client.post(
+            reverse("cart_add", args=[self.product.id]),
+            {"variant_id": self.variant.id, "quantity": 4}
+        )
+        self.client.get(reverse("cart_detail"))
+
+        Variant.objects.filter(pk=self.variant.pk).update(stock=2)
+        inventory.stock_changed([self.product.id])
+
+        response = self.client.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 2)
+        self.assertEqual(self.client.session["cart"][f"variant_{self.variant.id}"]["quantity"], 2)
+
+        self.product.is_active = False
+        self.product.save()
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"], [])
+
+    def test_stock_change_during_validation_not_cached(self):
+        self.client.post(
+            reverse("cart_add", args=[self.product.id]),
+            {"variant_id": self.variant.id, "quantity": 4}
+        )
+        set_cached = catalog_cache.set_cached
+
+        def change_then_cache(key, token, value):
+            # остаток изменился между проверкой корзины и записью в кэш
+            Variant.objects.filter(pk=self.variant.pk).update(stock=2)
+            inventory.stock_changed([self.product.id])
+            set_cached(key, token, value)
+
+        with patch.object(catalog_cache, "set_cached", change_then_cache):
+            response = self.client.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 4)
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 2)
+
+
+# ==============================
+# JSON API
+# ==============================
+
+class CartApiTestCase(TestCase):
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Api", slug="api")
+        self.product = Product.objects.create(
+            name="Jacket",
+            slug="jacket",
+            description="d",
+            price=2000,
+            category=self.category,
+            is_active=True
+        )
+        self.variants = [
+            Variant.objects.create(product=self.product, stock=stock)
+            for stock in (5, 3, 1)
+        ]
+        self.plain = Product.objects.create(
+            name="Sticker",
+            slug="sticker",
+            description="d",
+            price=50,
+            category=self.category,
+            is_active=True
+        )
+        self.url = reverse("cart_api")
+
+    def post(self, data):
+        return self.client.post(self.url, data, content_type="application/json")
+
+    def line(self, variant, quantity):
+        return {"product_id": self.product.id, "variant_id": variant.id, "quantity": quantity}
+
+    def test_batch_add_with_single_stock_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({"add": [
+                self.line(self.variants[0], 2),
+                self.line(self.variants[1], 3),
+                self.line(self.variants[0], 1),
+                {"product_id": self.plain.id, "variant_id": None, "quantity": 4},
+            ]})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 10)
+        self.assertEqual(data["total"], 3 * 2000 + 3 * 2000 + 4 * 50)
+        self.assertNotIn("html", data)
+
+        # 1 проверка остатков на весь пакет + 1 при расчёте итогов
+        variant_queries = [q for q in queries if 'FROM "products_variant"' in q["sql"]]
+        self.assertEqual(len(variant_queries), 2)
+
+    def test_error_rolls_back_whole_batch(self):
+        response = self.post({"add": [
+            self.line(self.variants[0], 1),
+            self.line(self.variants[2], 2),
+        ]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["index"], 1)
+        self.assertEqual(self.client.get(self.url).json()["items"], [])
+
+    def test_plain_product_with_variants_rejected(self):
+        response = self.post({"add": [{"product_id": self.product.id, "quantity": 1}]})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["error"], "Выберите вариант товара")
+
+    def test_update_remove_and_fragment(self):
+        self.post({"add": [self.line(self.variants[0], 1), self.line(self.variants[1], 1)]})
+
+        first, second = (f"variant_{v.id}" for v in self.variants[:2])
+        response = self.post({
+            "update": [{"key": first, "quantity": 50}],
+            "remove": [second],
+            "fragment": True,
+        })
+
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        # как в форме: количество урезается до остатка
+        self.assertEqual([(item["key"], item["quantity"]) for item in data["items"]], [(first, 5)])
+        self.assertIn('class="cart-table"', data["html"])
+
+        self.assertEqual(self.client.session["cart"][first]["quantity"], 5)
+
+    def test_update_without_variant_trimmed_to_max_quantity(self):
+        self.post({"add": [{"product_id": self.plain.id, "variant_id": None, "quantity": 1}]})
+        key = f"product_{self.plain.id}"
+
+        response = self.post({"update": [{"key": key, "quantity": 10 ** 6}]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session["cart"][key]["quantity"], MAX_QUANTITY)
+
+    def test_clear(self):
+        self.post({"add": [self.line(self.variants[0], 1)]})
+
+        response = self.post({"clear": True, "fragment": True})
+
+        self.assertEqual(response.json()["count"], 0)
+        self.assertIn("Корзина пуста", response.json()["html"])
+
+    def test_invalid_payload(self):
+        self.assertEqual(self.client.post(self.url, "nope", content_type="application/json").status_code, 400)
+        self.assertEqual(self.post({"add": [{"product_id": "x"}]}).status_code, 400)
+        self.assertEqual(self.post({"update": [{"key": "variant_0", "quantity": 1}]}).status_code, 400)
+
+
+# ==============================
+# USER CART
+# ==============================
+
+class UserCartTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            "buyer@example.com", "Buyer", "+996700000001", "secret-pass-1"
+        )
+
+        self.category = Category.objects.create(name="Users", slug="users")
+        self.product = Product.objects.create(
+            name="Boots",
+            slug="boots",
+            description="d",
+            price=3000,
+            category=self.category,
+            is_active=True
+        )
+        self.variant = Variant.objects.create(product=self.product, stock=10)
+        self.key = f"variant_{self.variant.id}"
+
+    def add(self, client, quantity):
+        client.post(
+            reverse("cart_add", args=[self.product.id]),
+            {"variant_id": self.variant.id, "quantity": quantity}
+        )
+
+    def login(self, client=None):
+        client = client or self.client
+        self.assertTrue(client.login(email="buyer@example.com", password="secret-pass-1"))
+
+    def test_merge_on_login(self):
+        CartItem.objects.create(user=self.user, key=self.key, product=self.product, variant=self.variant, quantity=2)
+
+        self.add(self.client, 3)
+        self.login()
+
+        item = CartItem.objects.get(user=self.user)
+        self.assertEqual(item.quantity, 5)
+        self.assertEqual(self.client.session.get("cart"), {})
+
+    def test_merge_on_login_caps_quantity(self):
+        CartItem.objects.create(user=self.user, key=self.key, product=self.product, variant=self.variant, quantity=99)
+
+        self.add(self.client, 3)
+        self.login()
+
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, MAX_QUANTITY)
+
+    def test_login_with_deleted_variant_in_cart(self):
+        self.add(self.client, 3)
+        Variant.objects.filter(pk=self.variant.pk).delete()
+
+        self.login()
+
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.session.get("cart"), {})
+
+    def test_cart_follows_user_between_devices(self):
+        self.login()
+        self.add(self.client, 2)
+
+        self.assertIsNone(self.client.session.get("cart"))
+
+        other = Client()
+        self.login(other)
+        response = other.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 2)
+
+    def test_cart_detail_reads_cart_in_one_query(self):
+        self.login()
+        self.add(self.client, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["total"], 6000)
+
+        tables = [q["sql"] for q in queries if "cart_cartitem" in q["sql"] or 'FROM "products_' in q["sql"]]
+        self.assertEqual(len(tables), 1)
+
+    def test_inactive_product_removed(self):
+        self.login()
+        self.add(self.client, 1)
+
+        Product.objects.filter(pk=self.product.pk).update(is_active=False)
+        response = self.client.get(reverse("cart_detail"))
+
+        self.assertEqual(response.context["cart_items"], [])
+        self.assertFalse(CartItem.objects.exists())
+
+
+# ==============================
+# CART STORAGE BACKENDS
+# ==============================
+
+class FakeRedis:
+    """Минимальная замена redis.Redis для тестов: только хэши."""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+
+    def hgetall(self, name):
+        self.commands.append("HGETALL")
+        return {k.encode(): v.encode() for k, v in self.data.get(name, {}).items()}
+
+    def hset(self, name, key, value):
+        self.commands.append("HSET")
+        self.data.setdefault(name, {})[key] = value
+
+    def hdel(self, name, *keys):
+        self.commands.append("HDEL")
+        for key in keys:
+            self.data.get(name, {}).pop(key, None)
+
+    def delete(self, name):
+        self.commands.append("DEL")
+        self.data.pop(name, None)
+
+    def expire(self, name, seconds):
+        pass
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    def execute(self):
+        for name, args in self.calls:
+            getattr(self.redis, name)(*args)
+
+
+class CartStoreMixin:
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Store", slug="store")
+        self.product = Product.objects.create(
+            name="Hat",
+            slug="hat",
+            description="d",
+            price=700,
+            category=self.category,
+            is_active=True
+        )
+        self.variant = Variant.objects.create(product=self.product, stock=5)
+        self.key = f"variant_{self.variant.id}"
+
+    def add(self, quantity):
+        return self.client.post(
+            reverse("cart_add", args=[self.product.id]),
+            {"variant_id": self.variant.id, "quantity": quantity}
+        )
+
+    def test_add_update_remove(self):
+        self.add(2)
+        self.add(1)
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 3)
+
+        self.client.post(reverse("cart_update"), {"key": self.key, "quantity": 4})
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"][0]["quantity"], 4)
+
+        self.client.post(reverse("cart_remove"), {"key": self.key})
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"], [])
+
+    def test_clear(self):
+        self.add(1)
+        self.client.post(reverse("cart_clear"))
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"], [])
+
+    def test_no_session_write(self):
+        self.add(1)
+        self.client.get(reverse("cart_detail"))
+
+        self.assertIsNone(self.client.session.get("cart"))
+
+
+@override_settings(CART_STORE="redis")
+class RedisCartStoreTestCase(CartStoreMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.redis = FakeRedis()
+        patcher = patch.object(RedisCartStore, "_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_item_update_is_single_hash_write(self):
+        self.add(1)
+
+        self.redis.commands.clear()
+        self.client.post(reverse("cart_update"), {"key": self.key, "quantity": 2})
+
+        self.assertEqual(self.redis.commands, ["HGETALL", "HSET"])
+
+        cart_id = self.client.cookies["cart"].value
+        self.assertEqual(list(self.redis.data[f"cart:{cart_id}"]), [self.key])
+
+    def test_reading_does_not_create_cart(self):
+        self.client.get(reverse("cart_detail"))
+
+        self.assertNotIn("cart", self.client.cookies)
+        self.assertEqual(self.redis.data, {})
+
+
+@override_settings(CART_STORE="cookie")
+class SignedCookieCartStoreTestCase(CartStoreMixin, TestCase):
+
+    def test_tampered_cookie_ignored(self):
+        self.add(1)
+
+        value = self.client.cookies["cart"].value
+        self.assertIn(self.key, value)
+        self.assertIsNone(self.client.session.get("cart"))
+
+        self.client.cookies["cart"] = value.replace('"quantity":1', '"quantity":5')
+
+        response = self.client.get(reverse("cart_detail"))
+        self.assertEqual(response.context["cart_items"], [])
@@ -7,5 +7,6 @@ urlpatterns = [
     path('update/', views.cart_update, name='cart_update'),
     path('remove/', views.cart_remove, name='cart_remove'),
     path('clear/', views.cart_clear, name='cart_clear'),
+    path('api/', views.cart_api, name='cart_api'),
 
 ]
\ No newline at end of file
@@ -1,26 +1,21 @@
+import hashlib
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.views.decorators.http import require_POST
-
+from django.db.models import Count
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_http_methods, require_POST
+
+from products import cache as catalog_cache
+from products import inventory
+from products.images import rendition_url
 from products.models import Product, Variant
+from .storage import MAX_QUANTITY, get_cart_store
 
 
-# =========================
-# Helpers
-# =========================
-
-def get_cart(request):
-    cart = request.session.get('cart')
-    if cart is None:
-        request.session['cart'] = {}
-        request.session.modified = True
-        return {}
-    return cart
-
-
-def save_cart(request, cart):
-    request.session["cart"] = cart
-    request.session.modified = True
+CURRENCY_SYMBOL = "сом"
 
 
 # =========================
@@ -29,7 +24,7 @@ def save_cart(request, cart):
 
 @require_POST
 def cart_add(request, product_id):
-    cart = get_cart(request)
+    cart = get_cart_store(request)
 
     product = get_object_or_404(Product, id=product_id, is_active=True)
 
@@ -56,16 +51,16 @@ def cart_add(request, product_id):
         variant = Variant.objects.filter(
             id=variant_id,
             product_id=product.id
-        ).first()
+        ).annotate(available=inventory.available_expression()).first()
 
         if not variant:
             messages.error(request, "Вариант товара не найден")
             return redirect("product_detail", slug=product.slug)
 
-        if variant.stock < quantity:
+        if variant.available < quantity:
             messages.error(
                 request,
-                f"Недостаточно на складе: только {variant.stock} шт."
+                f"Недостаточно на складе: только {variant.available} шт."
             )
             return redirect("product_detail", slug=product.slug)
 
@@ -79,26 +74,28 @@ def cart_add(request, product_id):
 
         key = f"product_{product.id}"
 
+    item = cart.get(key)
+
     # увеличение количества
-    if key in cart:
-        new_quantity = cart[key]["quantity"] + quantity
+    if item:
+        new_quantity = item["quantity"] + quantity
 
-        if variant and variant.stock < new_quantity:
+        if variant and variant.available < new_quantity:
             messages.error(
                 request,
-                f"Недостаточно на складе: только {variant.stock} шт."
+                f"Недостаточно на складе: только {variant.available} шт."
             )
             return redirect("product_detail", slug=product.slug)
 
-        cart[key]["quantity"] = new_quantity
+        item["quantity"] = new_quantity
     else:
-        cart[key] = {
+        item = {
             "product_id": product.id,
             "variant_id": variant.id if variant else None,
             "quantity": quantity,
         }
 
-    save_cart(request, cart)
+    cart.set(key, item)
     messages.success(request, "Товар добавлен в корзину")
 
     return redirect("product_detail", slug=product.slug)
@@ -108,19 +105,39 @@ def cart_add(request, product_id):
 # Cart detail (production-safe)
 # =========================
 
-def cart_detail(request):
-    cart = get_cart(request)
+def lines_cache_key(cart):
+    digest = hashlib.sha1(
+        json.dumps(sorted(cart.items()), sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+    return f"cart:lines:{digest}"
 
-    items = []
-    total = 0
-    cart_changed = False
+
+def cart_lines(store):
+    """
+    Позиции корзины с актуальными ценами и остатками — два запроса
+    (для корзины пользователя — ни одного сверх чтения корзины).
+    Недоступные позиции удаляются, количество урезается до остатка.
+
+    Результат проверки кэшируется по содержимому корзины и версиям её
+    товаров (products.cache): пока товары не менялись, повторная
+    проверка не нужна и в БД каталога не ходим.
+    """
+    cart = store.items()
 
     if not cart:
-        return render(request, "cart/cart_detail.html", {
-            "cart_items": [],
-            "total": 0,
-            "currency_symbol": "сом",
-        })
+        return [], 0
+
+    preloaded = store.preloaded()
+
+    if not preloaded:
+        lines = catalog_cache.get_cached(lines_cache_key(cart))
+        if lines is not None:
+            return lines
+
+    items = []
+    total = 0
+    removed = []
+    trimmed = {}
 
     product_ids = {item["product_id"] for item in cart.values()}
     variant_ids = {
@@ -129,26 +146,33 @@ def cart_detail(request):
         if item.get("variant_id")
     }
 
-    products = {
-        p.id: p
-        for p in Product.objects
-        .filter(id__in=product_ids, is_active=True)
-        .prefetch_related("images")
-    }
+    if preloaded:
+        # корзина пользователя читается сразу с товарами и вариантами
+        products, variants = preloaded
+    else:
+        # версии — до чтения товаров: изменение после чтения сбросит запись
+        token = catalog_cache.versions([(catalog_cache.PRODUCT, pk) for pk in product_ids])
+
+        products = {
+            p.id: p
+            for p in Product.objects
+            .filter(id__in=product_ids, is_active=True)
+            .select_related("primary_image")
+        }
 
-    variants = {
-        v.id: v
-        for v in Variant.objects
-        .filter(id__in=variant_ids)
-        .select_related("product")
-    }
+        variants = {
+            v.id: v
+            for v in Variant.objects
+            .filter(id__in=variant_ids)
+            .select_related("size", "color")
+            .annotate(available=inventory.available_expression())
+        }
 
     for key, item in list(cart.items()):
         product = products.get(item["product_id"])
 
         if not product:
-            cart.pop(key)
-            cart_changed = True
+            removed.append(key)
             continue
 
         variant = None
@@ -159,25 +183,23 @@ def cart_detail(request):
         if variant_id:
             variant = variants.get(variant_id)
 
-            if not variant or variant.stock <= 0:
-                cart.pop(key)
-                cart_changed = True
+            if not variant or variant.available <= 0:
+                removed.append(key)
                 continue
 
-            stock = variant.stock
+            stock = variant.available
 
         quantity = int(item.get("quantity", 1))
 
         if stock is not None and quantity > stock:
             quantity = stock
-            cart[key]["quantity"] = stock
-            cart_changed = True
+            trimmed[key] = {**item, "quantity": stock}
 
         price = product.price
         subtotal = price * quantity
         total += subtotal
 
-        main_image = product.images.first()
+        main_image = product.primary_image
 
         if variant:
             display_name = f"{product.name} ({variant.size or ''} {variant.color or ''})".strip()
@@ -186,21 +208,34 @@ def cart_detail(request):
 
         items.append({
             "key": key,
+            "product_id": product.id,
+            "variant_id": variant_id,
             "display_name": display_name,
             "quantity": quantity,
             "price": price,
             "subtotal": subtotal,
-            "main_image": main_image.image.url if main_image else None,
+            "main_image": rendition_url(main_image, "thumb") if main_image else None,
             "stock": stock if stock is not None else 9999,
         })
 
-    if cart_changed:
-        save_cart(request, cart)
+    # пишем только изменившиеся позиции
+    store.remove(*removed)
+    for key, item in trimmed.items():
+        store.set(key, item)
+
+    if not preloaded:
+        catalog_cache.set_cached(lines_cache_key(store.items()), token, (items, total))
+
+    return items, total
+
+
+def cart_detail(request):
+    items, total = cart_lines(get_cart_store(request))
 
     return render(request, "cart/cart_detail.html", {
         "cart_items": items,
         "total": total,
-        "currency_symbol": "сом",
+        "currency_symbol": CURRENCY_SYMBOL,
     })
 
 
@@ -210,7 +245,7 @@ def cart_detail(request):
 
 @require_POST
 def cart_update(request):
-    cart = get_cart(request)
+    cart = get_cart_store(request)
     key = request.POST.get("key")
 
     if not key or key not in cart:
@@ -222,11 +257,10 @@ def cart_update(request):
         return redirect("cart_detail")
 
     if quantity < 1:
-        cart.pop(key, None)
-        save_cart(request, cart)
+        cart.remove(key)
         return redirect("cart_detail")
 
-    item = cart[key]
+    item = cart.get(key)
 
     product = Product.objects.filter(
         id=item.get("product_id"),
@@ -234,8 +268,7 @@ def cart_update(request):
     ).first()
 
     if not product:
-        cart.pop(key)
-        save_cart(request, cart)
+        cart.remove(key)
         return redirect("cart_detail")
 
     variant_id = item.get("variant_id")
@@ -244,18 +277,16 @@ def cart_update(request):
         variant = Variant.objects.filter(
             id=variant_id,
             product_id=product.id
-        ).first()
+        ).annotate(available=inventory.available_expression()).first()
 
-        if not variant or variant.stock <= 0:
-            cart.pop(key)
-            save_cart(request, cart)
+        if not variant or variant.available <= 0:
+            cart.remove(key)
             return redirect("cart_detail")
 
-        if quantity > variant.stock:
-            quantity = variant.stock
+        if quantity > variant.available:
+            quantity = variant.available
 
-    cart[key]["quantity"] = quantity
-    save_cart(request, cart)
+    cart.set(key, {**item, "quantity": quantity})
 
     return redirect("cart_detail")
 
@@ -266,17 +297,292 @@ def cart_update(request):
 
 @require_POST
 def cart_remove(request):
-    cart = get_cart(request)
-    key = request.POST.get("key")
-
-    if key in cart:
-        cart.pop(key)
-        save_cart(request, cart)
+    get_cart_store(request).remove(request.POST.get("key"))
 
     return redirect("cart_detail")
 
 
 @require_POST
 def cart_clear(request):
-    save_cart(request, {})
+    get_cart_store(request).clear()
     return redirect("cart_detail")
+
+
+# =========================
+# JSON API
+# =========================
+#
+# GET  /cart/api/  — содержимое корзины и итоги.
+# POST /cart/api/  — несколько изменений одним запросом:
+#
+#   {
+#       "clear": true,
+#       "remove": ["variant_1", ...],
+#       "update": [{"key": "variant_2", "quantity": 3}, ...],
+#       "add": [{"product_id": 5, "variant_id": 7, "quantity": 1}, ...],
+#       "fragment": true
+#   }
+#
+# Остатки всех затронутых вариантов проверяются одним запросом. При ошибке
+# в любой строке ничего не сохраняется (400, "errors"). "fragment" (или
+# ?fragment=1) добавляет в ответ HTML таблицы корзины.
+
+API_MAX_LINES = 50
+
+
+def _api_int(value, minimum=None):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError
+    if minimum is not None and value < minimum:
+        raise ValueError
+    return value
+
+
+def parse_cart_changes(data):
+    """Разобрать тело POST: (изменения, ошибки)."""
+    changes = {
+        "clear": bool(data.get("clear")),
+        "remove": data.get("remove") or [],
+        "update": [],
+        "add": [],
+    }
+    errors = []
+
+    if not isinstance(changes["remove"], list) or not all(
+        isinstance(key, str) for key in changes["remove"]
+    ):
+        errors.append({"op": "remove", "error": "Ожидается список ключей"})
+        changes["remove"] = []
+
+    for op, fields in (
+        ("update", ("key", "quantity")),
+        ("add", ("product_id", "variant_id", "quantity")),
+    ):
+        lines = data.get(op) or []
+
+        if not isinstance(lines, list):
+            errors.append({"op": op, "error": "Ожидается список"})
+            continue
+
+        for index, line in enumerate(lines):
+            try:
+                if not isinstance(line, dict):
+                    raise ValueError
+
+                if op == "update":
+                    if not isinstance(line.get("key"), str):
+                        raise ValueError
+                    parsed = {
+                        "key": line["key"],
+                        "quantity": _api_int(line.get("quantity")),
+                    }
+                else:
+                    variant_id = line.get("variant_id")
+                    parsed = {
+                        "product_id": _api_int(line.get("product_id"), 1),
+                        "variant_id": None if variant_id is None else _api_int(variant_id, 1),
+                        "quantity": _api_int(line.get("quantity", 1), 1),
+                    }
+            except ValueError:
+                errors.append({
+                    "op": op,
+                    "index": index,
+                    "error": "Некорректная строка: нужны " + ", ".join(fields),
+                })
+                continue
+
+            changes[op].append(parsed)
+
+    total = len(changes["remove"]) + len(changes["update"]) + len(changes["add"])
+    if total > API_MAX_LINES:
+        errors.append({"op": None, "error": f"Не больше {API_MAX_LINES} строк за запрос"})
+
+    return changes, errors
+
+
+def apply_cart_changes(store, changes):
+    """
+    Применить изменения к корзине. Возвращает список ошибок;
+    если он не пуст — корзина не меняется.
+    """
+    current = store.items()
+    cart = {} if changes["clear"] else {key: dict(item) for key, item in current.items()}
+    errors = []
+
+    for key in changes["remove"]:
+        cart.pop(key, None)
+
+    updated = set()
+    for index, line in enumerate(changes["update"]):
+        key = line["key"]
+
+        if key not in cart:
+            errors.append({"op": "update", "index": index, "error": "Позиция не найдена"})
+            continue
+
+        if line["quantity"] < 1:
+            cart.pop(key)
+            continue
+
+        cart[key]["quantity"] = line["quantity"]
+        updated.add(key)
+
+    added = {}
+    for index, line in enumerate(changes["add"]):
+        if line["variant_id"]:
+            key = f"variant_{line['variant_id']}"
+        else:
+            key = f"product_{line['product_id']}"
+
+        if key not in cart:
+            cart[key] = {
+                "product_id": line["product_id"],
+                "variant_id": line["variant_id"],
+                "quantity": 0,
+            }
+        elif cart[key]["product_id"] != line["product_id"]:
+            errors.append({"op": "add", "index": index, "error": "Вариант товара не найден"})
+            continue
+
+        cart[key]["quantity"] += line["quantity"]
+        added[key] = index
+
+    # ----- одна проверка остатков на весь запрос -----
+
+    variant_ids = {
+        cart[key]["variant_id"]
+        for key in updated | set(added)
+        if key in cart and cart[key].get("variant_id")
+    }
+
+    variants = {
+        pk: (product_id, stock)
+        for pk, product_id, stock in Variant.objects
+        .filter(id__in=variant_ids, product__is_active=True)
+        .annotate(available=inventory.available_expression())
+        .values_list("id", "product_id", "available")
+    }
+
+    plain_ids = {cart[key]["product_id"] for key in added if not cart[key]["variant_id"]}
+    plain_products = dict(
+        Product.objects
+        .filter(id__in=plain_ids, is_active=True)
+        .annotate(variant_count=Count("variants"))
+        .values_list("id", "variant_count")
+    ) if plain_ids else {}
+
+    for key, index in added.items():
+        item = cart[key]
+        variant_id = item["variant_id"]
+
+        if variant_id:
+            product_id, stock = variants.get(variant_id, (None, 0))
+
+            if product_id != item["product_id"]:
+                error = "Вариант товара не найден"
+            elif item["quantity"] > stock:
+                error = f"Недостаточно на складе: только {stock} шт."
+            elif item["quantity"] > MAX_QUANTITY:
+                error = f"Не больше {MAX_QUANTITY} шт."
+            else:
+                continue
+        else:
+            if item["product_id"] not in plain_products:
+                error = "Товар не найден"
+            elif plain_products[item["product_id"]]:
+                error = "Выберите вариант товара"
+            elif item["quantity"] > MAX_QUANTITY:
+                error = f"Не больше {MAX_QUANTITY} шт."
+            else:
+                continue
+
+        errors.append({"op": "add", "index": index, "error": error})
+
+    for key in updated - set(added):
+        if key not in cart:
+            continue
+
+        # как cart_update: недоступное — убрать, лишнее — урезать
+        limit = MAX_QUANTITY
+        if cart[key].get("variant_id"):
+            _, stock = variants.get(cart[key]["variant_id"], (None, 0))
+            limit = min(limit, stock)
+
+        if limit <= 0:
+            cart.pop(key)
+        else:
+            cart[key]["quantity"] = min(cart[key]["quantity"], limit)
+
+    if errors:
+        return errors
+
+    # ----- запись только изменившихся позиций -----
+
+    if changes["clear"]:
+        store.clear()
+    else:
+        store.remove(*(key for key in current if key not in cart))
+
+    for key, item in cart.items():
+        if store.get(key) != item:
+            store.set(key, item)
+
+    return []
+
+
+def cart_response(request, store, fragment=False):
+    items, total = cart_lines(store)
+
+    data = {
+        "items": [
+            {
+                "key": item["key"],
+                "product_id": item["product_id"],
+                "variant_id": item["variant_id"],
+                "name": item["display_name"],
+                "quantity": item["quantity"],
+                "price": int(item["price"]),
+                "subtotal": int(item["subtotal"]),
+                "stock": item["stock"],
+                "image": item["main_image"],
+            }
+            for item in items
+        ],
+        "count": sum(item["quantity"] for item in items),
+        "total": int(total),
+    }
+
+    if fragment:
+        data["html"] = render_to_string("cart/cart_contents.html", {
+            "cart_items": items,
+            "total": total,
+            "currency_symbol": CURRENCY_SYMBOL,
+        }, request=request)
+
+    return JsonResponse(data)
+
+
+@require_http_methods(["GET", "POST"])
+def cart_api(request):
+    store = get_cart_store(request)
+
+    if request.method == "GET":
+        return cart_response(request, store, fragment=bool(request.GET.get("fragment")))
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict):
+        return JsonResponse({"errors": [{"op": None, "error": "Ожидается JSON-объект"}]}, status=400)
+
+    changes, errors = parse_cart_changes(data)
+
+    if not errors:
+        errors = apply_cart_changes(store, changes)
+
+    if errors:
+        return JsonResponse({"errors": errors}, status=400)
+
+    return cart_response(request, store, fragment=bool(data.get("fragment")))
@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'cart.storage.CartMiddleware',
 ]
 
 ROOT_URLCONF = 'clothes_shop.urls'
@@ -111,6 +112,37 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 SESSION_COOKIE_AGE = 1209600  # 2 недели для корзины
+
+# Хранилище корзины: session | redis | cookie (cart.storage)
+CART_STORE = env("CART_STORE", default="session")
+CART_REDIS_URL = env("CART_REDIS_URL", default="redis://localhost:6379/1")
+CART_COOKIE_NAME = "cart"
+CART_TTL = SESSION_COOKIE_AGE
+
+# Кэш каталога (products.cache). Версии записей сбрасывают и
+# manage.py-команды — кэш должен быть общим для всех процессов, поэтому
+# по умолчанию Redis; LocMem (свой в каждом процессе) — только с DEBUG.
+CACHE_URL = env("CACHE_URL", default="locmemcache://" if DEBUG else CART_REDIS_URL)
+CACHES = {"default": env.cache_url_config(CACHE_URL)}
+
+# Списание остатков при оформлении заказа: lock | optimistic (orders.checkout)
+ORDER_STOCK_ALLOCATION = env("ORDER_STOCK_ALLOCATION", default="lock")
+
+# Каталог
+CATALOG_CURSOR_PAGINATION = env.bool("CATALOG_CURSOR_PAGINATION", default=False)
+
+# Процессы Pillow для копий изображений (0 — генерировать в текущем процессе)
+IMAGE_RENDITION_WORKERS = env.int("IMAGE_RENDITION_WORKERS", default=2)
+
+# Дисковый кэш ресайза по запросу (/media/r/<w>x<h>/...)
+IMAGE_RESIZE_CACHE_DIR = BASE_DIR / 'cache' / 'resize'
+IMAGE_RESIZE_CACHE_MAX_BYTES = env.int("IMAGE_RESIZE_CACHE_MAX_BYTES", default=512 * 1024 * 1024)
+
+# Фиды для маркетплейсов (manage.py generate_feeds)
+FEEDS_DIR = BASE_DIR / 'feeds'
+
+# sitemap.xml и шарды (manage.py generate_sitemaps)
+SITEMAP_DIR = BASE_DIR / 'sitemaps'
 AUTH_USER_MODEL = "users.User"
 
 LOGIN_REDIRECT_URL = "home"
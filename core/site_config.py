@@ -8,6 +8,8 @@ SITE_DESCRIPTION = "Лучшая этно одежда по доступным 
 LOGO_PATH = "images/logo.png"  # Путь относительно static (замени файл под клиента)
 
 
+SITE_URL = "https://shop.kg"  # Адрес сайта для фидов и sitemap (без / на конце)
+
 EMAIL = "info@shop.kg"      # Для контактов и уведомлений
 PHONE = "+996 702 434 330"  # Телефон в футере
 
@@ -0,0 +1,272 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+
+from products import bestsellers, inventory
+from products.models import Product, StockMovement, Variant
+from .models import OrderItem
+
+
+# ==============================
+# Оформление заказа
+# ==============================
+#
+# Постоянное число запросов при любом размере корзины: 1 SELECT вариантов,
+# 1 SELECT товаров без вариантов, списание остатков, 2 INSERT.
+#
+# Списание — по настройке ORDER_STOCK_ALLOCATION:
+#
+#   lock       — варианты читаются SELECT ... FOR UPDATE, остатки списываются
+#                одним UPDATE ... CASE в той же транзакции. Покупатели одного
+#                варианта ждут друг друга до конца транзакции заказа.
+#   optimistic — без блокировок: каждая строка списывается условным
+#                UPDATE ... WHERE stock >= q сразу (autocommit). Если строке
+#                не хватило остатка или заказ не создался — уже списанное
+#                возвращается (компенсация). Работает и на SQLite, где
+#                FOR UPDATE игнорируется; CHECK (stock >= 0) поля
+#                PositiveIntegerField на Variant — страховка на уровне БД.
+#
+# Шардированные варианты (products.inventory, распродажи) в обоих режимах
+# не блокируются и списываются из StockShard условными UPDATE; их сводные
+# остатки пересчитываются после коммита заказа.
+#
+# Продажа пишется в журнал движений свёрнутой. Если не хватило остатка,
+# а в журнале варианта есть несвёрнутый приход (отмены, поступления),
+# он сворачивается и заказ пробуется ещё раз.
+
+LOCK = "lock"
+OPTIMISTIC = "optimistic"
+
+MAX_LINE_QUANTITY = 100
+
+
+class CheckoutError(Exception):
+    """Заказ не может быть оформлен — текст показывается покупателю."""
+
+
+class InsufficientStock(CheckoutError):
+
+    def __init__(self, message, variant_id):
+        super().__init__(message)
+        self.variant_id = variant_id
+
+
+def allocation_mode():
+    return getattr(settings, "ORDER_STOCK_ALLOCATION", LOCK)
+
+
+def parse_lines(cart):
+    lines = []
+
+    for item in cart.values():
+        quantity = int(item['quantity'])
+
+        if quantity <= 0 or quantity > MAX_LINE_QUANTITY:
+            raise CheckoutError('Некорректное количество')
+
+        lines.append((item, quantity))
+
+    return lines
+
+
+def load_variants(lines, lock):
+    ids = [item['variant_id'] for item, _ in lines if item.get('variant_id')]
+    variants = Variant.objects.select_related('product', 'size', 'color')
+
+    if not lock:
+        return {v.id: v for v in variants.filter(id__in=ids)}
+
+    # блокируем только строки вариантов, не товары/размеры/цвета;
+    # шардированные не блокируем — их остаток в StockShard
+    found = {
+        v.id: v
+        for v in variants
+        .filter(id__in=ids, stock_shards=0)
+        .select_for_update(of=('self',))
+    }
+
+    missing = set(ids) - set(found)
+    if missing:
+        found.update((v.id, v) for v in variants.filter(id__in=missing))
+
+    return found
+
+
+def sharded(variants):
+    """{id варианта: число шардов} шардированных вариантов."""
+    return {v.id: v.stock_shards for v in variants.values() if v.stock_shards}
+
+
+def load_products(lines):
+    product_ids = [item['product_id'] for item, _ in lines if not item.get('variant_id')]
+
+    if not product_ids:
+        return {}
+
+    return (
+        Product.objects
+        .filter(id__in=product_ids, is_active=True)
+        .in_bulk()
+    )
+
+
+def build_items(lines, variants, products):
+    """(данные OrderItem, сумма, {вариант: штук})"""
+    total = 0
+    order_items_data = []
+    quantities = {}
+
+    for item, quantity in lines:
+
+        if item.get('variant_id'):
+            variant = variants.get(item['variant_id'])
+
+            if not variant:
+                raise CheckoutError('Товар больше недоступен')
+
+            # у шардированного stock — сводка, остаток проверит списание
+            if not variant.stock_shards and variant.stock < quantity:
+                raise InsufficientStock(
+                    f'Недостаточно "{variant.product.name}" на складе', variant.id
+                )
+
+            quantities[variant.id] = quantity
+            product = variant.product
+
+        else:
+            product = products.get(item['product_id'])
+
+            if not product:
+                raise Http404('Товар не найден')
+
+            variant = None
+
+        price = product.price
+        total += price * quantity
+
+        variant_description = ""
+
+        if variant:
+            parts = []
+            if variant.size:
+                parts.append(str(variant.size))
+            if variant.color:
+                parts.append(str(variant.color))
+            variant_description = " / ".join(parts)
+
+        order_items_data.append({
+            'product': product,
+            'variant': variant,
+            'product_name': product.name,
+            'variant_description': variant_description,
+            'quantity': quantity,
+            'price': price,
+        })
+
+    return order_items_data, total, quantities
+
+
+def stock_changed(variants):
+    # stock изменён через update() — сигналы не срабатывают
+    inventory.stock_changed(v.product_id for v in variants.values() if not v.stock_shards)
+
+    # сводки «горячих» вариантов — после коммита, не продлевая транзакцию;
+    # сбой здесь не отменяет заказ (сводку поправит manage.py reconcile_stock)
+    sharded_ids = [v.id for v in variants.values() if v.stock_shards]
+    if sharded_ids:
+        transaction.on_commit(lambda: inventory.shards_changed(sharded_ids), robust=True)
+
+
+def out_of_stock(variants, error):
+    return InsufficientStock(
+        f'Недостаточно "{variants[error.variant_id].product.name}" на складе', error.variant_id
+    )
+
+
+def create_order(form, user, order_items_data, total, variants):
+    order = form.save(commit=False)
+    order.user = user
+    order.total_price = total
+    order.save()
+
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, **data)
+        for data in order_items_data
+    ])
+
+    # журнал: продажа уже списана — сразу свёрнутой
+    inventory.record_movements(
+        StockMovement.KIND_SALE,
+        {data['variant'].pk: -data['quantity'] for data in order_items_data if data['variant']},
+        order_id=order.pk,
+        folded=True,
+    )
+
+    stock_changed(variants)
+
+    bestsellers.record_sales(
+        (data['product'].pk, data['product'].category_id, data['quantity'])
+        for data in order_items_data
+    )
+
+    return order
+
+
+def place_order(form, user, cart, mode=None):
+    lines = parse_lines(cart)
+    place = _place_optimistic if (mode or allocation_mode()) == OPTIMISTIC else _place_locked
+
+    try:
+        return place(form, user, lines)
+    except InsufficientStock as e:
+        # остаток мог вернуться в журнал и ещё не свернуться
+        if not inventory.compact([e.variant_id]):
+            raise
+
+    return place(form, user, lines)
+
+
+def _place_locked(form, user, lines):
+    with transaction.atomic():
+        variants = load_variants(lines, lock=True)
+        order_items_data, total, quantities = build_items(lines, variants, load_products(lines))
+
+        shards = sharded(variants)
+
+        try:
+            # остатки проверены под блокировкой — списываем одним UPDATE ... CASE;
+            # условие stock >= q страхует от продажи, прошедшей мимо блокировки
+            # (SQLite не поддерживает SELECT ... FOR UPDATE)
+            inventory.adjust_stock({
+                pk: -quantity for pk, quantity in quantities.items() if pk not in shards
+            })
+
+            # шардированные — условными UPDATE шардов; отказ откатит транзакцию
+            inventory.reserve_stock(
+                {pk: quantities[pk] for pk in shards if pk in quantities},
+                shards,
+                key=user.pk,
+            )
+        except inventory.OutOfStock as e:
+            raise out_of_stock(variants, e)
+
+        return create_order(form, user, order_items_data, total, variants)
+
+
+def _place_optimistic(form, user, lines):
+    # снимок без блокировок: цены, названия и быстрый отказ
+    variants = load_variants(lines, lock=False)
+    order_items_data, total, quantities = build_items(lines, variants, load_products(lines))
+
+    try:
+        reserved = inventory.reserve_stock(quantities, sharded(variants), key=user.pk)
+    except inventory.OutOfStock as e:
+        raise out_of_stock(variants, e)
+
+    try:
+        with transaction.atomic():
+            return create_order(form, user, order_items_data, total, variants)
+    except BaseException:
+        inventory.release_stock(reserved)
+        stock_changed(variants)
+        raise
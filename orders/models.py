@@ -1,11 +1,11 @@
+from collections import defaultdict
+
 from django.db import models, transaction
-from django.db.models import F
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
-from products.models import *
-from django.apps import apps
-from django.contrib.auth import get_user_model
+from products.models import Product, StockMovement, Variant
+from products import bestsellers, inventory
 
 User = get_user_model()
 
@@ -62,105 +62,143 @@ class Order(models.Model):
     # ==============================
     # BUSINESS LOGIC
     # ==============================
-
-    from django.db import transaction
-    from django.db.models import F
+    #
+    # Переход статуса — один условный UPDATE ... WHERE status = <текущий>:
+    # из параллельных переходов проходит только один, без SELECT FOR UPDATE.
+    # save() сверяет статус и сумму со значениями на момент загрузки
+    # (from_db), а не с отдельным SELECT, и не перезаписывает их.
+
+    GUARDED_FIELDS = ("status", "total_price")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_guarded()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_guarded(fields)
+
+    def _remember_guarded(self, fields=None):
+        deferred = self.get_deferred_fields()
+        loaded = {
+            field: getattr(self, field)
+            for field in self.GUARDED_FIELDS
+            if field not in deferred and (fields is None or field in fields)
+        }
+
+        # частичный refresh_from_db обновляет только перечитанные поля
+        if fields is not None:
+            loaded = {**getattr(self, "_loaded_values", {}), **loaded}
+
+        self._loaded_values = loaded
 
     def mark_paid(self):
-        with transaction.atomic():
-            locked = (
-                Order.objects
-                .select_for_update()
-                .get(pk=self.pk)
-            )
-
-            locked._change_status(self.STATUS_PAID)
-
-            # синхронизация текущего объекта
-            self.status = locked.status
+        self._change_status(self.STATUS_PAID)
 
     def mark_shipped(self):
-        with transaction.atomic():
-            locked = (
-                Order.objects
-                .select_for_update()
-                .get(pk=self.pk)
-            )
-
-            locked._change_status(self.STATUS_SHIPPED)
-
-            self.status = locked.status
+        self._change_status(self.STATUS_SHIPPED)
 
     def cancel(self):
-        with transaction.atomic():
-            locked = (
-                Order.objects
-                .select_for_update()
-                .get(pk=self.pk)
-            )
-
-            if locked.status == self.STATUS_SHIPPED:
-                raise Exception("Нельзя отменить уже отправленный заказ")
+        if self.status == self.STATUS_SHIPPED:
+            raise Exception("Нельзя отменить уже отправленный заказ")
 
-            if locked.status == self.STATUS_CANCELLED:
-                raise Exception("Заказ уже отменён")
+        if self.status == self.STATUS_CANCELLED:
+            raise Exception("Заказ уже отменён")
 
-            for item in locked.items.select_related("variant"):
-                if item.variant:
-                    type(item.variant).objects.filter(pk=item.variant.pk).update(
-                        stock=F("stock") + item.quantity
-                    )
+        with transaction.atomic():
+            # остатки возвращает только выигравший переход
+            self._change_status(self.STATUS_CANCELLED)
 
-            locked._change_status(self.STATUS_CANCELLED)
+            self._restore_stock()
 
-            # синхронизируем текущий объект
-            self.status = locked.status
+            bestsellers.revert_sales(
+                self.items.values_list("product_id", "product__category_id", "quantity"),
+                timezone.localdate(self.created_at)
+            )
 
     def _restore_stock(self):
-        Variant = apps.get_model('products', 'Variant')
-        for item in self.items.select_related("variant"):
-            if item.variant:
-                Variant.objects.filter(pk=item.variant.pk).update(
-                    stock=F("stock") + item.quantity
-                )
+        deltas = defaultdict(int)
+        product_ids = set()
+
+        for variant_id, product_id, quantity in (
+            self.items
+            .filter(variant__isnull=False)
+            .values_list("variant_id", "variant__product_id", "quantity")
+        ):
+            deltas[variant_id] += quantity
+            product_ids.add(product_id)
+
+        # возврат на склад — приход в журнал одним INSERT, без UPDATE
+        # строк вариантов; в Variant.stock его свернёт inventory.compact
+        inventory.record_movements(StockMovement.KIND_CANCEL, deltas, order_id=self.pk)
+        inventory.stock_changed(product_ids)
 
     def _change_status(self, new_status):
-        if new_status not in self.ALLOWED_TRANSITIONS[self.status]:
+        old_status = self.status
+
+        if new_status not in self.ALLOWED_TRANSITIONS[old_status]:
             raise Exception(
-                f"Недопустимый переход: {self.status} → {new_status}"
+                f"Недопустимый переход: {old_status} → {new_status}"
             )
 
+        updated = (
+            Order.objects
+            .filter(pk=self.pk, status=old_status)
+            .update(status=new_status)
+        )
+
+        if not updated:
+            # статус успели изменить — проверяем переход по свежему
+            self.refresh_from_db(fields=["status"])
+
+            if self.status == old_status:
+                raise Order.DoesNotExist(f"Заказ #{self.pk} не найден")
+
+            return self._change_status(new_status)
+
         self.status = new_status
-        self._allow_status_change = True
-        self.save(update_fields=["status"])
-        self._allow_status_change = False
+        self._remember_guarded()
 
     def save(self, *args, **kwargs):
+        loaded = getattr(self, "_loaded_values", {})
+
         if self.pk:
-            old = (
-                Order.objects
-                .filter(pk=self.pk)
-                .values("status", "total_price")
-                .first()
-            )
+            old = loaded
 
-            if old:
-                old_status = old["status"]
-                old_total = old["total_price"]
+            # объект без снимка (поля были отложены) — сверяем с базой
+            if len(old) < len(self.GUARDED_FIELDS):
+                old = (
+                    Order.objects
+                    .filter(pk=self.pk)
+                    .values(*self.GUARDED_FIELDS)
+                    .first()
+                ) or {}
 
+            if old:
                 # защита статуса
-                if old_status != self.status:
-                    if not getattr(self, "_allow_status_change", False):
-                        raise Exception(
-                            "Нельзя менять статус напрямую. Используйте методы модели."
-                        )
+                if old["status"] != self.status:
+                    raise Exception(
+                        "Нельзя менять статус напрямую. Используйте методы модели."
+                    )
 
                 # защита total_price
-                if old_total != self.total_price:
+                if old["total_price"] != self.total_price:
                     raise Exception("Нельзя менять total_price напрямую.")
 
+                # не пишем их: устаревший объект не затрёт параллельный переход
+                if kwargs.get("update_fields") is None:
+                    kwargs["update_fields"] = [
+                        field.name
+                        for field in self._meta.concrete_fields
+                        if not field.primary_key and field.name not in self.GUARDED_FIELDS
+                    ]
+
         super().save(*args, **kwargs)
 
+        self._remember_guarded()
+
     def is_expired(self):
         if self.status != self.STATUS_NEW:
             return False
@@ -1,10 +1,18 @@
+import logging
+import random
 import threading
+import time
 from django.test import TransactionTestCase
 from django.contrib.auth import get_user_model
-from django.db import transaction
+from django.db import OperationalError, connection, transaction
+from products import inventory
 from products.models import Category, Product, Variant
+from orders.checkout import LOCK, OPTIMISTIC, CheckoutError, place_order
+from orders.forms import OrderCreateForm
 from orders.models import Order, OrderItem
 
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
 
@@ -74,4 +82,124 @@ class OrderConcurrencyTestCase(TransactionTestCase):
         for t in threads:
             t.join()
 
-        self.assertEqual(Order.objects.count(), 1000)
\ No newline at end of file
+        self.assertEqual(Order.objects.count(), 1000)
+
+
+class StockAllocationBenchmarkTestCase(TransactionTestCase):
+    """
+    Блокирующее (SELECT FOR UPDATE) и оптимистичное (условный UPDATE)
+    списание на одном «горячем» варианте: остатка хватает не всем,
+    перепродажи быть не должно. Время печатается для сравнения режимов
+    (на PostgreSQL разница видна лучше, чем на SQLite).
+    """
+
+    THREADS = 8
+    ORDERS_PER_THREAD = 10
+    STOCK = 50
+
+    def setUp(self):
+        # у каждого покупателя свой шард (по id пользователя)
+        self.users = [
+            User.objects.create_user(
+                email=f"bench{i}@test.com",
+                full_name="Bench User",
+                phone="123",
+                password="12345678"
+            )
+            for i in range(self.THREADS)
+        ]
+
+        category = Category.objects.create(name="Bench", slug="bench")
+
+        product = Product.objects.create(
+            name="Hot Product",
+            slug="hot-product",
+            description="desc",
+            price=1000,
+            category=category,
+            is_active=True
+        )
+
+        self.variant = Variant.objects.create(product=product, stock=self.STOCK)
+
+        self.cart = {
+            f"variant_{self.variant.id}": {
+                "product_id": product.id,
+                "variant_id": self.variant.id,
+                "quantity": 1,
+            }
+        }
+
+    def form(self):
+        form = OrderCreateForm({
+            "name": "Bench User",
+            "phone": "123",
+            "email": "bench@test.com",
+            "address": "Address",
+        })
+        form.is_valid()
+        return form
+
+    def buy(self, user, mode, results):
+        try:
+            for _ in range(self.ORDERS_PER_THREAD):
+                while True:
+                    try:
+                        place_order(self.form(), user, self.cart, mode=mode)
+                        results.append("ok")
+                    except CheckoutError:
+                        results.append("sold out")
+                    except OperationalError:
+                        # SQLite: база занята другим писателем — повторяем
+                        results.append("busy")
+                        time.sleep(random.uniform(0.001, 0.01))
+                        continue
+                    break
+        finally:
+            connection.close()
+
+    def run_mode(self, mode):
+        results = []
+        threads = [
+            threading.Thread(target=self.buy, args=(user, mode, results))
+            for user in self.users
+        ]
+
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        self.variant.refresh_from_db()
+        sold = results.count("ok")
+
+        label = f"{mode}, шардов: {self.variant.stock_shards}" if self.variant.stock_shards else mode
+        logger.debug(
+            "%s: %s заказов, %s отказов, %s повторов, %.3f с",
+            label, sold, results.count("sold out"), results.count("busy"), elapsed
+        )
+
+        # ни перепродажи, ни потерянных штук
+        self.assertGreaterEqual(self.variant.stock, 0)
+        self.assertEqual(self.variant.stock, self.STOCK - sold)
+        self.assertEqual(Order.objects.count(), sold)
+
+        return elapsed
+
+    def test_lock(self):
+        self.run_mode(LOCK)
+
+    def test_optimistic(self):
+        self.run_mode(OPTIMISTIC)
+
+    def test_sharded(self):
+        # покупатели списывают из разных строк StockShard
+        inventory.shard_stock([self.variant.pk], self.THREADS)
+        self.run_mode(OPTIMISTIC)
+
+        self.assertEqual(
+            sum(self.variant.shards.values_list("stock", flat=True)),
+            self.variant.stock
+        )
@@ -1,11 +1,18 @@
-from django.test import TestCase
+from unittest.mock import patch
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.urls import reverse
 from datetime import timedelta
 
+from orders import checkout
 from orders.models import Order, OrderItem
-from products.models import Product, Variant, Category
+from products import bestsellers, inventory
+from products.models import Color, Product, ProductSales, Size, StockMovement, Variant, Category
 
 User = get_user_model()
 
@@ -111,10 +118,24 @@ class OrderProductionTestCase(TestCase):
     # CANCEL LOGIC
     # ===============================
 
+    def available(self):
+        return (
+            Variant.objects
+            .annotate(available=inventory.available_expression())
+            .get(pk=self.variant.pk)
+        )
+
     def test_cancel_returns_stock(self):
         original_stock = self.variant.stock
 
         self.order.cancel()
+
+        # возврат — в журнале, снимок не тронут до сворачивания
+        variant = self.available()
+        self.assertEqual(variant.stock, original_stock)
+        self.assertEqual(variant.available, original_stock + self.item.quantity)
+
+        inventory.compact()
         self.variant.refresh_from_db()
 
         self.assertEqual(
@@ -136,6 +157,9 @@ class OrderProductionTestCase(TestCase):
         with self.assertRaises(Exception):
             self.order.cancel()
 
+        self.assertEqual(self.available().available, original_stock + self.item.quantity)
+
+        inventory.compact()
         self.variant.refresh_from_db()
 
         self.assertEqual(
@@ -213,4 +237,418 @@ class OrderProductionTestCase(TestCase):
             reverse("order_detail", args=[self.order.id])
         )
 
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class OrderStockSummaryTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="stock@test.com",
+            full_name="Stock User",
+            phone="123",
+            password="password123"
+        )
+
+        self.category = Category.objects.create(
+            name="Category",
+            slug="category"
+        )
+
+        self.product = Product.objects.create(
+            name="Product",
+            slug="product",
+            description="Desc",
+            price=1000,
+            is_active=True,
+            category=self.category
+        )
+
+        self.variant = Variant.objects.create(
+            product=self.product,
+            stock=10
+        )
+
+        self.client.force_login(self.user)
+
+    def create_order(self, quantity):
+        self.client.post(
+            reverse("cart_add", args=[self.product.id]),
+            {"variant_id": self.variant.id, "quantity": quantity}
+        )
+
+        self.client.post(reverse("order_create"), {
+            "name": "Name",
+            "phone": "123",
+            "email": "stock@test.com",
+            "address": "Address",
+        })
+
+        return Order.objects.get(user=self.user)
+
+    def test_checkout_and_cancel_update_available_stock(self):
+        order = self.create_order(3)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 7)
+
+        order.cancel()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 10)
+
+    def test_checkout_and_cancel_update_bestsellers(self):
+        order = self.create_order(3)
+
+        sales = ProductSales.objects.get(product=self.product)
+        self.assertEqual((sales.category_id, sales.units), (self.category.id, 3))
+        self.assertEqual(bestsellers.top_product_ids(self.category.id), [self.product.id])
+
+        order.cancel()
+
+        self.assertEqual(ProductSales.objects.get(product=self.product).units, 0)
+        self.assertEqual(bestsellers.top_product_ids(), [])
+
+
+class SetBasedCheckoutTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="batch@test.com",
+            full_name="Batch User",
+            phone="123",
+            password="password123"
+        )
+
+        self.category = Category.objects.create(name="Batch", slug="batch")
+        self.size = Size.objects.create(name="M")
+        self.color = Color.objects.create(name="Red")
+
+        self.client.force_login(self.user)
+
+    def make_lines(self, count, stock=10):
+        variants = []
+        for i in range(count):
+            product = Product.objects.create(
+                name=f"Product {i}",
+                slug=f"product-{count}-{i}",
+                description="d",
+                price=100,
+                category=self.category,
+                is_active=True
+            )
+            variants.append(Variant.objects.create(
+                product=product, size=self.size, color=self.color, stock=stock
+            ))
+        return variants
+
+    def checkout(self, variants, quantity=2):
+        self.client.post(reverse("cart_api"), {
+            "add": [
+                {"product_id": v.product_id, "variant_id": v.id, "quantity": quantity}
+                for v in variants
+            ]
+        }, content_type="application/json")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("order_create"), {
+                "name": "Name",
+                "phone": "123",
+                "email": "batch@test.com",
+                "address": "Address",
+            })
+
+        return response, queries
+
+    def test_statement_count_does_not_depend_on_cart_size(self):
+        _, small = self.checkout(self.make_lines(1))
+
+        # второй заказ — от другого покупателя, с корзиной побольше
+        self.user = User.objects.create_user(
+            email="batch2@test.com",
+            full_name="Batch User",
+            phone="123",
+            password="password123"
+        )
+        self.client.force_login(self.user)
+
+        variants = self.make_lines(5)
+        response, large = self.checkout(variants)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(large), len(small))
+
+        stock_updates = [q for q in large if q["sql"].startswith('UPDATE "products_variant"')]
+        self.assertEqual(len(stock_updates), 1)
+
+        for variant in variants:
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, 8)
+
+        order = Order.objects.get(user=self.user)
+        self.assertEqual(order.total_price, 5 * 2 * 100)
+        self.assertEqual(
+            set(order.items.values_list("variant_description", flat=True)),
+            {"M / Red"}
+        )
+
+    def test_checkout_folds_pending_returns(self):
+        variant = self.make_lines(2)[0]
+        Variant.objects.filter(pk=variant.pk).update(stock=1)
+        inventory.record_movements(StockMovement.KIND_CANCEL, {variant.pk: 5})
+
+        response, _ = self.checkout([variant], quantity=3)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Order.objects.filter(user=self.user).exists())
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 3)
+        self.assertEqual(
+            list(variant.movements.values_list("kind", "quantity", "folded").order_by("id")),
+            [
+                (StockMovement.KIND_RESTOCK, 10, True),
+                (StockMovement.KIND_CANCEL, 5, True),
+                (StockMovement.KIND_SALE, -3, True),
+            ]
+        )
+
+    def test_failed_line_leaves_stock_untouched(self):
+        variants = self.make_lines(2)
+
+        # второй строке не хватает остатка — первая не должна списаться
+        self.client.post(reverse("cart_api"), {
+            "add": [{"product_id": v.product_id, "variant_id": v.id, "quantity": 3} for v in variants]
+        }, content_type="application/json")
+        Variant.objects.filter(pk=variants[1].pk).update(stock=1)
+
+        self.client.post(reverse("order_create"), {
+            "name": "Name",
+            "phone": "123",
+            "email": "batch@test.com",
+            "address": "Address",
+        })
+
+        variants[0].refresh_from_db()
+        self.assertEqual(variants[0].stock, 10)
+        self.assertFalse(Order.objects.exists())
+
+    def test_concurrent_sale_after_check_is_insufficient_stock(self):
+        variants = self.make_lines(2)
+        build_items = checkout.build_items
+
+        def sold_meanwhile(*args):
+            # SQLite не блокирует строки: чужая продажа успевает
+            # между проверкой остатка и списанием
+            result = build_items(*args)
+            Variant.objects.filter(pk=variants[1].pk).update(stock=1)
+            return result
+
+        with patch("orders.checkout.build_items", side_effect=sold_meanwhile):
+            response, _ = self.checkout(variants, quantity=3)
+
+        self.assertRedirects(response, reverse("cart_detail"), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+        variants[0].refresh_from_db()
+        self.assertEqual(variants[0].stock, 10)
+
+
+@override_settings(ORDER_STOCK_ALLOCATION="optimistic")
+class OptimisticCheckoutTestCase(SetBasedCheckoutTestCase):
+
+    def test_statement_count_does_not_depend_on_cart_size(self):
+        variants = self.make_lines(3)
+        response, queries = self.checkout(variants)
+
+        self.assertEqual(response.status_code, 302)
+
+        # без блокировок, по условному UPDATE на строку
+        self.assertFalse([q for q in queries if "FOR UPDATE" in q["sql"]])
+        guarded = [
+            q for q in queries
+            if q["sql"].startswith('UPDATE "products_variant"') and '"stock" >=' in q["sql"]
+        ]
+        self.assertEqual(len(guarded), 3)
+
+        for variant in variants:
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, 8)
+
+        self.assertEqual(Order.objects.get(user=self.user).total_price, 3 * 2 * 100)
+
+    def test_reserve_releases_earlier_lines(self):
+        first, second = self.make_lines(2)
+        Variant.objects.filter(pk=second.pk).update(stock=1)
+
+        with self.assertRaises(inventory.OutOfStock) as error:
+            inventory.reserve_stock({first.pk: 3, second.pk: 3})
+
+        self.assertEqual(error.exception.variant_id, second.pk)
+
+        first.refresh_from_db()
+        self.assertEqual(first.stock, 10)
+
+    def test_stock_sold_out_after_snapshot(self):
+        variants = self.make_lines(2)
+
+        # остаток ушёл другому покупателю между чтением и списанием
+        reserve = inventory.reserve_stock
+
+        def sell_out(*args, **kwargs):
+            Variant.objects.filter(pk=variants[1].pk).update(stock=0)
+            return reserve(*args, **kwargs)
+
+        with patch("products.inventory.reserve_stock", sell_out):
+            response, _ = self.checkout(variants)
+
+        self.assertRedirects(response, reverse("cart_detail"), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+
+        variants[0].refresh_from_db()
+        self.assertEqual(variants[0].stock, 10)
+
+    def test_failed_order_returns_stock(self):
+        variants = self.make_lines(2)
+
+        with patch("orders.checkout.create_order", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout(variants)
+
+        for variant in variants:
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, 10)
+
+    def test_stock_cannot_go_negative(self):
+        variant, = self.make_lines(1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Variant.objects.filter(pk=variant.pk).update(stock=F("stock") - 11)
+
+
+class ShardedCheckoutTestCase(SetBasedCheckoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.variant, = self.make_lines(1, stock=8)
+        inventory.shard_stock([self.variant.pk], 4)
+
+    def test_statement_count_does_not_depend_on_cart_size(self):
+        # шардированная строка не блокируется и не списывается из Variant.stock
+        with self.captureOnCommitCallbacks(execute=True):
+            response, queries = self.checkout([self.variant])
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "products_variant"')])
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 6)
+        self.assertEqual(sum(self.variant.shards.values_list("stock", flat=True)), 6)
+
+    @override_settings(ORDER_STOCK_ALLOCATION="optimistic")
+    def test_optimistic_checkout_and_cancel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.checkout([self.variant], quantity=3)
+
+        order = Order.objects.get(user=self.user)
+        order.cancel()
+
+        # возврат ждёт сворачивания журнала
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+
+        inventory.compact()
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 8)
+        self.assertEqual(sum(self.variant.shards.values_list("stock", flat=True)), 8)
+
+    def test_sold_out_sharded_line(self):
+        response, _ = self.checkout([self.variant], quantity=9)
+
+        self.assertRedirects(response, reverse("cart_detail"), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(sum(self.variant.shards.values_list("stock", flat=True)), 8)
+
+
+class OrderStatusUpdateTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="status@test.com",
+            full_name="Status User",
+            phone="123",
+            password="password123"
+        )
+
+        self.order = Order.objects.create(
+            user=self.user,
+            name="Name",
+            phone="123",
+            email="status@test.com",
+            address="Address",
+            total_price=2000
+        )
+
+    def test_transition_is_one_conditional_update(self):
+        order = Order.objects.get(pk=self.order.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            order.mark_paid()
+
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith('UPDATE "orders_order"'))
+        self.assertIn('"status" =', queries[0]["sql"].split("WHERE")[1])
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.STATUS_PAID)
+
+    def test_save_does_not_reread_order(self):
+        order = Order.objects.get(pk=self.order.pk)
+        order.comment = "Позвонить заранее"
+
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"status"', queries[0]["sql"])
+
+        order.status = Order.STATUS_SHIPPED
+        with self.assertRaises(Exception):
+            order.save()
+
+    def test_stale_instance_does_not_overwrite_status(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        Order.objects.get(pk=self.order.pk).mark_paid()
+
+        stale.comment = "Изменено"
+        stale.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_PAID)
+        self.assertEqual(self.order.comment, "Изменено")
+
+    def test_refresh_from_db_updates_snapshot(self):
+        order = Order.objects.get(pk=self.order.pk)
+        Order.objects.get(pk=self.order.pk).mark_paid()
+
+        order.refresh_from_db()
+        order.address = "Новый адрес"
+        order.save()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_PAID)
+        self.assertEqual(self.order.address, "Новый адрес")
+
+    def test_concurrent_transition_is_rechecked(self):
+        stale = Order.objects.get(pk=self.order.pk)
+
+        shipped = Order.objects.get(pk=self.order.pk)
+        shipped.mark_paid()
+        shipped.mark_shipped()
+
+        # по устаревшему объекту отмена ещё разрешена, по базе — нет
+        with self.assertRaises(Exception):
+            stale.cancel()
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_SHIPPED)
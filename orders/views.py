@@ -1,12 +1,10 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.db import transaction
-from django.db.models import F
 from django.shortcuts import get_object_or_404
 
-from cart.views import get_cart, save_cart
-from products.models import Variant, Product
-from .models import Order, OrderItem
+from cart.storage import get_cart_store
+from .checkout import CheckoutError, place_order
+from .models import Order
 from .forms import OrderCreateForm
 from django.contrib.auth.decorators import login_required
 
@@ -17,7 +15,8 @@ from django.contrib.auth.decorators import login_required
 
 @login_required
 def order_create(request):
-    cart = get_cart(request)
+    store = get_cart_store(request)
+    cart = store.items()
 
     if not cart:
         messages.error(request, 'Корзина пуста')
@@ -27,103 +26,16 @@ def order_create(request):
         form = OrderCreateForm(request.POST, user=request.user)
 
         if form.is_valid():
-            with transaction.atomic():
-
-                # Собираем variant_ids
-                variant_ids = [
-                    item['variant_id']
-                    for item in cart.values()
-                    if item.get('variant_id')
-                ]
-
-                # LOCK variants
-                locked_variants = {
-                    v.id: v
-                    for v in Variant.objects.select_related('product')
-                    .filter(id__in=variant_ids)
-                    .select_for_update()
-                }
-
-                total = 0
-                order_items_data = []
-
-                for key, item in cart.items():
-
-                    quantity = int(item['quantity'])
-
-                    if quantity <= 0 or quantity > 100:
-                        messages.error(request, 'Некорректное количество')
-                        return redirect('cart_detail')
-
-                    if item.get('variant_id'):
-                        variant = locked_variants.get(item['variant_id'])
-
-                        if not variant:
-                            messages.error(request, 'Товар больше недоступен')
-                            return redirect('cart_detail')
-
-                        if variant.stock < quantity:
-                            messages.error(
-                                request,
-                                f'Недостаточно "{variant.product.name}" на складе'
-                            )
-                            return redirect('cart_detail')
-
-                        price = variant.product.price
-
-                        # списание stock
-                        Variant.objects.filter(id=variant.id).update(
-                            stock=F('stock') - quantity
-                        )
-
-                        product = variant.product
-
-                    else:
-                        product = get_object_or_404(
-                            Product,
-                            id=item['product_id'],
-                            is_active=True
-                        )
-                        price = product.price
-                        variant = None
-
-                    total += price * quantity
-
-                    variant_description = ""
-
-                    if variant:
-                        parts = []
-                        if variant.size:
-                            parts.append(str(variant.size))
-                        if variant.color:
-                            parts.append(str(variant.color))
-                        variant_description = " / ".join(parts)
-
-                    order_items_data.append({
-                        'product': product,
-                        'variant': variant,
-                        'product_name': product.name,
-                        'variant_description': variant_description,
-                        'quantity': quantity,
-                        'price': price,
-                    })
-
-                # создаём заказ
-                order = form.save(commit=False)
-                order.user = request.user
-                order.total_price = total
-                order.save()
-
-                # создаём items
-                OrderItem.objects.bulk_create([
-                    OrderItem(order=order, **data)
-                    for data in order_items_data
-                ])
-
-                # очищаем корзину
-                save_cart(request, {})
-
-                return redirect('order_success', order_id=order.id)
+            try:
+                order = place_order(form, request.user, cart)
+            except CheckoutError as e:
+                messages.error(request, str(e))
+                return redirect('cart_detail')
+
+            # очищаем корзину
+            store.clear()
+
+            return redirect('order_success', order_id=order.id)
 
     else:
         form = OrderCreateForm(user=request.user)
@@ -1,6 +1,58 @@
+import json
+
+from django import forms
 from django.contrib import admin
+from django.contrib import messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Prefetch
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from .models import Category, Product, ProductImage, Color, Size, Variant
+
+from . import inventory
+from .images import rendition_url
+from .models import Category, Product, ProductImage, Color, Size, StockMovement, Variant
+
+
+# ==============================
+# Пагинация больших таблиц
+# ==============================
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Точный COUNT только до exact_limit строк (подзапрос с LIMIT),
+    дальше — оценка планировщика PostgreSQL по EXPLAIN.
+    На других СУБД оценки нет — полный COUNT, иначе страницы
+    дальше exact_limit недоступны.
+    """
+
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limited = queryset.values("pk")[:self.exact_limit + 1].count()
+
+        if limited <= self.exact_limit:
+            return limited
+
+        estimate = self.estimate(queryset)
+
+        if estimate is None:
+            return queryset.count()
+
+        return max(estimate, limited)
+
+    @staticmethod
+    def estimate(queryset):
+        if connections[queryset.db].vendor != "postgresql":
+            return None
+
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        return int(plan[0]["Plan"]["Plan Rows"])
 
 
 @admin.register(Category)
@@ -13,7 +65,7 @@ class CategoryAdmin(admin.ModelAdmin):
         if obj.image:
             return format_html(
                 '<img src="{}" style="height:60px; border-radius:8px;" />',
-                obj.image.url
+                rendition_url(obj, "thumb")
             )
         return "(Нет фото)"
 
@@ -29,26 +81,237 @@ class ProductImageInline(admin.TabularInline):
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="height: 100px;" />', obj.image.url)
+            return format_html('<img src="{}" style="height: 100px;" />', rendition_url(obj, "thumb"))
         return "(Нет фото)"
     image_preview.short_description = 'Превью'
 
 
+class VariantInlineForm(forms.ModelForm):
+    """
+    Остаток в инлайне — доступный (снимок + несвёрнутый журнал), как
+    в массовом редакторе. Правка существующего варианта применяется
+    разницей через inventory.bulk_edit (ProductAdmin.save_formset),
+    новый вариант создаётся с введённым остатком.
+    """
+
+    available = forms.IntegerField(label='Доступно', min_value=0, initial=0)
+    initial_available = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Variant
+        fields = ['color', 'size']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if self.instance.pk:
+            available = self.instance.stock + getattr(self.instance, 'pending', 0)
+            self.fields['available'].initial = available
+            self.fields['initial_available'].initial = available
+
+    def save(self, commit=True):
+        variant = super().save(commit=False)
+
+        if not variant.pk:
+            variant.stock = self.cleaned_data['available']
+            if commit:
+                variant.save()
+        elif commit:
+            # stock не пишем: загруженный снимок мог устареть (продажи)
+            variant.save(update_fields=['color', 'size'])
+
+        return variant
+
+
 class VariantInline(admin.TabularInline):
     model = Variant
+    form = VariantInlineForm
     extra = 1
-    fields = ['color', 'size', 'stock']
+    fields = ['color', 'size', 'available', 'initial_available', 'stock_shards']
+    readonly_fields = ['stock_shards']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(pending=inventory.pending_subquery())
 
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'is_active']
+    list_display = ['name', 'category', 'price', 'available_stock', 'is_active']
     list_filter = ['category', 'is_active']
+    list_select_related = ['category']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     inlines = [ProductImageInline, VariantInline]
     readonly_fields = ['created_at']
 
+    # без второго COUNT(*) по всей таблице при фильтрации
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    change_list_template = 'admin/products/product/change_list.html'
+
+    bulk_edit_per_page = 50
+
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+
+        if formset.model is not Variant:
+            return
+
+        # изменённый доступный остаток — разницей, как массовый редактор
+        stocks = {
+            variant_form.instance.pk: (
+                variant_form.cleaned_data['initial_available'],
+                variant_form.cleaned_data['available'],
+            )
+            for variant_form in formset.forms
+            if variant_form not in formset.deleted_forms
+            and variant_form.cleaned_data.get('initial_available') is not None
+        }
+
+        result = inventory.bulk_edit(stocks, {})
+
+        if result['conflicts']:
+            self.message_user(
+                request,
+                'Остаток изменился с момента открытия страницы, не сохранён: '
+                + ', '.join(str(obj) for obj in result['conflicts']),
+                level=messages.WARNING
+            )
+
+    def get_urls(self):
+        return [
+            path(
+                'bulk-stock/',
+                self.admin_site.admin_view(self.bulk_stock_view),
+                name='products_product_bulk_stock',
+            ),
+        ] + super().get_urls()
+
+    # ===== Массовая правка остатков и цен =====
+
+    def bulk_stock_queryset(self, request):
+        queryset = (
+            Product.objects
+            .select_related('category')
+            .only('id', 'name', 'price', 'category__name')
+            .prefetch_related(
+                Prefetch(
+                    'variants',
+                    queryset=Variant.objects
+                    .select_related('color', 'size')
+                    .only('id', 'product', 'stock', 'color__name', 'size__name')
+                    # доступный остаток: снимок + несвёрнутый журнал
+                    .annotate(available=F('stock') + inventory.pending_subquery())
+                    .order_by('size_id', 'color_id', 'id')
+                )
+            )
+            .order_by('category_id', 'name', 'id')
+        )
+
+        category = request.GET.get('category')
+        if category and category.isdigit():
+            queryset = queryset.filter(category_id=category)
+
+        query = request.GET.get('q', '').strip()
+        if query:
+            queryset = queryset.filter(name__icontains=query)
+
+        return queryset
+
+    @staticmethod
+    def parse_bulk_stock(data):
+        """{id: (показанное, новое)} для полей stock-<id> / price-<id>."""
+        stocks, prices, errors = {}, {}, []
+
+        for key, value in data.items():
+            kind, _, pk = key.partition('-')
+            if kind not in ('stock', 'price') or not pk.isdigit():
+                continue
+
+            try:
+                new = int(value)
+                shown = int(data.get(f'initial-{key}', ''))
+            except ValueError:
+                errors.append(key)
+                continue
+
+            if new < 0:
+                errors.append(key)
+                continue
+
+            (stocks if kind == 'stock' else prices)[int(pk)] = (shown, new)
+
+        return stocks, prices, errors
+
+    def bulk_stock_view(self, request):
+        if not self.has_change_permission(request):
+            return redirect('admin:index')
+
+        if request.method == 'POST':
+            stocks, prices, errors = self.parse_bulk_stock(request.POST)
+
+            if errors:
+                self.message_user(
+                    request,
+                    f'Некорректные значения: {len(errors)}. Ничего не сохранено.',
+                    level=messages.ERROR
+                )
+            else:
+                result = inventory.bulk_edit(stocks, prices)
+
+                self.message_user(
+                    request,
+                    f"Сохранено вариантов: {result['variants']}, цен: {result['products']}."
+                )
+                if result['conflicts']:
+                    self.message_user(
+                        request,
+                        'Изменились с момента открытия страницы, не сохранены: '
+                        + ', '.join(str(obj) for obj in result['conflicts']),
+                        level=messages.WARNING
+                    )
+
+            return redirect(request.get_full_path())
+
+        paginator = EstimatedCountPaginator(
+            self.bulk_stock_queryset(request),
+            self.bulk_edit_per_page
+        )
+        page = paginator.get_page(request.GET.get('page'))
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Остатки и цены',
+            'opts': self.model._meta,
+            'page': page,
+            'categories': Category.objects.only('id', 'name').order_by('name'),
+            'category': request.GET.get('category', ''),
+            'query': request.GET.get('q', ''),
+        }
+
+        return TemplateResponse(request, 'admin/products/product/bulk_stock.html', context)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """Журнал движений остатков — только просмотр."""
+
+    list_display = ['created_at', 'variant', 'kind', 'quantity', 'order_id', 'folded']
+    list_filter = ['kind', 'folded']
+    list_select_related = ['variant__product', 'variant__size', 'variant__color']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 admin.site.register(Color)
 admin.site.register(Size)
@@ -0,0 +1,164 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import Product, ProductSales
+
+
+# ==============================
+# Хиты продаж
+# ==============================
+#
+# ProductSales — проданные штуки товара за день. Строки обновляются
+# при оформлении заказа (+) и его отмене (−), поэтому рейтинг за 7/30 дней —
+# сумма по ≤30 дням маленькой таблицы по индексу (category, day), а не
+# GROUP BY по всем OrderItem. Готовый top-N кэшируется по версии
+# catalog_cache.SALES, которую сбрасывает продажа в категории.
+# manage.py rebuild_bestsellers пересчитывает таблицу с нуля и удаляет
+# устаревшие дни.
+
+WINDOWS = (7, 30)
+KEEP_DAYS = max(WINDOWS)
+TOP_N = 8
+
+
+def _bump(category_ids):
+    catalog_cache.bump(
+        [(catalog_cache.SALES, "all")]
+        + [(catalog_cache.SALES, pk) for pk in set(category_ids)]
+    )
+
+
+def _add_units(day, units):
+    """{товар: ±штук} за день — одним UPDATE ... CASE."""
+    ProductSales.objects.filter(product_id__in=units, day=day).update(
+        units=F("units") + Case(
+            *[When(product_id=pk, then=Value(quantity)) for pk, quantity in units.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def record_sales(items, day=None):
+    """items — (product_id, category_id, штук) проданных позиций."""
+    day = day or timezone.localdate()
+
+    units = defaultdict(int)
+    categories = {}
+
+    for product_id, category_id, quantity in items:
+        if product_id is None:
+            continue
+        units[product_id] += quantity
+        categories[product_id] = category_id
+
+    if not units:
+        return
+
+    # строки дня создаются один раз, дальше — атомарный инкремент
+    ProductSales.objects.bulk_create(
+        [
+            ProductSales(product_id=pk, category_id=categories[pk], day=day)
+            for pk in units
+        ],
+        ignore_conflicts=True,
+    )
+
+    _add_units(day, units)
+
+    _bump(categories.values())
+
+
+def revert_sales(items, day):
+    """Отмена заказа от дня day: вычесть проданные штуки."""
+    if day < timezone.localdate() - timedelta(days=KEEP_DAYS):
+        return
+
+    units = defaultdict(int)
+    categories = set()
+
+    for product_id, category_id, quantity in items:
+        if product_id is None:
+            continue
+        units[product_id] += quantity
+        categories.add(category_id)
+
+    if units:
+        _add_units(day, {pk: -quantity for pk, quantity in units.items()})
+        _bump(categories)
+
+
+def top_product_ids(category_id=None, limit=TOP_N):
+    """
+    Хиты по продажам за 7 дней, при равенстве (в т.ч. нулевых) — за 30.
+    Оба окна считаются одним запросом.
+    """
+    today = timezone.localdate()
+    week, month = (today - timedelta(days=days - 1) for days in WINDOWS)
+
+    rows = ProductSales.objects.filter(day__gte=month)
+
+    if category_id is not None:
+        rows = rows.filter(category_id=category_id)
+
+    return list(
+        rows
+        .values("product_id")
+        .annotate(
+            week=Sum("units", filter=Q(day__gte=week), default=0),
+            month=Sum("units"),
+        )
+        .filter(month__gt=0)
+        .order_by("-week", "-month", "product_id")
+        .values_list("product_id", flat=True)[:limit]
+    )
+
+
+# ==============================
+# Полный пересчёт
+# ==============================
+
+def rebuild(days=KEEP_DAYS):
+    from orders.models import Order, OrderItem
+
+    since = timezone.localdate() - timedelta(days=days - 1)
+
+    totals = defaultdict(int)
+    for product_id, created_at, quantity in (
+        OrderItem.objects
+        .filter(product__isnull=False, order__created_at__date__gte=since)
+        .exclude(order__status=Order.STATUS_CANCELLED)
+        .values_list("product_id", "order__created_at", "quantity")
+        .iterator(chunk_size=5000)
+    ):
+        totals[product_id, timezone.localdate(created_at)] += quantity
+
+    categories = dict(
+        Product.objects
+        .filter(pk__in={product_id for product_id, _ in totals})
+        .values_list("id", "category_id")
+    )
+
+    with transaction.atomic():
+        ProductSales.objects.all().delete()
+        ProductSales.objects.bulk_create(
+            [
+                ProductSales(
+                    product_id=product_id,
+                    category_id=categories[product_id],
+                    day=day,
+                    units=units,
+                )
+                for (product_id, day), units in totals.items()
+            ],
+            batch_size=1000,
+        )
+
+        catalog_cache.bump_catalog()
+
+    return len(totals)
@@ -0,0 +1,120 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+# ==============================
+# Версии каталога
+# ==============================
+#
+# Каждая запись кэша хранит версии товаров/категорий, из которых она
+# собрана. Изменение товара или категории увеличивает версию —
+# все зависящие записи становятся невалидными без явного удаления.
+#
+# Версии читаются ДО запроса к БД (versions) и передаются в set_cached:
+# если изменение зафиксировали между запросом и записью в кэш, запись
+# получит старую версию и сразу станет невалидной.
+#
+# Версии сбрасывают и manage.py-команды (импорт, сворачивание журнала,
+# популярность, ...) — кэш должен быть общим для процессов (CACHES в
+# settings: Redis; LocMem — только для разработки в одном процессе).
+
+CATALOG_CACHE_TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", 60 * 60 * 24)
+
+PRODUCT = "product"
+CATEGORY = "category"
+CATALOG = "catalog"
+SALES = "sales"  # хиты продаж категории, см. products.bestsellers
+
+
+def version_key(kind, pk):
+    return f"catalog:{kind}:{pk}:v"
+
+
+def _new_version():
+    # уникальное начальное значение: если ключ версии вытеснен из кэша,
+    # старые записи не совпадут с новой версией
+    return time.time_ns()
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def bump(refs):
+    keys = [version_key(kind, pk) for kind, pk in refs if pk is not None]
+
+    if not keys:
+        return
+
+    _bump(keys)
+    # повторно после коммита: читатель мог закэшировать старые данные
+    # между первым bump и фиксацией транзакции
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def bump_products(product_ids):
+    bump((PRODUCT, pk) for pk in set(product_ids))
+
+
+def bump_categories(category_ids):
+    bump((CATEGORY, pk) for pk in set(category_ids))
+
+
+def bump_catalog():
+    bump([(CATALOG, "all")])
+
+
+def _current_versions(keys):
+    versions = cache.get_many(keys)
+
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        value = _new_version()
+        # add — чтобы не перетереть версию, выставленную параллельно
+        if not cache.add(key, value, None):
+            value = cache.get(key)
+        versions[key] = value
+
+    return versions
+
+
+# ==============================
+# Чтение / запись
+# ==============================
+
+def get_cached(key):
+    entry = cache.get(key)
+
+    if entry is None:
+        return None
+
+    versions, value = entry
+
+    if cache.get_many(list(versions)) != versions:
+        return None
+
+    return value
+
+
+def versions(refs, token=None):
+    """
+    Текущие версии refs (и всего каталога) — брать до запроса к БД.
+    token — ранее полученные версии: зависимости, известные только после
+    первого запроса (id товаров), добавляются перед следующим запросом.
+    """
+    keys = [version_key(kind, pk) for kind, pk in [*refs, (CATALOG, "all")]]
+    token = dict(token or {})
+    token.update(_current_versions([key for key in keys if key not in token]))
+    return token
+
+
+def set_cached(key, token, value):
+    """token — versions(), полученные до чтения value из БД."""
+    cache.set(key, (token, value), CATALOG_CACHE_TIMEOUT)
@@ -0,0 +1,204 @@
+from . import cache as catalog_cache
+from . import inventory
+from . import sorting
+from .models import Product, Variant, Size, Color
+
+
+# ==============================
+# Фасеты категории
+# ==============================
+#
+# Для категории строится индекс: товары в порядке выдачи по умолчанию
+# (плюс перестановки позиций для остальных сортировок) и для каждого
+# значения фасета — битовая маска позиций товаров. Пересечение фильтров
+# и счётчики «M (14)» считаются в памяти. Индекс хранится в кэше каталога
+# с версией категории, поэтому перестраивается только для категории,
+# в которой изменились товары или варианты.
+
+PRICE_BUCKETS = [
+    (None, 1000),
+    (1000, 3000),
+    (3000, 5000),
+    (5000, 10000),
+    (10000, None),
+]
+
+FACETS = ("size", "color", "price", "in_stock")
+
+
+def price_bucket(price):
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        if (low is None or price >= low) and (high is None or price < high):
+            return index
+    return None
+
+
+def price_label(index):
+    low, high = PRICE_BUCKETS[index]
+    if low is None:
+        return f"до {high}"
+    if high is None:
+        return f"от {low}"
+    return f"{low} – {high}"
+
+
+def iter_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class FacetIndex:
+
+    def __init__(self, product_ids, masks, labels, orders=None):
+        self.product_ids = product_ids
+        self.all = (1 << len(product_ids)) - 1
+        self.masks = masks      # {facet: {value: mask}}
+        self.labels = labels    # {facet: {value: label}}
+        self.orders = orders or {}  # {sort: [позиции в порядке сортировки]}
+
+    def _union(self, facet, values):
+        mask = 0
+        for value in values:
+            mask |= self.masks[facet].get(value, 0)
+        return mask
+
+    def select(self, filters, exclude=None):
+        mask = self.all
+        for facet, values in filters.items():
+            if facet != exclude and values:
+                mask &= self._union(facet, values)
+        return mask
+
+    def product_ids_for(self, filters, sort=sorting.DEFAULT_SORT):
+        mask = self.select(filters)
+
+        if sort not in self.orders:
+            return [self.product_ids[i] for i in iter_bits(mask)]
+
+        return [self.product_ids[i] for i in self.orders[sort] if mask >> i & 1]
+
+    def counts(self, filters):
+        """
+        Счётчики значений фасетов. Для значения фасета учитываются
+        фильтры всех остальных фасетов (выбор внутри фасета — «ИЛИ»).
+        """
+        result = {}
+
+        for facet in FACETS:
+            base = self.select(filters, exclude=facet)
+            selected = filters.get(facet, set())
+            options = []
+
+            for value, label in self.labels[facet].items():
+                count = (base & self.masks[facet].get(value, 0)).bit_count()
+                if count or value in selected:
+                    options.append({
+                        "value": value,
+                        "label": label,
+                        "count": count,
+                        "selected": value in selected,
+                    })
+
+            result[facet] = options
+
+        return result
+
+
+def build_facet_index(category_id):
+    products = list(
+        Product.objects
+        .filter(category_id=category_id, is_active=True)
+        .order_by(*sorting.ordering(sorting.DEFAULT_SORT))
+        .values_list("id", "price", "available_stock", "popularity")
+    )
+
+    position = {pk: i for i, (pk, _, _, _) in enumerate(products)}
+    masks = {facet: {} for facet in FACETS}
+
+    for pk, price, available_stock, _ in products:
+        bit = 1 << position[pk]
+
+        bucket = price_bucket(price)
+        if bucket is not None:
+            masks["price"][bucket] = masks["price"].get(bucket, 0) | bit
+
+        if available_stock > 0:
+            masks["in_stock"][1] = masks["in_stock"].get(1, 0) | bit
+
+    # размер/цвет — только варианты в наличии (снимок + несвёрнутый журнал)
+    variants = (
+        Variant.objects
+        .filter(product__category_id=category_id, product__is_active=True)
+        .alias(available=inventory.available_expression())
+        .filter(available__gt=0)
+        .values_list("product_id", "size_id", "color_id")
+    )
+
+    for product_id, size_id, color_id in variants:
+        if product_id not in position:
+            continue
+
+        bit = 1 << position[product_id]
+        if size_id:
+            masks["size"][size_id] = masks["size"].get(size_id, 0) | bit
+        if color_id:
+            masks["color"][color_id] = masks["color"].get(color_id, 0) | bit
+
+    labels = {
+        "size": dict(
+            Size.objects.filter(id__in=masks["size"]).order_by("id").values_list("id", "name")
+        ),
+        "color": dict(
+            Color.objects.filter(id__in=masks["color"]).order_by("name").values_list("id", "name")
+        ),
+        "price": {i: price_label(i) for i in range(len(PRICE_BUCKETS))},
+        "in_stock": {1: "В наличии"},
+    }
+
+    # порядок по умолчанию совпадает с позициями, остальные — перестановки
+    columns = {"price": 1, "popularity": 3}
+    orders = {}
+
+    for sort in sorting.SORTS:
+        if sort == sorting.DEFAULT_SORT:
+            continue
+
+        field, descending = sorting.sort_field(sort)
+        orders[sort] = sorted(
+            range(len(products)),
+            key=lambda i: (products[i][columns[field]], products[i][0]),
+            reverse=descending
+        )
+
+    return FacetIndex([pk for pk, _, _, _ in products], masks, labels, orders)
+
+
+def get_facet_index(category_id):
+    key = f"catalog:facet_index:{category_id}"
+    index = catalog_cache.get_cached(key)
+
+    if index is None:
+        token = catalog_cache.versions([(catalog_cache.CATEGORY, category_id)])
+        index = build_facet_index(category_id)
+        catalog_cache.set_cached(key, token, index)
+
+    return index
+
+
+def parse_filters(params):
+    """GET-параметры (?size=1&size=2&price=0&in_stock=1) → {facet: {int}}."""
+    filters = {}
+
+    for facet in FACETS:
+        values = set()
+        for raw in params.getlist(facet):
+            try:
+                values.add(int(raw))
+            except (TypeError, ValueError):
+                continue
+        if values:
+            filters[facet] = values
+
+    return filters
@@ -0,0 +1,387 @@
+import csv
+import io
+import json
+import os
+import re
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from core import site_config
+
+from . import inventory
+from .models import Category, Product, Variant
+
+
+# ==============================
+# Фиды для маркетплейсов
+# ==============================
+#
+# Один оффер — один вариант товара (group_id — товар). Товары читаются
+# блоками по id через iterator(), в памяти только текущий блок.
+#
+# Для инкрементальной генерации рядом с фидом лежит файл фрагментов
+# (<feed>.parts: id товара → готовый текст офферов) и время прошлого
+# запуска. Заново рендерятся только товары с updated_at позже него,
+# остальные фрагменты переносятся из прошлого файла.
+
+CHUNK_SIZE = 1000
+
+CONTROL_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def feeds_dir():
+    return str(getattr(settings, "FEEDS_DIR", settings.BASE_DIR / "feeds"))
+
+
+def absolute_url(path):
+    return site_config.SITE_URL + path
+
+
+def _xml(value):
+    return escape(CONTROL_CHARS_RE.sub("", str(value)))
+
+
+# ==============================
+# Форматы
+# ==============================
+
+class YmlFeed:
+    """Яндекс.Маркет (YML)."""
+
+    extension = "yml"
+    content_type = "application/xml; charset=utf-8"
+
+    def header(self, categories):
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            f'<yml_catalog date="{timezone.now():%Y-%m-%dT%H:%M}">',
+            "<shop>",
+            f"<name>{_xml(site_config.SITE_NAME)}</name>",
+            f"<company>{_xml(site_config.SITE_NAME)}</company>",
+            f"<url>{_xml(site_config.SITE_URL)}</url>",
+            "<currencies>",
+            f'<currency id="{site_config.CURRENCY_CODE}" rate="1"/>',
+            "</currencies>",
+            "<categories>",
+        ]
+        lines += [
+            f'<category id="{pk}">{_xml(name)}</category>'
+            for pk, name in categories
+        ]
+        lines += ["</categories>", "<offers>", ""]
+        return "\n".join(lines)
+
+    def offers(self, product, variants):
+        parts = []
+
+        for variant in variants:
+            lines = [
+                f'<offer id="{variant["id"]}" group_id="{product["id"]}" '
+                f'available="{"true" if variant["stock"] > 0 else "false"}">',
+                f"<url>{_xml(product['url'])}</url>",
+                f"<price>{product['price']}</price>",
+                f"<currencyId>{site_config.CURRENCY_CODE}</currencyId>",
+                f"<categoryId>{product['category_id']}</categoryId>",
+            ]
+            if product["picture"]:
+                lines.append(f"<picture>{_xml(product['picture'])}</picture>")
+            lines += [
+                f"<name>{_xml(product['name'])}</name>",
+                f"<description>{_xml(product['description'])}</description>",
+            ]
+            if variant["color_name"]:
+                lines.append(f'<param name="Цвет">{_xml(variant["color_name"])}</param>')
+            if variant["size_name"]:
+                lines.append(f'<param name="Размер">{_xml(variant["size_name"])}</param>')
+            lines += [f"<count>{variant['stock']}</count>", "</offer>", ""]
+            parts.append("\n".join(lines))
+
+        return "".join(parts)
+
+    def footer(self):
+        return "</offers>\n</shop>\n</yml_catalog>\n"
+
+
+class GoogleFeed:
+    """Google Merchant Center (RSS 2.0)."""
+
+    extension = "xml"
+    content_type = "application/xml; charset=utf-8"
+
+    def header(self, categories):
+        return "\n".join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">',
+            "<channel>",
+            f"<title>{_xml(site_config.SITE_NAME)}</title>",
+            f"<link>{_xml(site_config.SITE_URL)}</link>",
+            f"<description>{_xml(site_config.SITE_DESCRIPTION)}</description>",
+            "",
+        ])
+
+    def offers(self, product, variants):
+        parts = []
+
+        for variant in variants:
+            lines = [
+                "<item>",
+                f"<g:id>{variant['id']}</g:id>",
+                f"<g:item_group_id>{product['id']}</g:item_group_id>",
+                f"<title>{_xml(product['name'])}</title>",
+                f"<description>{_xml(product['description'])}</description>",
+                f"<link>{_xml(product['url'])}</link>",
+                f"<g:price>{product['price']} {site_config.CURRENCY_CODE}</g:price>",
+                "<g:availability>{}</g:availability>".format(
+                    "in_stock" if variant["stock"] > 0 else "out_of_stock"
+                ),
+            ]
+            if product["picture"]:
+                lines.append(f"<g:image_link>{_xml(product['picture'])}</g:image_link>")
+            if variant["color_name"]:
+                lines.append(f"<g:color>{_xml(variant['color_name'])}</g:color>")
+            if variant["size_name"]:
+                lines.append(f"<g:size>{_xml(variant['size_name'])}</g:size>")
+            lines += ["</item>", ""]
+            parts.append("\n".join(lines))
+
+        return "".join(parts)
+
+    def footer(self):
+        return "</channel>\n</rss>\n"
+
+
+class CsvFeed:
+
+    extension = "csv"
+    content_type = "text/csv; charset=utf-8"
+
+    COLUMNS = (
+        "id", "group_id", "name", "url", "price", "currency", "available",
+        "stock", "category_id", "color", "size", "picture", "description",
+    )
+
+    def _rows(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def header(self, categories):
+        return self._rows([self.COLUMNS])
+
+    def offers(self, product, variants):
+        return self._rows(
+            (
+                variant["id"], product["id"], product["name"], product["url"],
+                product["price"], site_config.CURRENCY_CODE,
+                int(variant["stock"] > 0), variant["stock"],
+                product["category_id"], variant["color_name"] or "",
+                variant["size_name"] or "", product["picture"] or "",
+                product["description"],
+            )
+            for variant in variants
+        )
+
+    def footer(self):
+        return ""
+
+
+FORMATS = {
+    "yml": YmlFeed,
+    "xml": GoogleFeed,
+    "csv": CsvFeed,
+}
+
+
+def get_format(name):
+    try:
+        return FORMATS[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестный формат фида: {name}")
+
+
+# ==============================
+# Данные
+# ==============================
+
+def product_blocks(chunk_size=CHUNK_SIZE):
+    """Блоки [(id, updated_at)] активных товаров по возрастанию id."""
+    block = []
+
+    queryset = (
+        Product.objects
+        .filter(is_active=True)
+        .order_by("id")
+        .values_list("id", "updated_at")
+    )
+
+    for row in queryset.iterator(chunk_size=chunk_size):
+        block.append(row)
+        if len(block) >= chunk_size:
+            yield block
+            block = []
+
+    if block:
+        yield block
+
+
+def load_products(ids):
+    """{id: (товар, варианты)} для блока товаров — два запроса."""
+    products = {}
+    for row in (
+        Product.objects
+        .filter(pk__in=ids)
+        .annotate(picture_name=F("primary_image__image"))
+        .values("id", "name", "slug", "description", "price", "category_id", "picture_name")
+    ):
+        row["price"] = int(row["price"])
+        row["url"] = absolute_url(reverse("product_detail", args=[row["slug"]]))
+        row["picture"] = (
+            absolute_url(default_storage.url(row["picture_name"]))
+            if row["picture_name"] else None
+        )
+        products[row["id"]] = (row, [])
+
+    for variant in (
+        Variant.objects
+        .filter(product_id__in=ids)
+        .order_by("product_id", "id")
+        .values(
+            "id", "product_id",
+            color_name=F("color__name"),
+            size_name=F("size__name"),
+            # доступный остаток: снимок + несвёрнутый журнал
+            available=inventory.available_expression(),
+        )
+    ):
+        variant["stock"] = variant.pop("available")
+        products[variant["product_id"]][1].append(variant)
+
+    return products
+
+
+def render_block(feed, ids):
+    """{id: текст офферов} (товар без вариантов — пустой фрагмент)."""
+    return {
+        pk: feed.offers(product, variants)
+        for pk, (product, variants) in load_products(ids).items()
+    }
+
+
+def categories():
+    return Category.objects.order_by("id").values_list("id", "name")
+
+
+# ==============================
+# Отдача потоком
+# ==============================
+
+def stream_feed(name, chunk_size=CHUNK_SIZE):
+    """Генератор фида целиком из базы — для StreamingHttpResponse."""
+    feed = get_format(name)
+
+    yield feed.header(categories())
+
+    for block in product_blocks(chunk_size):
+        fragments = render_block(feed, [pk for pk, _ in block])
+        yield "".join(fragments.get(pk, "") for pk, _ in block)
+
+    yield feed.footer()
+
+
+# ==============================
+# Файл с инкрементальным обновлением
+# ==============================
+
+def feed_path(name):
+    return os.path.join(feeds_dir(), f"catalog.{get_format(name).extension}")
+
+
+def _read_parts(path):
+    """(id товара, фрагмент) из файла прошлого запуска по возрастанию id."""
+    if not path or not os.path.exists(path):
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            pk, fragment = line.rstrip("\n").split("\t", 1)
+            yield int(pk), json.loads(fragment)
+
+
+def _load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_feed(name, full=False, chunk_size=CHUNK_SIZE):
+    """
+    Записать фид в FEEDS_DIR. Без full перерендериваются только товары,
+    изменённые после прошлого запуска (и отсутствующие в прошлом файле).
+    """
+    feed = get_format(name)
+    path = feed_path(name)
+    parts_path = path + ".parts"
+    state_path = path + ".json"
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    state = {} if full else _load_state(state_path)
+    since = state.get("started_at")
+    since = datetime.fromisoformat(since) if since else None
+
+    # время начала: изменения во время генерации попадут в следующий запуск
+    started_at = timezone.now()
+
+    old_parts = _read_parts(parts_path if since else None)
+    pending = next(old_parts, None)
+
+    stats = {"products": 0, "rendered": 0}
+
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as out, \
+            open(parts_path + ".tmp", "w", encoding="utf-8") as parts:
+
+        out.write(feed.header(categories()))
+
+        for block in product_blocks(chunk_size):
+            last_id = block[-1][0]
+
+            # фрагменты прошлого запуска для этого блока (удалённые товары отбрасываются)
+            previous = {}
+            while pending is not None and pending[0] <= last_id:
+                previous[pending[0]] = pending[1]
+                pending = next(old_parts, None)
+
+            changed = [
+                pk for pk, updated_at in block
+                if pk not in previous or updated_at >= since
+            ]
+            rendered = render_block(feed, changed) if changed else {}
+
+            for pk, _ in block:
+                fragment = rendered.get(pk, previous.get(pk, ""))
+                out.write(fragment)
+                parts.write(f"{pk}\t{json.dumps(fragment, ensure_ascii=False)}\n")
+
+            stats["products"] += len(block)
+            stats["rendered"] += len(changed)
+
+        out.write(feed.footer())
+
+    # генератор держит открытым старый файл фрагментов
+    old_parts.close()
+
+    os.replace(parts_path + ".tmp", parts_path)
+    os.replace(path + ".tmp", path)
+
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump({"started_at": started_at.isoformat(), **stats}, f)
+
+    return stats
@@ -0,0 +1,266 @@
+import os
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Now
+
+from . import cache as catalog_cache
+from .models import Product, ProductImage
+
+
+# ==============================
+# Размеры изображений
+# ==============================
+#
+# Из оригинала (ProductImage.image, Category.image) генерируются уменьшенные
+# копии в WebP и JPEG. Список реально созданных ширин хранится в поле
+# renditions модели, чтобы шаблон строил srcset без обращения к диску.
+
+RENDITIONS = {
+    "thumb": 160,
+    "card": 480,
+    "detail": 960,
+    "zoom": 1600,
+}
+
+# атрибут sizes для <img> по месту использования
+SIZES = {
+    "thumb": "80px",
+    "card": "(max-width: 600px) 100vw, 320px",
+    "detail": "(max-width: 900px) 100vw, 50vw",
+    "zoom": "100vw",
+}
+
+FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+
+RENDITIONS_DIR = "renditions"
+
+ORIENTATION_TAG = 0x0112  # EXIF Orientation
+
+
+def rendition_name(name, width, ext):
+    """products/a.jpg → renditions/products/a_480.webp"""
+    stem, _ = posixpath.splitext(name)
+    return posixpath.join(RENDITIONS_DIR, f"{stem}_{width}.{ext}")
+
+
+# ==============================
+# Генерация (выполняется в дочернем процессе)
+# ==============================
+
+def render_file(source_path, target_stem):
+    """
+    Создать копии файла source_path по всем ширинам RENDITIONS.
+    Без Django — функция запускается в пуле процессов.
+    Возвращает список созданных ширин.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        # ширина на экране — после поворота по EXIF (Orientation 5–8
+        # меняет стороны местами); больше неё копий не делаем
+        rotated = image.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8)
+        display_width = image.height if rotated else image.width
+
+        widths = sorted(
+            {w for w in RENDITIONS.values() if w <= display_width} or {display_width},
+            reverse=True
+        )
+
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+
+        # JPEG декодируется сразу в уменьшенном масштабе (размер до поворота)
+        largest = widths[0]
+        image.draft("RGB", (
+            max(1, image.width * largest // display_width),
+            max(1, image.height * largest // display_width),
+        ))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        os.makedirs(os.path.dirname(target_stem), exist_ok=True)
+
+        current = image
+        for width in widths:
+            height = max(1, round(current.height * width / current.width))
+            if width != current.width:
+                # уменьшаем из предыдущей копии — дешевле, чем из оригинала
+                current = current.resize((width, height), Image.LANCZOS)
+
+            current.save(f"{target_stem}_{width}.webp", **FORMATS["webp"])
+
+            flat = current
+            if current.mode == "RGBA":
+                flat = Image.new("RGB", current.size, (255, 255, 255))
+                flat.paste(current, mask=current.getchannel("A"))
+            flat.save(f"{target_stem}_{width}.jpg", **FORMATS["jpg"])
+
+    return sorted(widths)
+
+
+def _job(obj):
+    name = obj.image.name
+    stem, _ = posixpath.splitext(name)
+    return (
+        default_storage.path(name),
+        default_storage.path(posixpath.join(RENDITIONS_DIR, stem)),
+    )
+
+
+def _save_result(model, pk, name, widths):
+    model.objects.filter(pk=pk).update(
+        renditions={"name": name, "widths": widths}
+    )
+
+    if model is ProductImage:
+        product_id, category_id = (
+            model.objects.filter(pk=pk)
+            .values_list("product_id", "product__category_id")
+            .first() or (None, None)
+        )
+        catalog_cache.bump_products([product_id])
+        catalog_cache.bump_categories([category_id])
+    else:
+        catalog_cache.bump_categories([pk])
+        catalog_cache.bump_catalog()
+
+
+def render_objects(objects, executor=None):
+    """Сгенерировать копии для набора объектов (backfill), дождавшись результата."""
+    objects = [obj for obj in objects if obj.image]
+    jobs = [_job(obj) for obj in objects]
+
+    if executor is not None:
+        results = list(executor.map(_safe_render, jobs, chunksize=4))
+    else:
+        results = [_safe_render(job) for job in jobs]
+
+    rendered = 0
+    for obj, widths in zip(objects, results):
+        if widths:
+            _save_result(type(obj), obj.pk, obj.image.name, widths)
+            rendered += 1
+
+    return rendered
+
+
+def _safe_render(job):
+    from PIL import Image
+
+    try:
+        return render_file(*job)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # битый или неподдерживаемый файл — остаётся оригинал
+        return None
+
+
+# ==============================
+# Генерация при загрузке
+# ==============================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, "IMAGE_RENDITION_WORKERS", 2)
+            )
+        return _executor
+
+
+def schedule(obj):
+    """Поставить генерацию копий в очередь после коммита транзакции."""
+    if not obj.image or obj.renditions.get("name") == obj.image.name:
+        return
+
+    model, pk, name = type(obj), obj.pk, obj.image.name
+    job = _job(obj)
+
+    def run():
+        if not getattr(settings, "IMAGE_RENDITION_WORKERS", 2):
+            widths = _safe_render(job)
+            if widths:
+                _save_result(model, pk, name, widths)
+            return
+
+        future = _get_executor().submit(_safe_render, job)
+
+        def done(future):
+            try:
+                widths = future.result()
+                if widths:
+                    _save_result(model, pk, name, widths)
+            finally:
+                # callback выполняется в служебном потоке пула
+                connections.close_all()
+
+        future.add_done_callback(done)
+
+    transaction.on_commit(run)
+
+
+# ==============================
+# URL для шаблонов
+# ==============================
+
+def rendition_url(obj, size="card", ext="jpg"):
+    """URL копии нужного размера (или ближайшей большей), иначе оригинала."""
+    if not obj.image:
+        return None
+
+    widths = (obj.renditions or {}).get("widths") or []
+
+    if (obj.renditions or {}).get("name") != obj.image.name or not widths:
+        return obj.image.url
+
+    target = RENDITIONS[size]
+    width = next((w for w in widths if w >= target), widths[-1])
+    return default_storage.url(rendition_name(obj.image.name, width, ext))
+
+
+def srcset(obj, ext):
+    widths = (obj.renditions or {}).get("widths") or []
+    return ", ".join(
+        f"{default_storage.url(rendition_name(obj.image.name, w, ext))} {w}w"
+        for w in widths
+    )
+
+
+# ==============================
+# Главное фото товара
+# ==============================
+
+def primary_image_subquery():
+    return Subquery(
+        ProductImage.objects
+        .filter(product=OuterRef("pk"))
+        .order_by("order", "id")
+        .values("id")[:1]
+    )
+
+
+def refresh_primary_images(product_ids):
+    """Пересчитать Product.primary_image одним UPDATE (и отметить updated_at)."""
+    product_ids = set(product_ids)
+
+    if not product_ids:
+        return 0
+
+    return (
+        Product.objects
+        .filter(pk__in=product_ids)
+        .update(primary_image=primary_image_subquery(), updated_at=Now())
+    )
@@ -0,0 +1,365 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from . import cache as catalog_cache
+from . import inventory
+from . import search
+from .images import refresh_primary_images
+from .models import Category, Color, Product, ProductImage, Size, StockMovement, Variant
+
+
+# ==============================
+# Импорт каталога
+# ==============================
+#
+# Одна строка файла — один вариант товара (поля товара повторяются):
+#
+#   slug, name, description, price, category, is_active,
+#   color, size, stock, images
+#
+# category — slug или название существующей категории, images — пути
+# относительно MEDIA_ROOT через «|». Строки читаются потоком и пишутся
+# пачками: товары — bulk_create(update_conflicts=True) по Product.slug,
+# варианты сопоставляются по (товар, цвет, размер), поэтому повторный
+# импорт того же файла только обновляет данные. stock — доступный остаток:
+# у существующих вариантов он меняется разницей через журнал движений
+# (inventory.bulk_edit), а не перезаписью Variant.stock; у шардированных
+# — в строках StockShard.
+
+PRODUCT_FIELDS = ("name", "description", "price", "category_id", "is_active", "updated_at")
+
+IMAGE_SEPARATOR = "|"
+
+TRUE_VALUES = {"1", "true", "yes", "да", "y"}
+FALSE_VALUES = {"0", "false", "no", "нет", "n", ""}
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(file, fmt):
+    """(номер строки, dict) из CSV или JSON Lines."""
+    if fmt == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as exc:
+            yield line_no, ImportRowError(f"некорректный JSON: {exc}")
+
+
+def _text(row, field):
+    value = row.get(field)
+    return "" if value is None else str(value).strip()
+
+
+def _int(value, field):
+    try:
+        number = int(Decimal(str(value).strip() or "0"))
+    except (InvalidOperation, ValueError):
+        raise ImportRowError(f"{field}: ожидается число, получено {value!r}")
+
+    if number < 0:
+        raise ImportRowError(f"{field}: отрицательное значение")
+
+    return number
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+
+    value = "" if value is None else str(value).strip().lower()
+
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+
+    raise ImportRowError(f"is_active: непонятное значение {value!r}")
+
+
+class CatalogImporter:
+
+    def __init__(self, batch_size=1000, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+
+        self.categories = {}
+        for pk, slug, name in Category.objects.values_list("id", "slug", "name"):
+            self.categories[slug.lower()] = pk
+            self.categories.setdefault(name.lower(), pk)
+
+        self.colors = self._lookup(Color)
+        self.sizes = self._lookup(Size)
+
+        self.stats = {
+            "rows": 0,
+            "products_created": 0,
+            "products_updated": 0,
+            "variants": 0,
+            "images": 0,
+            "colors_created": 0,
+            "sizes_created": 0,
+            "stock_conflicts": 0,
+            "errors": 0,
+        }
+        self.errors = []
+
+    @staticmethod
+    def _lookup(model):
+        names = {}
+        # при дублях названий берём первую запись
+        for pk, name in model.objects.order_by("-id").values_list("id", "name"):
+            names[name.strip().lower()] = pk
+        return names
+
+    # ------------------------------
+    # Разбор строки
+    # ------------------------------
+
+    def _reference(self, model, names, value, stat):
+        value = value.strip()
+
+        if not value:
+            return None
+
+        key = value.lower()
+
+        if key not in names:
+            # в dry-run ничего не создаём, ключ — только для подсчёта вариантов
+            names[key] = key if self.dry_run else model.objects.create(name=value).pk
+            self.stats[stat] += 1
+
+        return names[key]
+
+    def parse(self, row):
+        slug = _text(row, "slug")
+        if not slug:
+            raise ImportRowError("slug: обязательное поле")
+
+        category = _text(row, "category").lower()
+        if category not in self.categories:
+            raise ImportRowError(f"category: неизвестная категория {category!r}")
+
+        product = {
+            "slug": slug,
+            "name": _text(row, "name") or slug,
+            "description": _text(row, "description"),
+            "price": _int(row.get("price"), "price"),
+            "category_id": self.categories[category],
+            "is_active": _bool(row.get("is_active", True)),
+        }
+
+        variant = None
+        color, size = _text(row, "color"), _text(row, "size")
+
+        if color or size or _text(row, "stock"):
+            variant = {
+                "color": self._reference(Color, self.colors, color, "colors_created"),
+                "size": self._reference(Size, self.sizes, size, "sizes_created"),
+                "stock": _int(row.get("stock"), "stock"),
+            }
+
+        images = row.get("images") or []
+        if isinstance(images, str):
+            images = images.split(IMAGE_SEPARATOR)
+        images = [path.strip().lstrip("/") for path in images if path.strip()]
+
+        return product, variant, images
+
+    # ------------------------------
+    # Запись
+    # ------------------------------
+
+    def run(self, rows, progress=None):
+        batch = []
+
+        for line_no, row in rows:
+            self.stats["rows"] += 1
+
+            try:
+                if isinstance(row, ImportRowError):
+                    raise row
+                batch.append(self.parse(row))
+            except ImportRowError as exc:
+                self.stats["errors"] += 1
+                self.errors.append((line_no or self.stats["rows"], str(exc)))
+                continue
+
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+                if progress:
+                    progress(self.stats)
+
+        self.flush(batch)
+
+        if progress:
+            progress(self.stats)
+
+        return self.stats
+
+    def flush(self, batch):
+        if not batch:
+            return
+
+        # в пачке один товар может встречаться много раз — берём последнюю версию
+        products = {}
+        variants = {}
+        images = {}
+
+        for product, variant, paths in batch:
+            products[product["slug"]] = product
+
+            if variant is not None:
+                variants[(product["slug"], variant["color"], variant["size"])] = variant
+
+            for path in paths:
+                images.setdefault(product["slug"], {}).setdefault(path, None)
+
+        existing = dict(
+            Product.objects
+            .filter(slug__in=products)
+            .values_list("slug", "id")
+        )
+
+        created = len(products.keys() - existing.keys())
+        self.stats["products_created"] += created
+        self.stats["products_updated"] += len(products) - created
+        self.stats["variants"] += len(variants)
+
+        if self.dry_run:
+            self.stats["images"] += sum(len(paths) for paths in images.values())
+            return
+
+        with transaction.atomic():
+            ids = self.write_products(products)
+            self.write_variants(ids, variants)
+            self.write_images(ids, images)
+
+            inventory.refresh_available_stock(ids.values())
+            search.index_products(
+                Product.objects
+                .filter(pk__in=ids.values())
+                .select_related("category")
+                .only("id", "name", "description", "is_active", "category__name")
+            )
+
+            # товары могли сменить категорию — сбрасываем каталог целиком
+            catalog_cache.bump_catalog()
+
+    def write_products(self, products):
+        Product.objects.bulk_create(
+            [Product(**fields) for fields in products.values()],
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=["slug"],
+            update_fields=PRODUCT_FIELDS,
+        )
+
+        # pk после upsert возвращают не все СУБД — перечитываем одним запросом
+        return dict(
+            Product.objects
+            .filter(slug__in=products)
+            .values_list("slug", "id")
+        )
+
+    def write_variants(self, ids, variants):
+        targets = {
+            (ids[slug], color_id, size_id): variant["stock"]
+            for (slug, color_id, size_id), variant in variants.items()
+        }
+
+        # NULL в уникальном ключе не конфликтует с upsert — существующие
+        # варианты сопоставляем сами, одним запросом на пачку
+        existing = {
+            (product_id, color_id, size_id): (
+                pk,
+                # у шардированных Variant.stock — сводка, которая может
+                # отставать: снимок — сумма шардов, bulk_edit меняет шарды
+                (shard_total if shards else stock) + pending
+            )
+            for pk, product_id, color_id, size_id, stock, shards, shard_total, pending in (
+                Variant.objects
+                .filter(product_id__in={key[0] for key in targets})
+                .annotate(
+                    shard_total=inventory.shard_total_subquery(),
+                    pending=inventory.pending_subquery(),
+                )
+                .values_list(
+                    "id", "product_id", "color_id", "size_id",
+                    "stock", "stock_shards", "shard_total", "pending"
+                )
+            )
+        }
+
+        to_create = [
+            Variant(product_id=product_id, color_id=color_id, size_id=size_id, stock=stock)
+            for (product_id, color_id, size_id), stock in targets.items()
+            if (product_id, color_id, size_id) not in existing
+        ]
+        Variant.objects.bulk_create(to_create, batch_size=self.batch_size)
+
+        # остаток из файла — доступный остаток целиком; у существующих
+        # вариантов меняем его разницей через журнал, как массовый редактор
+        inventory.record_movements(
+            StockMovement.KIND_RESTOCK,
+            {variant.pk: variant.stock for variant in to_create},
+            folded=True,
+        )
+
+        result = inventory.bulk_edit(
+            {
+                pk: (available, targets[key])
+                for key, (pk, available) in existing.items()
+                if key in targets
+            },
+            {},
+            batch_size=self.batch_size,
+        )
+
+        # вариант успели изменить (заказ) между чтением и записью
+        self.stats["stock_conflicts"] += len(result["conflicts"])
+
+    def write_images(self, ids, images):
+        if not images:
+            return
+
+        existing = {}
+        for product_id, name, order in (
+            ProductImage.objects
+            .filter(product_id__in=[ids[slug] for slug in images])
+            .values_list("product_id", "image", "order")
+        ):
+            names, last = existing.get(product_id, (set(), -1))
+            names.add(name)
+            existing[product_id] = (names, max(last, order))
+
+        new = []
+        for slug, paths in images.items():
+            product_id = ids[slug]
+            names, last = existing.get(product_id, (set(), -1))
+
+            for path in paths:
+                if path in names:
+                    continue
+                last += 1
+                new.append(ProductImage(product_id=product_id, image=path, order=last))
+
+        ProductImage.objects.bulk_create(new, batch_size=self.batch_size)
+        self.stats["images"] += len(new)
+
+        # bulk_create минует сигналы
+        refresh_primary_images(image.product_id for image in new)
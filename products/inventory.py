@@ -0,0 +1,692 @@
+import random
+import time
+import zlib
+from collections import defaultdict
+
+from django.db import OperationalError, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import Product, StockMovement, StockShard, Variant
+
+
+# ==============================
+# Сводный остаток товара
+# ==============================
+#
+# Доступно = снимок Variant.stock + несвёрнутые движения журнала
+# (см. «Журнал движений остатка» ниже).
+
+def pending_subquery(outer="pk", group="variant"):
+    """Сумма несвёрнутых движений: по варианту (outer — его pk) или по товару."""
+    return Coalesce(
+        Subquery(
+            StockMovement.objects
+            .filter(folded=False, **{group: OuterRef(outer)})
+            .values(group)
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        ),
+        Value(0)
+    )
+
+
+def available_expression(prefix=""):
+    """Доступный остаток варианта для annotate (prefix — путь до варианта)."""
+    return F(f"{prefix}stock") + pending_subquery(outer=f"{prefix}pk")
+
+
+def available_stock_subquery():
+    return Coalesce(
+        Subquery(
+            Variant.objects
+            .filter(product=OuterRef("pk"))
+            .values("product")
+            .annotate(total=Sum("stock"))
+            .values("total")
+        ),
+        Value(0)
+    ) + pending_subquery(group="variant__product")
+
+
+def refresh_available_stock(product_ids):
+    """
+    Пересчитать Product.available_stock одним UPDATE (и отметить updated_at),
+    затем матрицу вариантов.
+    """
+    product_ids = set(product_ids)
+
+    if not product_ids:
+        return 0
+
+    updated = (
+        Product.objects
+        .filter(pk__in=product_ids)
+        .update(available_stock=available_stock_subquery(), updated_at=Now())
+    )
+
+    refresh_variant_matrix(product_ids)
+
+    return updated
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, variant_id):
+        super().__init__(variant_id)
+        self.variant_id = variant_id
+
+
+def adjust_stock(deltas):
+    """
+    {id варианта: изменение остатка} — один UPDATE ... SET stock = stock + CASE.
+    Убавка условная (WHERE stock >= q): если какой-то строке не хватило
+    остатка, весь UPDATE откатывается и поднимается OutOfStock.
+    Сигналы не срабатывают: после вызова нужен stock_changed.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+
+    if not deltas:
+        return 0
+
+    takes = {pk: -delta for pk, delta in deltas.items() if delta < 0}
+    rows = Q(pk__in=[pk for pk in deltas if pk not in takes])
+    for pk, quantity in takes.items():
+        rows |= Q(pk=pk, stock__gte=quantity)
+
+    try:
+        with transaction.atomic():
+            updated = (
+                Variant.objects
+                .filter(rows)
+                .update(stock=F("stock") + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ))
+            )
+
+            # строки с убавкой существуют (заблокированы вызывающим),
+            # недостача — только из-за условия
+            if takes and updated < len(deltas):
+                raise OutOfStock(None)
+    except OutOfStock:
+        stocks = dict(Variant.objects.filter(pk__in=takes).values_list("pk", "stock"))
+        raise OutOfStock(next(
+            (pk for pk in sorted(takes) if stocks.get(pk, 0) < takes[pk]),
+            min(takes)
+        ))
+
+    return updated
+
+
+def reserve_stock(quantities, shards=None, key=None):
+    """
+    {id варианта: штук} — списать без блокировок: по условному
+    UPDATE ... SET stock = stock - q WHERE stock >= q на строку.
+    shards — {id варианта: число шардов} для шардированных вариантов,
+    key — ключ покупателя для выбора шарда.
+
+    Возвращает списанное {(вариант, шард или None): штук} для release_stock.
+    Если строке не хватило остатка — уже списанное возвращается
+    и поднимается OutOfStock. Вне транзакции каждый UPDATE коммитится сразу,
+    строки варианта не держатся до конца заказа.
+    """
+    shards = shards or {}
+    reserved = {}
+
+    try:
+        # один порядок строк у всех покупателей — без взаимных ожиданий
+        for pk, quantity in sorted(quantities.items()):
+            if pk in shards:
+                _take_from_shards(pk, quantity, shards[pk], key, reserved)
+                continue
+
+            updated = (
+                Variant.objects
+                .filter(pk=pk, stock__gte=quantity)
+                .update(stock=F("stock") - quantity)
+            )
+
+            if not updated:
+                raise OutOfStock(pk)
+
+            reserved[pk, None] = quantity
+
+    except BaseException:
+        release_stock(reserved)
+        raise
+
+    return reserved
+
+
+def release_stock(reserved, attempts=10):
+    """
+    Вернуть {(вариант, шард или None): штук} на склад — компенсация
+    reserve_stock, возврат отменённого заказа. Сбой здесь — потерянные
+    штуки, поэтому временные ошибки БД повторяются.
+    """
+    plain = {pk: quantity for (pk, index), quantity in reserved.items() if index is None}
+    sharded = {key: quantity for key, quantity in reserved.items() if key[1] is not None}
+
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                adjust_stock(plain)
+                adjust_shards(sharded)
+            return
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(min(0.01 * 2 ** attempt, 0.5))
+
+
+def stock_changed(product_ids):
+    """
+    Вызывать после изменения Variant.stock через update():
+    пересчитывает сводный остаток и сбрасывает кэш каталога.
+    """
+    product_ids = set(product_ids)
+
+    if not product_ids:
+        return
+
+    refresh_available_stock(product_ids)
+
+    catalog_cache.bump_products(product_ids)
+    catalog_cache.bump_categories(
+        Product.objects
+        .filter(pk__in=product_ids)
+        .values_list("category_id", flat=True)
+    )
+
+
+# ==============================
+# Журнал движений остатка
+# ==============================
+#
+# Каждое изменение остатка пишется в StockMovement. Расход (продажа,
+# уменьшение в админке) применяется сразу условным UPDATE — иначе остаток
+# не проверить — и попадает в журнал уже свёрнутым. Приход (отмена заказа,
+# поступление) только дописывается в журнал, не трогая горячую строку
+# варианта; manage.py compact_stock пачками сворачивает его в Variant.stock.
+# Несвёрнутый журнал — только приход, поэтому сворачивание не уводит
+# остаток в минус. Сводки (available_stock, матрица) показывают снимок +
+# несвёрнутое; оформлению заказа при нехватке хватает свернуть журнал
+# своего варианта (compact с variant_ids).
+
+def record_movements(kind, quantities, order_id=None, folded=False):
+    """{id варианта: ±штук} — одним INSERT."""
+    return StockMovement.objects.bulk_create([
+        StockMovement(
+            variant_id=pk,
+            kind=kind,
+            quantity=quantity,
+            order_id=order_id,
+            folded=folded,
+        )
+        for pk, quantity in quantities.items()
+        if quantity
+    ])
+
+
+def compact(variant_ids=None, batch_size=1000):
+    """
+    Свернуть несвёрнутые движения в Variant.stock (у шардированных — в шарды)
+    пачками по batch_size: на пачку один SELECT, один UPDATE вариантов
+    и отметка folded. Возвращает число свёрнутых движений.
+    """
+    total = 0
+
+    while True:
+        with transaction.atomic():
+            pending = StockMovement.objects.filter(folded=False)
+            if variant_ids is not None:
+                pending = pending.filter(variant_id__in=variant_ids)
+
+            # параллельные сворачивания берут разные пачки
+            rows = list(
+                pending
+                .select_for_update(skip_locked=True, of=("self",))
+                .order_by("id")
+                .values_list(
+                    "id", "variant_id", "variant__product_id", "variant__stock_shards", "quantity"
+                )[:batch_size]
+            )
+
+            if not rows:
+                return total
+
+            deltas = defaultdict(int)
+            product_ids = set()
+            sharded_ids = set()
+
+            for movement_id, variant_id, product_id, shards, quantity in rows:
+                shard = shard_index(shards, movement_id) if shards else None
+                deltas[variant_id, shard] += quantity
+                product_ids.add(product_id)
+                if shards:
+                    sharded_ids.add(variant_id)
+
+            adjust_stock({pk: delta for (pk, shard), delta in deltas.items() if shard is None})
+            adjust_shards({key: delta for key, delta in deltas.items() if key[1] is not None})
+
+            StockMovement.objects.filter(pk__in=[row[0] for row in rows]).update(folded=True)
+
+            sync_sharded_stock(sharded_ids)
+            stock_changed(product_ids)
+
+        total += len(rows)
+
+        if len(rows) < batch_size:
+            return total
+
+
+# ==============================
+# Шардированный остаток
+# ==============================
+#
+# На распродаже строку Variant.stock «горячего» варианта обновляют все
+# покупатели разом. У такого варианта (Variant.stock_shards = N > 0) остаток
+# разбит на N строк StockShard: покупатель списывает из своего шарда
+# (по хэшу пользователя), а если там не хватает — обходит остальные.
+# Variant.stock шардированного варианта — сумма шардов (только для чтения:
+# карточки, матрица, сводный остаток), её пересчитывает shards_changed.
+# Включение и выключение — manage.py shard_stock.
+
+DEFAULT_SHARDS = 8
+
+
+def shard_index(shards, key=None):
+    """Шард покупателя: по хэшу ключа или случайный."""
+    if key is None:
+        return random.randrange(shards)
+    return zlib.crc32(str(key).encode()) % shards
+
+
+def split_stock(stock, shards):
+    base, extra = divmod(stock, shards)
+    return [base + (i < extra) for i in range(shards)]
+
+
+def adjust_shards(deltas):
+    """{(id варианта, шард): изменение остатка} — один UPDATE ... CASE."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+
+    if not deltas:
+        return 0
+
+    return (
+        StockShard.objects
+        .filter(variant_id__in={pk for pk, _ in deltas})
+        .update(stock=F("stock") + Case(
+            *[
+                When(variant_id=pk, index=index, then=Value(delta))
+                for (pk, index), delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+    )
+
+
+def _take_shard(pk, index, quantity):
+    return (
+        StockShard.objects
+        .filter(variant_id=pk, index=index, stock__gte=quantity)
+        .update(stock=F("stock") - quantity)
+    )
+
+
+def _take_from_shards(pk, quantity, shards, key, reserved):
+    start = shard_index(shards, key)
+
+    # обычно хватает своего шарда — один UPDATE
+    if _take_shard(pk, start, quantity):
+        reserved[pk, start] = quantity
+        return
+
+    # свой шард пуст — обходим остальные по кругу, списывая сколько есть
+    remaining = quantity
+
+    while remaining:
+        available = dict(
+            StockShard.objects
+            .filter(variant_id=pk, stock__gt=0)
+            .values_list("index", "stock")
+        )
+
+        if sum(available.values()) < remaining:
+            raise OutOfStock(pk)
+
+        for index in sorted(available, key=lambda index: (index - start) % shards):
+            take = min(available[index], remaining)
+
+            # шард успели опустошить — прочитаем заново на следующем круге
+            if _take_shard(pk, index, take):
+                reserved[pk, index] = reserved.get((pk, index), 0) + take
+                remaining -= take
+
+            if not remaining:
+                break
+
+
+def _write_shards(variants):
+    """Разложить variant.stock по variant.stock_shards строкам заново."""
+    StockShard.objects.filter(variant__in=variants).delete()
+    StockShard.objects.bulk_create([
+        StockShard(variant=variant, index=index, stock=stock)
+        for variant in variants
+        if variant.stock_shards
+        for index, stock in enumerate(split_stock(variant.stock, variant.stock_shards))
+    ])
+
+
+def shard_stock(variant_ids, shards=DEFAULT_SHARDS):
+    """Разбить остаток вариантов на shards строк (0 — вернуть в Variant.stock)."""
+    with transaction.atomic():
+        variants = list(
+            Variant.objects
+            .select_for_update()
+            .filter(pk__in=variant_ids)
+            .only("id", "product_id", "stock", "stock_shards")
+        )
+
+        # у уже шардированных остаток — сумма шардов, а не Variant.stock
+        totals = defaultdict(int)
+        for variant_id, stock in (
+            StockShard.objects
+            .select_for_update()
+            .filter(variant__in=variants)
+            .values_list("variant_id", "stock")
+        ):
+            totals[variant_id] += stock
+
+        for variant in variants:
+            if variant.stock_shards:
+                variant.stock = totals[variant.pk]
+            variant.stock_shards = shards
+
+        Variant.objects.bulk_update(variants, ["stock", "stock_shards"])
+        _write_shards(variants)
+
+        stock_changed(variant.product_id for variant in variants)
+
+    return len(variants)
+
+
+def resplit_stock(variant):
+    """Остаток шардированного варианта задан целиком (админка) — разложить заново."""
+    with transaction.atomic():
+        _write_shards([variant])
+
+
+def shard_total_subquery():
+    """Сумма шардов варианта для annotate/update."""
+    return Coalesce(
+        Subquery(
+            StockShard.objects
+            .filter(variant=OuterRef("pk"))
+            .values("variant")
+            .annotate(total=Sum("stock"))
+            .values("total")
+        ),
+        Value(0)
+    )
+
+
+def sync_sharded_stock(variant_ids):
+    """Variant.stock шардированных вариантов = сумма шардов, одним UPDATE."""
+    variant_ids = set(variant_ids)
+
+    if not variant_ids:
+        return 0
+
+    return (
+        Variant.objects
+        .filter(pk__in=variant_ids, stock_shards__gt=0)
+        .update(stock=shard_total_subquery())
+    )
+
+
+def shards_changed(variant_ids):
+    """stock_changed для шардированных вариантов: сначала сумма шардов."""
+    variant_ids = set(variant_ids)
+
+    if not variant_ids:
+        return
+
+    sync_sharded_stock(variant_ids)
+    stock_changed(
+        Variant.objects
+        .filter(pk__in=variant_ids)
+        .values_list("product_id", flat=True)
+    )
+
+
+# ==============================
+# Матрица вариантов размер × цвет
+# ==============================
+#
+# Product.variant_matrix — всё, что нужно странице товара для выбора
+# варианта, без запросов к Variant/Color/Size:
+#
+#   {
+#       "sizes":    [[id, название], ...],
+#       "colors":   [[id, название, hex], ...],
+#       "variants": [[id варианта, индекс размера, индекс цвета, остаток], ...],
+#   }
+#
+# Индекс — позиция в sizes/colors, null — вариант без размера/цвета.
+
+VARIANT_MATRIX_FIELDS = (
+    "product_id", "id",
+    "size_id", "size__name",
+    "color_id", "color__name", "color__hex_code",
+    "stock",
+)
+
+
+def build_variant_matrix(rows):
+    """rows — кортежи VARIANT_MATRIX_FIELDS без product_id."""
+    rows = list(rows)
+
+    if not rows:
+        return {}
+
+    sizes = sorted({(size_id, name) for _, size_id, name, *_ in rows if size_id})
+    colors = sorted(
+        {(color_id, name, hex_code) for _, _, _, color_id, name, hex_code, _ in rows if color_id},
+        key=lambda color: (color[1], color[0])
+    )
+
+    size_index = {size_id: i for i, (size_id, _) in enumerate(sizes)}
+    color_index = {color_id: i for i, (color_id, _, _) in enumerate(colors)}
+
+    return {
+        "sizes": [list(size) for size in sizes],
+        "colors": [list(color) for color in colors],
+        "variants": [
+            [variant_id, size_index.get(size_id), color_index.get(color_id), stock]
+            for variant_id, size_id, _, color_id, _, _, stock in sorted(rows)
+        ],
+    }
+
+
+def refresh_variant_matrix(product_ids):
+    """Пересобрать Product.variant_matrix: один SELECT и один UPDATE на пачку."""
+    product_ids = set(product_ids)
+
+    if not product_ids:
+        return
+
+    rows = defaultdict(list)
+    for product_id, *row in (
+        Variant.objects
+        .filter(product_id__in=product_ids)
+        # остаток в матрице — доступный, с несвёрнутым журналом
+        .annotate(available=F("stock") + pending_subquery())
+        .values_list(*VARIANT_MATRIX_FIELDS[:-1], "available")
+    ):
+        rows[product_id].append(row)
+
+    Product.objects.bulk_update(
+        [
+            Product(pk=pk, variant_matrix=build_variant_matrix(rows[pk]))
+            for pk in product_ids
+        ],
+        ["variant_matrix"],
+        batch_size=500,
+    )
+
+
+def variant_grid(matrix):
+    """
+    Сетка для шаблона: строки — размеры, столбцы — цвета.
+    Варианты без размера/цвета попадают в строку/столбец без названия.
+    """
+    variants = matrix.get("variants", [])
+
+    sizes = [name for _, name in matrix.get("sizes", [])]
+    colors = [{"name": name, "hex": hex_code} for _, name, hex_code in matrix.get("colors", [])]
+
+    if any(size is None for _, size, _, _ in variants):
+        sizes.append("")
+    if not colors or any(color is None for _, _, color, _ in variants):
+        colors.append({"name": "", "hex": ""})
+
+    cells = {
+        (len(sizes) - 1 if size is None else size, len(colors) - 1 if color is None else color):
+            {"id": variant_id, "stock": stock}
+        for variant_id, size, color, stock in variants
+    }
+
+    return {
+        "colors": colors,
+        "show_colors": any(color["name"] for color in colors),
+        "rows": [
+            {"size": size, "cells": [cells.get((i, j)) for j in range(len(colors))]}
+            for i, size in enumerate(sizes)
+        ],
+        "first_available": next(
+            (variant_id for variant_id, _, _, stock in variants if stock > 0),
+            None
+        ),
+    }
+
+
+# ==============================
+# Массовая правка остатков и цен
+# ==============================
+
+def bulk_edit(stocks, prices, batch_size=500):
+    """
+    stocks — {id варианта: (показанный доступный остаток, новый)},
+    prices — {id товара: (показанная цена, новая)}.
+
+    Всё пишется одной транзакцией. Остаток меняется на разницу: прибавка —
+    поступление в журнал (без UPDATE варианта), убавка списывается сразу.
+    Строку, которую успели изменить с момента показа формы (например,
+    оформили заказ), не трогаем — она попадает в conflicts.
+    """
+    stocks = {pk: values for pk, values in stocks.items() if values[0] != values[1]}
+    prices = {pk: values for pk, values in prices.items() if values[0] != values[1]}
+
+    conflicts = []
+
+    with transaction.atomic():
+        locked = list(
+            Variant.objects
+            .select_for_update(of=("self",))
+            .filter(pk__in=stocks)
+            .annotate(pending=pending_subquery())
+            .only("id", "product_id", "stock", "stock_shards")
+        )
+
+        # снимок шардированных вариантов — сумма шардов
+        shard_totals = defaultdict(int)
+        sharded = [variant for variant in locked if variant.stock_shards]
+        if sharded:
+            for variant_id, stock in (
+                StockShard.objects
+                .select_for_update()
+                .filter(variant__in=sharded)
+                .values_list("variant_id", "stock")
+            ):
+                shard_totals[variant_id] += stock
+
+        variants = {}
+        restocks = {}
+        takes = {}
+        for variant in locked:
+            shown, new = stocks[variant.pk]
+            snapshot = shard_totals[variant.pk] if variant.stock_shards else variant.stock
+            if snapshot + variant.pending != shown:
+                conflicts.append(variant)
+                continue
+
+            variants[variant.pk] = variant
+            if new > shown:
+                restocks[variant.pk] = new - shown
+            else:
+                takes[variant.pk] = (shown - new, snapshot)
+
+        # убавке не хватает снимка — сначала свернуть приход журнала
+        short = [pk for pk, (quantity, snapshot) in takes.items() if snapshot < quantity]
+        if short:
+            compact(short)
+
+        shards = {pk: variants[pk].stock_shards for pk in takes if variants[pk].stock_shards}
+        adjust_stock({pk: -quantity for pk, (quantity, _) in takes.items() if pk not in shards})
+        for pk in shards:
+            try:
+                reserve_stock({pk: takes[pk][0]}, shards)
+            except OutOfStock:
+                conflicts.append(variants.pop(pk))
+                del takes[pk]
+
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(variant_id=pk, kind=StockMovement.KIND_RESTOCK, quantity=quantity)
+                for pk, quantity in restocks.items()
+            ]
+            + [
+                StockMovement(
+                    variant_id=pk,
+                    kind=StockMovement.KIND_ADJUSTMENT,
+                    quantity=-quantity,
+                    folded=True,
+                )
+                for pk, (quantity, _) in takes.items()
+            ],
+            batch_size=batch_size,
+        )
+
+        products = []
+        now = timezone.now()
+        for product in (
+            Product.objects
+            .select_for_update()
+            .filter(pk__in=prices)
+            .only("id", "price", "updated_at")
+        ):
+            shown, new = prices[product.pk]
+            if product.price != shown:
+                conflicts.append(product)
+                continue
+            product.price = new
+            product.updated_at = now
+            products.append(product)
+
+        Product.objects.bulk_update(products, ["price", "updated_at"], batch_size=batch_size)
+
+        # update/bulk_update минуют сигналы: остатки, матрица, updated_at и кэш — здесь
+        sync_sharded_stock(pk for pk in shards if pk in takes)
+        stock_changed(
+            {variant.product_id for variant in variants.values()}
+            | {product.pk for product in products}
+        )
+
+    return {"variants": len(variants), "products": len(products), "conflicts": conflicts}
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import recommendations
+
+
+class Command(BaseCommand):
+    help = "Пересобрать рекомендации «С этим товаром покупают» по истории заказов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=recommendations.TOP_N)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=recommendations.HISTORY_DAYS,
+            help="Сколько дней истории заказов учитывать",
+        )
+        parser.add_argument(
+            "--min-support",
+            type=int,
+            default=1,
+            help="Минимум совместных заказов для пары товаров",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        total = recommendations.build_recommendations(
+            n=options["top"],
+            days=options["days"],
+            min_support=options["min_support"],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Связей сохранено: {total} за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products import inventory
+
+
+class Command(BaseCommand):
+    help = "Свернуть журнал движений остатков в Variant.stock"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+        folded = inventory.compact(batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(f"Свёрнуто движений: {folded}"))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import feeds
+
+
+class Command(BaseCommand):
+    help = "Сгенерировать фиды каталога (YML, Google XML, CSV) в FEEDS_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            action="append",
+            choices=sorted(feeds.FORMATS),
+            help="Формат фида (можно несколько), по умолчанию — все",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Перерендерить все товары, а не только изменённые",
+        )
+        parser.add_argument("--chunk-size", type=int, default=feeds.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for name in options["format"] or sorted(feeds.FORMATS):
+            started = time.monotonic()
+
+            stats = feeds.write_feed(
+                name,
+                full=options["full"],
+                chunk_size=options["chunk_size"],
+            )
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{feeds.feed_path(name)}: товаров {stats['products']}, "
+                f"обновлено {stats['rendered']} за {time.monotonic() - started:.1f} с"
+            ))
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products import images
+from products.models import Category, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Сгенерировать копии изображений (thumb/card/detail/zoom) для товаров и категорий"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Пересоздать копии, даже если они уже есть",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "IMAGE_RENDITION_WORKERS", 2),
+        )
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        workers = options["workers"]
+        pool = ProcessPoolExecutor(max_workers=workers) if workers else nullcontext()
+
+        with pool as executor:
+            total = self.render_all(executor, options)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: {total} изображений за {time.monotonic() - started:.1f} с"
+        ))
+
+    def render_all(self, executor, options):
+        batch_size = options["batch_size"]
+        total = 0
+
+        for model in (ProductImage, Category):
+            queryset = (
+                model.objects
+                .exclude(image="")
+                .exclude(image__isnull=True)
+                .only("id", "image", "renditions")
+                .order_by("id")
+            )
+
+            batch = []
+            for obj in queryset.iterator(chunk_size=batch_size):
+                if not options["force"] and obj.renditions.get("name") == obj.image.name:
+                    continue
+
+                batch.append(obj)
+
+                if len(batch) >= batch_size:
+                    total += images.render_objects(batch, executor)
+                    self.stdout.write(f"{model.__name__}: {total}")
+                    batch = []
+
+            total += images.render_objects(batch, executor)
+
+        return total
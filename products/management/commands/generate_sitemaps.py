@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import sitemaps
+
+
+class Command(BaseCommand):
+    help = "Сгенерировать sitemap.xml и шарды категорий/товаров в SITEMAP_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Перезаписать все шарды, а не только изменившиеся",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        stats = sitemaps.write_sitemaps(full=options["full"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Шардов товаров: {stats['shards']}, перезаписано: {stats['written']} "
+            f"за {time.monotonic() - started:.1f} с"
+        ))
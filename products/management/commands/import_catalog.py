@@ -0,0 +1,79 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importer import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = "Импорт товаров и вариантов из CSV / JSON Lines (потоково, пачками)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл каталога или «-» для stdin")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="По умолчанию — по расширению файла",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только проверить файл и посчитать изменения",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("csv" if path.lower().endswith(".csv") else "jsonl")
+
+        self.started = time.monotonic()
+        importer = CatalogImporter(
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+
+        try:
+            file = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", newline="")
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with file:
+            stats = importer.run(read_rows(file, fmt), progress=self.progress)
+
+        for line_no, message in importer.errors[:20]:
+            self.stderr.write(f"строка {line_no}: {message}")
+
+        if len(importer.errors) > 20:
+            self.stderr.write(f"... и ещё {len(importer.errors) - 20} ошибок")
+
+        summary = (
+            f"товаров новых: {stats['products_created']}, "
+            f"обновлённых: {stats['products_updated']}, "
+            f"вариантов: {stats['variants']}, "
+            f"фото: {stats['images']}, "
+            f"новых цветов: {stats['colors_created']}, "
+            f"новых размеров: {stats['sizes_created']}, "
+            f"ошибок: {stats['errors']}"
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(f"Проверка без записи — {summary}")
+            return
+
+        if stats["stock_conflicts"]:
+            self.stderr.write(
+                f"Остаток изменился во время импорта, не обновлён: "
+                f"{stats['stock_conflicts']} вариантов — повторите импорт"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Импорт завершён — {summary}"))
+
+        if stats["images"]:
+            self.stdout.write("Копии изображений: manage.py generate_renditions")
+
+    def progress(self, stats):
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        self.stdout.write(
+            f"Строк: {stats['rows']} ({stats['rows'] / elapsed * 60:,.0f}/мин)"
+        )
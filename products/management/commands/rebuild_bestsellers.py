@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import bestsellers
+
+
+class Command(BaseCommand):
+    help = "Пересчитать продажи по дням для хитов продаж (и удалить устаревшие дни)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=bestsellers.KEEP_DAYS)
+
+    def handle(self, *args, **options):
+        rows = bestsellers.rebuild(days=options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Строк продаж: {rows}"))
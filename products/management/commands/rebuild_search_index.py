@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = "Перестроить поисковый индекс каталога"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        with transaction.atomic():
+            total = search.rebuild_index(batch_size=options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Проиндексировано товаров: {total} за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import inventory
+from products.models import Product, Variant
+
+
+class Command(BaseCommand):
+    help = "Сверить Product.available_stock с суммой остатков вариантов"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать расхождения, ничего не менять",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # Variant.stock шардированных вариантов — сумма шардов
+        if not options["dry_run"]:
+            inventory.sync_sharded_stock(
+                Variant.objects
+                .filter(stock_shards__gt=0)
+                .values_list("id", flat=True)
+            )
+
+        drifted = (
+            Product.objects
+            .annotate(actual_stock=inventory.available_stock_subquery())
+            .values_list("id", "available_stock", "actual_stock")
+            .order_by("id")
+        )
+
+        ids = []
+        for product_id, stored, actual in drifted.iterator(chunk_size=batch_size):
+            if stored != actual:
+                ids.append(product_id)
+                self.stdout.write(f"#{product_id}: {stored} → {actual}")
+
+        if options["dry_run"] or not ids:
+            self.stdout.write(f"Расхождений: {len(ids)}")
+            return
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with transaction.atomic():
+                inventory.stock_changed(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Исправлено товаров: {len(ids)}"))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import inventory
+from products.models import Variant
+
+
+class Command(BaseCommand):
+    help = "Разбить остаток «горячих» вариантов на шарды (распродажи)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("variant_ids", nargs="+", type=int)
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=inventory.DEFAULT_SHARDS,
+            help="Число шардов, 0 — вернуть обычный остаток",
+        )
+
+    def handle(self, *args, **options):
+        shards = options["shards"]
+
+        if not 0 <= shards <= 256:
+            raise CommandError("--shards: от 0 до 256")
+
+        ids = options["variant_ids"]
+        missing = set(ids) - set(Variant.objects.filter(pk__in=ids).values_list("id", flat=True))
+
+        if missing:
+            raise CommandError(f"Нет вариантов: {', '.join(map(str, sorted(missing)))}")
+
+        count = inventory.shard_stock(ids, shards)
+
+        self.stdout.write(self.style.SUCCESS(f"Вариантов: {count}, шардов: {shards}"))
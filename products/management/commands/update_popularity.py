@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import popularity
+
+
+class Command(BaseCommand):
+    help = "Пересчитать Product.popularity по заказам (для сортировки «Популярные»)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        changed = popularity.update_popularity(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Обновлено товаров: {changed}"))
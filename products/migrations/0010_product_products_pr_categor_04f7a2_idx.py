@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_products_pr_slug_3edc0c_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_active', 'created_at', 'id'], name='products_pr_categor_04f7a2_idx'),
+        ),
+    ]
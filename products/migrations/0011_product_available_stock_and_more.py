@@ -0,0 +1,43 @@
+# Generated by Django 6.0.2 on 2026-10-18 01:37
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_available_stock(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Variant = apps.get_model('products', 'Variant')
+
+    Product.objects.update(
+        available_stock=Coalesce(
+            Subquery(
+                Variant.objects
+                .filter(product=OuterRef('pk'))
+                .values('product')
+                .annotate(total=Sum('stock'))
+                .values('total')
+            ),
+            Value(0)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_product_products_pr_categor_04f7a2_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_stock',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Всего на складе'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_active', 'available_stock'], name='products_pr_categor_94c907_idx'),
+        ),
+        migrations.RunPython(fill_available_stock, migrations.RunPython.noop),
+    ]
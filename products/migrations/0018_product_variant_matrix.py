@@ -0,0 +1,74 @@
+# Generated by Django 6.0.2 on 2026-10-18 01:57
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+# копия products.inventory на момент миграции — живой модуль может меняться
+
+VARIANT_MATRIX_FIELDS = (
+    'product_id', 'id',
+    'size_id', 'size__name',
+    'color_id', 'color__name', 'color__hex_code',
+    'stock',
+)
+
+
+def build_variant_matrix(rows):
+    rows = list(rows)
+
+    if not rows:
+        return {}
+
+    sizes = sorted({(size_id, name) for _, size_id, name, *_ in rows if size_id})
+    colors = sorted(
+        {(color_id, name, hex_code) for _, _, _, color_id, name, hex_code, _ in rows if color_id},
+        key=lambda color: (color[1], color[0])
+    )
+
+    size_index = {size_id: i for i, (size_id, _) in enumerate(sizes)}
+    color_index = {color_id: i for i, (color_id, _, _) in enumerate(colors)}
+
+    return {
+        'sizes': [list(size) for size in sizes],
+        'colors': [list(color) for color in colors],
+        'variants': [
+            [variant_id, size_index.get(size_id), color_index.get(color_id), stock]
+            for variant_id, size_id, _, color_id, _, _, stock in sorted(rows)
+        ],
+    }
+
+
+def fill_variant_matrix(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Variant = apps.get_model('products', 'Variant')
+
+    rows = defaultdict(list)
+    for product_id, *row in Variant.objects.values_list(*VARIANT_MATRIX_FIELDS).iterator():
+        rows[product_id].append(row)
+
+    Product.objects.bulk_update(
+        [
+            Product(pk=pk, variant_matrix=build_variant_matrix(product_rows))
+            for pk, product_rows in rows.items()
+        ],
+        ['variant_matrix'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_productsales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='variant_matrix',
+            field=models.JSONField(default=dict, editable=False, verbose_name='Матрица вариантов'),
+        ),
+        migrations.RunPython(fill_variant_matrix, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_primary_image(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+
+    Product.objects.update(
+        primary_image=Subquery(
+            ProductImage.objects
+            .filter(product=OuterRef('pk'))
+            .order_by('order', 'id')
+            .values('id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_product_variant_matrix'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productimage', verbose_name='Главное фото'),
+        ),
+        migrations.RunPython(fill_primary_image, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_product_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variant',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, help_text='0 — остаток в stock; иначе он разбит на строки StockShard, а stock — их сумма (manage.py shard_stock)', verbose_name='Шардов остатка'),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('stock', models.PositiveIntegerField(default=0)),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='products.variant')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('variant', 'index'), name='unique_stock_shard'), models.CheckConstraint(condition=models.Q(('stock__gte', 0)), name='stock_shard_non_negative')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 02:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_stock_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sale', 'Продажа'), ('cancel', 'Отмена заказа'), ('restock', 'Поступление'), ('adjustment', 'Корректировка')], max_length=16, verbose_name='Тип')),
+                ('quantity', models.IntegerField(verbose_name='Количество')),
+                ('order_id', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Заказ')),
+                ('folded', models.BooleanField(default=False, verbose_name='Свёрнуто')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='products.variant')),
+            ],
+            options={
+                'verbose_name': 'Движение остатка',
+                'verbose_name_plural': 'Движения остатков',
+                'indexes': [models.Index(condition=models.Q(('folded', False)), fields=['variant'], name='stock_movement_pending')],
+            },
+        ),
+    ]
@@ -12,7 +12,8 @@ class Category(models.Model):
         blank=True,
         null=True
     )
-
+    # сгенерированные копии изображения, см. products.images
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Категория'
@@ -33,6 +34,29 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     is_active = models.BooleanField('Активен', default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # меняется и при изменении вариантов/фото — для инкрементальных фидов
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # сумма доступных остатков вариантов (снимок + журнал), см. products.inventory
+    available_stock = models.PositiveIntegerField('Всего на складе', default=0, editable=False)
+
+    # продажи с затуханием по времени, пересчитывает manage.py update_popularity
+    popularity = models.FloatField('Популярность', default=0, editable=False)
+
+    # первое фото по ProductImage.order — для карточек и корзины без
+    # загрузки всех фото; поддерживается products.images
+    primary_image = models.ForeignKey(
+        'ProductImage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        verbose_name='Главное фото'
+    )
+
+    # размеры × цвета с остатками для страницы товара, см. products.inventory
+    variant_matrix = models.JSONField('Матрица вариантов', default=dict, editable=False)
 
 
     class Meta:
@@ -42,6 +66,12 @@ class Product(models.Model):
             models.Index(fields=["slug"]),
             models.Index(fields=["category", "is_active"]),
             models.Index(fields=["is_active", "created_at"]),
+            # keyset-пагинация категории: (category, is_active) + seek по created_at
+            models.Index(fields=["category", "is_active", "created_at", "id"]),
+            models.Index(fields=["category", "is_active", "available_stock"]),
+            # сортировки каталога (products.sorting)
+            models.Index(fields=["category", "is_active", "price", "id"]),
+            models.Index(fields=["category", "is_active", "popularity", "id"]),
         ]
 
     def __str__(self):
@@ -52,13 +82,37 @@ class Product(models.Model):
 
     @property
     def in_stock(self):
-        return self.variants.filter(stock__gt=0).exists()
+        return self.available_stock > 0
+
+    # поддерживаются UPDATE'ами (products.inventory, products.images) —
+    # save() существующего товара их не пишет: загруженные значения могли устареть
+    DENORMALIZED_FIELDS = ("available_stock", "variant_matrix", "primary_image")
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        ):
+            # отложенные (.only/.defer) поля не трогаем — иначе Django
+            # дочитает каждое отдельным SELECT
+            skipped = set(self.DENORMALIZED_FIELDS) | self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in skipped
+                and field.attname not in skipped
+            ]
+
+        super().save(*args, **kwargs)
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField('Фото', upload_to='products/')
     order = models.PositiveIntegerField('Порядок', default=0)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         ordering = ['order']
@@ -84,15 +138,46 @@ class Variant(models.Model):
     color = models.ForeignKey(Color, on_delete=models.SET_NULL, null=True, blank=True)
     size = models.ForeignKey(Size, on_delete=models.SET_NULL, null=True, blank=True)
     stock = models.PositiveIntegerField('На складе', default=0)
+    stock_shards = models.PositiveSmallIntegerField(
+        'Шардов остатка',
+        default=0,
+        editable=False,
+        help_text='0 — остаток в stock; иначе он разбит на строки StockShard, '
+                  'а stock — их сумма (manage.py shard_stock)'
+    )
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["product", "color", "size"],
                 name="unique_product_variant"
-            )
+            ),
         ]
 
+    # остаток на момент загрузки: разницу при save() пишем в журнал
+    # (products.signals) без повторного SELECT
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_stock()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if fields is None or "stock" in fields:
+            self._remember_stock()
+
+    def _remember_stock(self):
+        self._loaded_stock = None if "stock" in self.get_deferred_fields() else self.stock
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "stock" in update_fields:
+            self._remember_stock()
+
     def delete(self, *args, **kwargs):
         from orders.models import OrderItem
 
@@ -104,4 +189,121 @@ class Variant(models.Model):
         super().delete(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.product} - {self.size} {self.color}"
\ No newline at end of file
+        return f"{self.product} - {self.size} {self.color}"
+
+
+class StockShard(models.Model):
+    """Часть остатка «горячего» варианта: покупатели списывают из разных строк."""
+
+    variant = models.ForeignKey(Variant, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["variant", "index"],
+                name="unique_stock_shard"
+            ),
+            models.CheckConstraint(
+                condition=models.Q(stock__gte=0),
+                name="stock_shard_non_negative"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.variant} #{self.index}"
+
+
+class StockMovement(models.Model):
+    """Движение остатка варианта (журнал), см. products.inventory."""
+
+    KIND_SALE = 'sale'
+    KIND_CANCEL = 'cancel'
+    KIND_RESTOCK = 'restock'
+    KIND_ADJUSTMENT = 'adjustment'
+
+    KIND_CHOICES = [
+        (KIND_SALE, 'Продажа'),
+        (KIND_CANCEL, 'Отмена заказа'),
+        (KIND_RESTOCK, 'Поступление'),
+        (KIND_ADJUSTMENT, 'Корректировка'),
+    ]
+
+    variant = models.ForeignKey(Variant, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField('Тип', max_length=16, choices=KIND_CHOICES)
+    quantity = models.IntegerField('Количество')  # + приход, − расход
+    order_id = models.PositiveBigIntegerField('Заказ', null=True, blank=True)
+    # учтено в Variant.stock
+    folded = models.BooleanField('Свёрнуто', default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Движение остатка'
+        verbose_name_plural = 'Движения остатков'
+        indexes = [
+            models.Index(
+                fields=["variant"],
+                condition=models.Q(folded=False),
+                name="stock_movement_pending"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d}"
+
+
+class SearchPosting(models.Model):
+    """Строка инвертированного индекса поиска: основа слова → товар."""
+
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_postings')
+    weight = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["term", "product"],
+                name="unique_search_posting"
+            )
+        ]
+
+
+class RelatedProduct(models.Model):
+    """«С этим товаром покупают»: top-N похожих товаров, см. products.recommendations."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_links')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "rank"],
+                name="unique_related_product_rank"
+            )
+        ]
+
+
+class ProductSales(models.Model):
+    """Продажи товара за день (штуки), см. products.bestsellers."""
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    # копия product.category_id на момент продажи — рейтинг категории без JOIN
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "day"],
+                name="unique_product_sales_day"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["category", "day"]),
+            models.Index(fields=["day"]),
+        ]
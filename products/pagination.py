@@ -0,0 +1,133 @@
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.http import Http404
+
+from . import sorting
+from .models import Product
+
+
+# ==============================
+# Keyset (cursor) пагинация
+# ==============================
+#
+# Вместо OFFSET страница ищется по ключу (поле сортировки, id) последнего
+# показанного товара: стоимость глубокой страницы такая же, как первой,
+# и COUNT(*) не нужен.
+
+CURSOR_SALT = "products.cursor"
+
+
+def encode_cursor(product, sort=sorting.DEFAULT_SORT):
+    field, _ = sorting.sort_field(sort)
+    return signing.dumps(
+        [sort, Product._meta.get_field(field).value_to_string(product), product.pk],
+        salt=CURSOR_SALT
+    )
+
+
+def decode_cursor(token, sort=sorting.DEFAULT_SORT):
+    try:
+        cursor_sort, value, pk = signing.loads(token, salt=CURSOR_SALT)
+        if cursor_sort != sort:
+            raise ValueError(cursor_sort)
+
+        field, _ = sorting.sort_field(sort)
+        return Product._meta.get_field(field).to_python(value), int(pk)
+    except (signing.BadSignature, TypeError, ValueError, ValidationError):
+        raise Http404("Некорректная страница")
+
+
+def _seek(field, value, pk, descending):
+    """Строки строго после (value, pk) в заданном направлении."""
+    lookup = "lt" if descending else "gt"
+    return (
+        Q(**{f"{field}__{lookup}": value})
+        | Q(**{field: value, f"id__{lookup}": pk})
+    )
+
+
+class CursorPage:
+    """Аналог django Page для keyset-пагинации (без номера и count)."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_by_cursor(queryset, page_size, after=None, before=None, sort=sorting.DEFAULT_SORT):
+    """
+    Страница товаров в порядке сортировки sort (см. products.sorting).
+
+    after  — страница после товара из курсора (вперёд)
+    before — страница перед товаром из курсора (назад)
+    """
+    field, descending = sorting.sort_field(sort)
+
+    if before:
+        value, pk = decode_cursor(before, sort)
+        rows = list(
+            queryset
+            .filter(_seek(field, value, pk, not descending))
+            .order_by(*sorting.ordering(sort, reverse=True))[:page_size + 1]
+        )
+        has_previous = len(rows) > page_size
+        object_list = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            value, pk = decode_cursor(after, sort)
+            queryset = queryset.filter(_seek(field, value, pk, descending))
+
+        rows = list(queryset.order_by(*sorting.ordering(sort))[:page_size + 1])
+        has_next = len(rows) > page_size
+        object_list = rows[:page_size]
+        has_previous = bool(after)
+
+    if not object_list:
+        return CursorPage([])
+
+    return CursorPage(
+        object_list,
+        next_cursor=encode_cursor(object_list[-1], sort) if has_next else None,
+        previous_cursor=encode_cursor(object_list[0], sort) if has_previous else None,
+    )
+
+
+# ==============================
+# Страница из кэша
+# ==============================
+
+class CachedPagePaginator(Paginator):
+    """
+    Пагинатор закэшированной страницы: товары страницы и count уже
+    известны, в БД не ходит. object_list — только товары этой страницы.
+    """
+
+    def __init__(self, page_objects, count, per_page, **kwargs):
+        super().__init__(page_objects, per_page, **kwargs)
+        self.cached_count = count
+
+    @property
+    def count(self):
+        return self.cached_count
+
+    def page(self, number):
+        return Page(self.object_list, self.validate_number(number), self)
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import Product
+
+
+# ==============================
+# Популярность товаров
+# ==============================
+#
+# Product.popularity — проданные штуки с весом по давности заказа.
+# Считается одним агрегатом по OrderItem и записывается пачками, чтобы
+# сортировка «Популярные» читала готовую колонку из индекса.
+
+WINDOWS = [
+    # (дней назад, вес)
+    (7, 4),
+    (30, 2),
+    (90, 1),
+]
+
+
+def compute_scores(now=None):
+    from orders.models import Order, OrderItem
+
+    now = now or timezone.now()
+
+    weight = Case(
+        *[
+            When(order__created_at__gte=now - timedelta(days=days), then=value)
+            for days, value in WINDOWS
+        ],
+        default=0,
+        output_field=IntegerField(),
+    )
+
+    rows = (
+        OrderItem.objects
+        .filter(
+            product__isnull=False,
+            order__created_at__gte=now - timedelta(days=WINDOWS[-1][0]),
+        )
+        .exclude(order__status=Order.STATUS_CANCELLED)
+        .values("product_id")
+        .annotate(score=Sum(F("quantity") * weight))
+    )
+
+    return {row["product_id"]: float(row["score"] or 0) for row in rows}
+
+
+def update_popularity(batch_size=1000, now=None):
+    """Записать новые значения; возвращает число изменённых товаров."""
+    scores = compute_scores(now)
+
+    changed = []
+    for pk, category_id, old in (
+        Product.objects
+        .order_by("id")
+        .values_list("id", "category_id", "popularity")
+        .iterator(chunk_size=batch_size)
+    ):
+        new = scores.get(pk, 0.0)
+        if new != old:
+            changed.append((Product(pk=pk, popularity=new), category_id))
+
+    with transaction.atomic():
+        Product.objects.bulk_update(
+            [product for product, _ in changed],
+            ["popularity"],
+            batch_size=batch_size,
+        )
+
+        catalog_cache.bump_products(product.pk for product, _ in changed)
+        catalog_cache.bump_categories(category_id for _, category_id in changed)
+
+    return len(changed)
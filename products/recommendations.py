@@ -0,0 +1,152 @@
+from array import array
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import Product, RelatedProduct
+
+
+# ==============================
+# «С этим товаром покупают»
+# ==============================
+#
+# Ночная пересборка (manage.py build_recommendations): корзины заказов
+# выгружаются одним запросом в матрицу заказы × товары, сходство товаров —
+# косинус по совместным покупкам (Bᵀ·B, нормированная на число заказов
+# каждого товара). Для каждого товара в RelatedProduct сохраняется top-N,
+# страница товара читает его одним запросом по индексу.
+
+TOP_N = 12
+HISTORY_DAYS = 365
+
+
+def load_baskets(days=HISTORY_DAYS, chunk_size=10000):
+    """Пары (заказ, товар) неотменённых заказов — компактными массивами."""
+    from orders.models import Order, OrderItem
+
+    order_ids = array("q")
+    product_ids = array("q")
+
+    rows = (
+        OrderItem.objects
+        .filter(
+            product__isnull=False,
+            order__created_at__gte=timezone.now() - timedelta(days=days),
+        )
+        .exclude(order__status=Order.STATUS_CANCELLED)
+        .values_list("order_id", "product_id")
+    )
+
+    for order_id, product_id in rows.iterator(chunk_size=chunk_size):
+        order_ids.append(order_id)
+        product_ids.append(product_id)
+
+    return order_ids, product_ids
+
+
+def similarity_matrix(order_ids, product_ids, min_support=1):
+    """
+    Косинусное сходство товаров по корзинам.
+    Возвращает (id товаров, csr-матрица сходства с нулевой диагональю).
+    """
+    import numpy as np
+    from scipy import sparse
+
+    orders = np.frombuffer(order_ids, dtype=np.int64)
+    products = np.frombuffer(product_ids, dtype=np.int64)
+
+    basket_ids, rows = np.unique(orders, return_inverse=True)
+    ids, cols = np.unique(products, return_inverse=True)
+
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(basket_ids), len(ids)),
+    )
+    # товар несколькими строками в одном заказе считается один раз
+    baskets.sum_duplicates()
+    baskets.data[:] = 1
+
+    counts = (baskets.T @ baskets).tocsr()
+    bought = counts.diagonal()
+
+    counts.setdiag(0)
+    if min_support > 1:
+        counts.data[counts.data < min_support] = 0
+    counts.eliminate_zeros()
+
+    scale = sparse.diags(1 / np.sqrt(np.maximum(bought, 1)))
+    return ids, (scale @ counts @ scale).tocsr()
+
+
+def top_related(ids, similarity, allowed, n=TOP_N):
+    """(товар, похожий товар, ранг, сходство) — только среди allowed."""
+    import numpy as np
+    from scipy import sparse
+
+    mask = np.isin(ids, np.fromiter(allowed, dtype=np.int64, count=len(allowed)))
+
+    # похожими могут быть только разрешённые товары — обнуляем остальные столбцы
+    similarity = (similarity @ sparse.diags(mask.astype(np.float32))).tocsr()
+    similarity.eliminate_zeros()
+
+    for row in np.flatnonzero(mask):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        if start == end:
+            continue
+
+        scores = similarity.data[start:end]
+        columns = similarity.indices[start:end]
+
+        if len(scores) > n:
+            keep = np.argpartition(-scores, n - 1)[:n]
+            scores, columns = scores[keep], columns[keep]
+
+        # по убыванию сходства, при равенстве — по id
+        order = np.lexsort((ids[columns], -scores))
+
+        for rank, i in enumerate(order, start=1):
+            yield int(ids[row]), int(ids[columns[i]]), rank, float(scores[i])
+
+
+def build_recommendations(n=TOP_N, days=HISTORY_DAYS, min_support=1, batch_size=5000):
+    order_ids, product_ids = load_baskets(days)
+
+    active = set(
+        Product.objects
+        .filter(is_active=True)
+        .values_list("id", flat=True)
+    )
+
+    links = []
+    if product_ids:
+        ids, similarity = similarity_matrix(order_ids, product_ids, min_support)
+        links = top_related(ids, similarity, active, n)
+
+    total = 0
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+
+        batch = []
+        for product_id, related_id, rank, score in links:
+            batch.append(RelatedProduct(
+                product_id=product_id,
+                related_id=related_id,
+                rank=rank,
+                score=score,
+            ))
+
+            if len(batch) >= batch_size:
+                RelatedProduct.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+
+        RelatedProduct.objects.bulk_create(batch)
+        total += len(batch)
+
+        # блоки рекомендаций на страницах товаров
+        catalog_cache.bump_catalog()
+
+    return total
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from .models import Category, ProductImage
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# ==============================
+# Ресайз по запросу
+# ==============================
+#
+# /media/r/<w>x<h>/<path> — копия изображения, вписанная в w×h (0 — любая
+# сторона). Результат лежит в дисковом кэше под ключом из хэша содержимого
+# оригинала и размера: одинаковые файлы под разными именами делят копии.
+# Кэш ограничен по объёму, вытесняются давно не запрошенные файлы (LRU
+# по mtime, который обновляется при каждом попадании).
+
+ALLOWED_DIMENSIONS = {0, 80, 160, 240, 320, 480, 640, 800, 960, 1200, 1600}
+
+ALLOWED_PREFIXES = tuple(
+    model._meta.get_field("image").upload_to
+    for model in (ProductImage, Category)
+)
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+class InvalidResize(Exception):
+    pass
+
+
+def cache_dir():
+    return str(getattr(settings, "IMAGE_RESIZE_CACHE_DIR", settings.BASE_DIR / "cache" / "resize"))
+
+
+def max_cache_bytes():
+    return getattr(settings, "IMAGE_RESIZE_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+
+
+def source_path(path):
+    path = os.path.normpath(path).replace(os.sep, "/")
+
+    if path.startswith(("/", "..")) or not path.startswith(ALLOWED_PREFIXES):
+        raise InvalidResize(path)
+
+    full_path = default_storage.path(path)
+
+    if not os.path.isfile(full_path):
+        raise InvalidResize(path)
+
+    return full_path
+
+
+def content_hash(full_path):
+    """sha256 содержимого; запоминается по (путь, размер, mtime)."""
+    stat = os.stat(full_path)
+    memo_key = "resize:hash:" + hashlib.sha1(
+        f"{full_path}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+
+    digest = cache.get(memo_key)
+
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        cache.set(memo_key, digest, None)
+
+    return digest
+
+
+def cached_path(digest, width, height, ext):
+    key = hashlib.sha256(f"{digest}:{width}x{height}".encode()).hexdigest()
+    return os.path.join(cache_dir(), key[:2], f"{key}.{ext}")
+
+
+# ==============================
+# Схлопывание одновременных запросов
+# ==============================
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def render_lock(path):
+    """
+    Один рендер на копию: потоки — через Lock на копию, процессы — через
+    flock на каталог-шард (файлы блокировок не накапливаются).
+    """
+    with _locks_guard:
+        lock = _locks.setdefault(path, threading.Lock())
+
+    with lock:
+        if fcntl is None:
+            yield
+        else:
+            with open(os.path.join(os.path.dirname(path), ".lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    with _locks_guard:
+        if _locks.get(path) is lock and not lock.locked():
+            del _locks[path]
+
+
+def render(full_path, target, width, height, ext):
+    from PIL import Image, ImageOps
+
+    image_format, _, options = FORMATS[ext]
+
+    try:
+        with Image.open(full_path) as image:
+            box = (width or image.width, height or image.height)
+            image.draft("RGB", box)
+            image = ImageOps.exif_transpose(image)
+
+            # не увеличиваем
+            image.thumbnail(box, Image.LANCZOS)
+
+            if ext == "jpg" or image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix="." + ext)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, image_format, **options)
+                os.replace(tmp, target)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    except (OSError, Image.DecompressionBombError) as exc:
+        # повреждённый файл или не изображение — для запроса это «нет копии»
+        raise InvalidResize(full_path) from exc
+
+
+def get_resized(path, width, height, ext):
+    """Путь к готовой копии (создаёт при первом запросе)."""
+    if width not in ALLOWED_DIMENSIONS or height not in ALLOWED_DIMENSIONS:
+        raise InvalidResize(f"{width}x{height}")
+
+    if not width and not height:
+        raise InvalidResize(f"{width}x{height}")
+
+    full_path = source_path(path)
+    target = cached_path(content_hash(full_path), width, height, ext)
+
+    if os.path.exists(target):
+        touch(target)
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    with render_lock(target):
+        # пока ждали блокировку, копию мог сделать другой запрос
+        if not os.path.exists(target):
+            render(full_path, target, width, height, ext)
+            track_write(os.path.getsize(target))
+
+    return target
+
+
+def open_resized(path, width, height, ext):
+    """Открытая копия; если её вытеснили между созданием и открытием — заново."""
+    for attempt in range(2):
+        target = get_resized(path, width, height, ext)
+        try:
+            return open(target, "rb")
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+# ==============================
+# LRU-вытеснение
+# ==============================
+
+_usage = {"bytes": None}
+_usage_lock = threading.Lock()
+
+
+def touch(target):
+    try:
+        os.utime(target)
+    except OSError:
+        pass
+
+
+def scan():
+    files = []
+    for root, _, names in os.walk(cache_dir()):
+        for name in names:
+            # блокировки и недописанные временные файлы не трогаем
+            if name.endswith(".lock") or name.startswith("tmp"):
+                continue
+            full = os.path.join(root, name)
+            try:
+                stat = os.stat(full)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, full))
+    return files
+
+
+def track_write(size):
+    with _usage_lock:
+        if _usage["bytes"] is None:
+            _usage["bytes"] = sum(f[1] for f in scan())
+        else:
+            _usage["bytes"] += size
+
+        if _usage["bytes"] > max_cache_bytes():
+            _usage["bytes"] = evict()
+
+
+def evict():
+    """Удалить самые старые по доступу файлы до 90% лимита."""
+    files = sorted(scan())
+    total = sum(size for _, size, _ in files)
+    limit = max_cache_bytes() * 0.9
+
+    for _, size, full in files:
+        if total <= limit:
+            break
+        try:
+            os.unlink(full)
+            total -= size
+        except OSError:
+            pass
+
+    return total
@@ -0,0 +1,296 @@
+import math
+import re
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Product, SearchPosting
+from .stemmer import stem
+
+
+# ==============================
+# Поиск по каталогу
+# ==============================
+#
+# Инвертированный индекс хранится в SearchPosting (term → product, weight)
+# и обновляется сигналами при сохранении товара. Словарь основ с
+# триграммами держится в памяти процесса и перечитывается, когда
+# меняется версия индекса в кэше.
+
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "category": 2.0,
+    "description": 1.0,
+}
+
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "для", "по", "из", "к", "ко", "от",
+    "до", "не", "за", "о", "об", "а", "но", "или", "у", "the", "and", "for",
+}
+
+MIN_SIMILARITY = 0.3  # как pg_trgm.similarity_threshold
+MAX_FUZZY_TERMS = 3
+PREFIX_FACTOR = 0.8
+
+VERSION_KEY = "search:index:v"
+
+TOKEN_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+
+# ==============================
+# Анализ текста
+# ==============================
+
+def tokenize(text):
+    text = (text or "").lower().replace("ё", "е")
+    return [token for token in TOKEN_RE.findall(text) if token not in STOP_WORDS]
+
+
+def analyze(text):
+    terms = []
+    for token in tokenize(text):
+        term = stem(token) if CYRILLIC_RE.search(token) else token
+        if term:
+            terms.append(term[:64])
+    return terms
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ==============================
+# Индексация
+# ==============================
+
+def build_postings(product, category_name=None):
+    if category_name is None:
+        category_name = product.category.name
+
+    weights = defaultdict(float)
+    fields = {
+        "name": product.name,
+        "category": category_name,
+        "description": product.description,
+    }
+
+    for field, text in fields.items():
+        for term in analyze(text):
+            weights[term] += FIELD_WEIGHTS[field]
+
+    return [
+        SearchPosting(term=term, product_id=product.pk, weight=weight)
+        for term, weight in weights.items()
+    ]
+
+
+def index_products(products):
+    """Переиндексировать товары (неактивные только удаляются из индекса)."""
+    products = list(products)
+
+    if not products:
+        return
+
+    with transaction.atomic():
+        SearchPosting.objects.filter(product__in=[p.pk for p in products]).delete()
+
+        postings = []
+        for product in products:
+            if product.is_active:
+                postings.extend(build_postings(product))
+
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+    bump_version()
+    # другие процессы могли перечитать словарь до коммита
+    transaction.on_commit(bump_version)
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+# ==============================
+# Словарь (в памяти процесса)
+# ==============================
+
+class Vocabulary:
+
+    def __init__(self, terms, doc_count):
+        self.terms = sorted(terms)
+        self.term_set = set(self.terms)
+        self.doc_count = doc_count
+        self.by_trigram = defaultdict(list)
+        self.gram_count = {}
+
+        for term in self.terms:
+            grams = trigrams(term)
+            self.gram_count[term] = len(grams)
+            for gram in grams:
+                self.by_trigram[gram].append(term)
+
+    def with_prefix(self, prefix):
+        start = bisect_left(self.terms, prefix)
+        result = []
+        for term in self.terms[start:]:
+            if not term.startswith(prefix):
+                break
+            result.append(term)
+        return result
+
+    def similar(self, term):
+        grams = trigrams(term)
+        shared = defaultdict(int)
+
+        for gram in grams:
+            for candidate in self.by_trigram.get(gram, ()):
+                shared[candidate] += 1
+
+        scored = []
+        for candidate, common in shared.items():
+            similarity = common / (len(grams) + self.gram_count[candidate] - common)
+            if similarity >= MIN_SIMILARITY:
+                scored.append((similarity, candidate))
+
+        scored.sort(reverse=True)
+        return [(candidate, similarity) for similarity, candidate in scored[:MAX_FUZZY_TERMS]]
+
+
+_vocabulary = {"version": None, "value": None}
+
+
+def get_vocabulary():
+    version = cache.get(VERSION_KEY)
+
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+
+    if _vocabulary["version"] != version:
+        terms = SearchPosting.objects.values_list("term", flat=True).distinct()
+        doc_count = SearchPosting.objects.values("product").distinct().count()
+
+        _vocabulary["value"] = Vocabulary(terms, doc_count)
+        _vocabulary["version"] = version
+
+    return _vocabulary["value"]
+
+
+# ==============================
+# Поиск
+# ==============================
+
+def expand_terms(terms, vocabulary):
+    """
+    Основа слова → {термин словаря: коэффициент}.
+    Точное совпадение, затем префикс (ввод не дописан), затем триграммы (опечатки).
+    """
+    expanded = []
+
+    for term in terms:
+        if term in vocabulary.term_set:
+            expanded.append({term: 1.0})
+            continue
+
+        matches = {}
+
+        if len(term) >= 3:
+            for candidate in vocabulary.with_prefix(term)[:MAX_FUZZY_TERMS]:
+                matches[candidate] = PREFIX_FACTOR
+
+        for candidate, similarity in vocabulary.similar(term):
+            matches[candidate] = max(matches.get(candidate, 0), similarity)
+
+        expanded.append(matches)
+
+    return expanded
+
+
+def search_product_ids(query):
+    """Id активных товаров по убыванию релевантности."""
+    terms = list(dict.fromkeys(analyze(query)))
+
+    if not terms:
+        return []
+
+    vocabulary = get_vocabulary()
+    expanded = expand_terms(terms, vocabulary)
+
+    all_terms = set()
+    for matches in expanded:
+        all_terms.update(matches)
+
+    if not all_terms:
+        return []
+
+    postings = defaultdict(list)
+    for term, product_id, weight in (
+        SearchPosting.objects
+        .filter(term__in=all_terms)
+        .values_list("term", "product_id", "weight")
+    ):
+        postings[term].append((product_id, weight))
+
+    doc_count = max(vocabulary.doc_count, 1)
+    scores = defaultdict(float)
+    matched = defaultdict(int)
+
+    for matches in expanded:
+        term_scores = defaultdict(float)
+
+        for term, factor in matches.items():
+            rows = postings.get(term, ())
+            idf = math.log(1 + doc_count / (1 + len(rows)))
+
+            for product_id, weight in rows:
+                # насыщение по весу поля (как в BM25)
+                score = factor * idf * weight / (weight + 1.0)
+                term_scores[product_id] = max(term_scores[product_id], score)
+
+        for product_id, score in term_scores.items():
+            scores[product_id] += score
+            matched[product_id] += 1
+
+    # товары, совпавшие по большему числу слов запроса, — выше
+    ranked = sorted(
+        scores,
+        key=lambda pk: (-matched[pk], -scores[pk], pk)
+    )
+
+    return ranked
+
+
+def rebuild_index(batch_size=500):
+    SearchPosting.objects.all().delete()
+
+    queryset = (
+        Product.objects
+        .filter(is_active=True)
+        .select_related("category")
+        .only("id", "name", "description", "is_active", "category__name")
+        .order_by("id")
+    )
+
+    batch = []
+    total = 0
+
+    for product in queryset.iterator(chunk_size=batch_size):
+        batch.extend(build_postings(product))
+        total += 1
+
+        if len(batch) >= batch_size:
+            SearchPosting.objects.bulk_create(batch, batch_size=batch_size)
+            batch = []
+
+    SearchPosting.objects.bulk_create(batch, batch_size=batch_size)
+    bump_version()
+
+    return total
@@ -0,0 +1,209 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache as catalog_cache
+from . import images
+from . import inventory
+from . import search
+from .models import Category, Product, ProductImage, StockMovement, Variant, Color, Size
+
+
+# ==============================
+# Инвалидация кэша каталога
+# ==============================
+
+@receiver(pre_save, sender=Product)
+def remember_old_category(sender, instance, raw=False, **kwargs):
+    # при переносе товара в другую категорию сбрасываем обе
+    instance._old_category_id = None
+
+    if raw or not instance.pk:
+        return
+
+    instance._old_category_id = (
+        Product.objects
+        .filter(pk=instance.pk)
+        .values_list("category_id", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    catalog_cache.bump_products([instance.pk])
+    catalog_cache.bump_categories([
+        instance.category_id,
+        getattr(instance, "_old_category_id", None),
+    ])
+
+
+@receiver(pre_save, sender=Variant)
+def remember_old_stock(sender, instance, raw=False, **kwargs):
+    # Variant.stock задан целиком (админка) — разница пойдёт в журнал;
+    # прежний остаток — снимок from_db, SELECT только для объекта без него
+    instance._old_stock = 0
+
+    if raw or not instance.pk:
+        return
+
+    instance._old_stock = getattr(instance, "_loaded_stock", None)
+
+    if instance._old_stock is None:
+        instance._old_stock = (
+            Variant.objects
+            .filter(pk=instance.pk)
+            .values_list("stock", flat=True)
+            .first()
+        ) or 0
+
+
+@receiver(post_save, sender=Variant)
+def variant_stock_recorded(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and "stock" not in update_fields):
+        return
+
+    inventory.record_movements(
+        StockMovement.KIND_RESTOCK if created else StockMovement.KIND_ADJUSTMENT,
+        {instance.pk: instance.stock - getattr(instance, "_old_stock", instance.stock)},
+        folded=True,
+    )
+
+
+@receiver(post_save, sender=Variant)
+def variant_shards_resplit(sender, instance, raw=False, update_fields=None, **kwargs):
+    # остаток «горячего» варианта сохранён целиком — по шардам заново
+    if raw or not instance.stock_shards:
+        return
+
+    if update_fields is None or "stock" in update_fields:
+        inventory.resplit_stock(instance)
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+def variant_stock_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    inventory.refresh_available_stock([instance.product_id])
+
+    # держим в актуальном состоянии и загруженный товар
+    if Variant.product.is_cached(instance):
+        try:
+            instance.product.refresh_from_db(fields=["available_stock", "variant_matrix"])
+        except Product.DoesNotExist:
+            pass
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_part_changed(sender, instance, **kwargs):
+    category_id = (
+        Product.objects
+        .filter(pk=instance.product_id)
+        .values_list("category_id", flat=True)
+        .first()
+    )
+
+    catalog_cache.bump_products([instance.product_id])
+    catalog_cache.bump_categories([category_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, raw=False, **kwargs):
+    # главное фото могло смениться; фото попадает в фиды — товар
+    # считается изменённым (updated_at)
+    if not raw:
+        images.refresh_primary_images([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    catalog_cache.bump_categories([instance.pk])
+    # название/slug категории выводится на страницах товаров
+    catalog_cache.bump_catalog()
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+def dictionary_changed(sender, instance, **kwargs):
+    catalog_cache.bump_catalog()
+
+
+# ==============================
+# Матрица вариантов
+# ==============================
+
+def _variant_product_ids(instance):
+    field = "color" if isinstance(instance, Color) else "size"
+    return set(
+        Variant.objects
+        .filter(**{field: instance})
+        .values_list("product_id", flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Color)
+@receiver(pre_delete, sender=Size)
+def remember_dictionary_products(sender, instance, **kwargs):
+    # после удаления у вариантов уже NULL — товары запоминаем заранее
+    instance._variant_product_ids = _variant_product_ids(instance)
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Color)
+@receiver(post_delete, sender=Size)
+def refresh_dictionary_matrix(sender, instance, raw=False, created=False, **kwargs):
+    # названия размеров/цветов хранятся в матрице
+    if raw or created:
+        return
+
+    product_ids = getattr(instance, "_variant_product_ids", None)
+    if product_ids is None:
+        product_ids = _variant_product_ids(instance)
+
+    inventory.refresh_variant_matrix(product_ids)
+
+
+# ==============================
+# Поисковый индекс
+# ==============================
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    # строки индекса удаляются каскадом
+    search.bump_version()
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_products(
+            Product.objects.filter(category=instance).select_related("category")
+        )
+
+
+# ==============================
+# Копии изображений
+# ==============================
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def render_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule(instance)
+
@@ -0,0 +1,179 @@
+import json
+import os
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Q
+
+from .feeds import absolute_url
+from .models import Category, Product
+
+
+# ==============================
+# Sitemap
+# ==============================
+#
+# Файлы генерируются командой generate_sitemaps и отдаются как статика:
+#
+#   sitemap.xml                — индекс
+#   sitemap-categories.xml     — все категории
+#   sitemap-products-<N>.xml   — товары с id в [N·SHARD_SIZE, (N+1)·SHARD_SIZE)
+#
+# Шард по диапазону id меняется только при изменении своих товаров, поэтому
+# при повторном запуске сравнивается «подпись» шарда (число активных товаров
+# и max(updated_at)) с прошлой и перезаписываются только изменившиеся.
+
+SHARD_SIZE = 10000  # протокол допускает до 50 000 URL в файле
+
+INDEX_NAME = "sitemap.xml"
+CATEGORIES_NAME = "sitemap-categories.xml"
+STATE_NAME = "sitemap-state.json"
+
+XMLNS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+
+
+def sitemap_dir():
+    return str(getattr(settings, "SITEMAP_DIR", settings.BASE_DIR / "sitemaps"))
+
+
+def shard_name(shard):
+    return f"sitemap-products-{shard}.xml"
+
+
+def _lastmod(value):
+    return f"<lastmod>{value.date().isoformat()}</lastmod>" if value else ""
+
+
+def _write(name, lines):
+    path = os.path.join(sitemap_dir(), name)
+
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+
+    os.replace(path + ".tmp", path)
+
+
+def _urlset(entries):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<urlset xmlns="{XMLNS}">\n'
+
+    for url, lastmod in entries:
+        yield f"<url><loc>{escape(url)}</loc>{_lastmod(lastmod)}</url>\n"
+
+    yield "</urlset>\n"
+
+
+def _sitemap_index(entries):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield f'<sitemapindex xmlns="{XMLNS}">\n'
+
+    for name, lastmod in entries:
+        yield f"<sitemap><loc>{escape(absolute_url('/' + name))}</loc>{_lastmod(lastmod)}</sitemap>\n"
+
+    yield "</sitemapindex>\n"
+
+
+# ==============================
+# Содержимое шардов
+# ==============================
+
+def shard_signatures():
+    """{шард: (число товаров, max updated_at)} — один GROUP BY."""
+    rows = (
+        Product.objects
+        .filter(is_active=True)
+        .annotate(shard=F("id") / SHARD_SIZE)
+        .values("shard")
+        .annotate(count=Count("id"), last=Max("updated_at"))
+        .order_by("shard")
+    )
+    return {row["shard"]: (row["count"], row["last"]) for row in rows}
+
+
+def product_entries(shard):
+    queryset = (
+        Product.objects
+        .filter(
+            is_active=True,
+            id__gte=shard * SHARD_SIZE,
+            id__lt=(shard + 1) * SHARD_SIZE,
+        )
+        .only("id", "slug", "updated_at")
+        .order_by("id")
+    )
+
+    for product in queryset.iterator(chunk_size=2000):
+        yield absolute_url(product.get_absolute_url()), product.updated_at
+
+
+def category_entries():
+    queryset = (
+        Category.objects
+        .annotate(last=Max("products__updated_at", filter=Q(products__is_active=True)))
+        .only("id", "slug")
+        .order_by("id")
+    )
+
+    for category in queryset:
+        yield absolute_url(category.get_absolute_url()), category.last
+
+
+# ==============================
+# Генерация
+# ==============================
+
+def _load_state():
+    try:
+        with open(os.path.join(sitemap_dir(), STATE_NAME), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    # при смене размера шарда старые файлы не подходят
+    if state.get("shard_size") != SHARD_SIZE:
+        return {}
+
+    return state.get("shards", {})
+
+
+def write_sitemaps(full=False):
+    os.makedirs(sitemap_dir(), exist_ok=True)
+
+    previous = {} if full else _load_state()
+    signatures = shard_signatures()
+
+    state = {}
+    written = 0
+
+    for shard, (count, last) in signatures.items():
+        signature = [count, last.isoformat() if last else None]
+        state[str(shard)] = signature
+
+        path = os.path.join(sitemap_dir(), shard_name(shard))
+        if previous.get(str(shard)) == signature and os.path.exists(path):
+            continue
+
+        _write(shard_name(shard), _urlset(product_entries(shard)))
+        written += 1
+
+    # шарды, в которых не осталось активных товаров
+    current = {shard_name(shard) for shard in signatures}
+    for name in os.listdir(sitemap_dir()):
+        if name.startswith("sitemap-products-") and name not in current:
+            os.unlink(os.path.join(sitemap_dir(), name))
+
+    # категорий немного — файл пересобирается всегда
+    categories = list(category_entries())
+    _write(CATEGORIES_NAME, _urlset(categories))
+
+    index = [(CATEGORIES_NAME, max((last for _, last in categories if last), default=None))]
+    index += [(shard_name(shard), last) for shard, (_, last) in signatures.items()]
+
+    _write(INDEX_NAME, _sitemap_index(index))
+
+    with open(os.path.join(sitemap_dir(), STATE_NAME), "w", encoding="utf-8") as f:
+        json.dump({"shard_size": SHARD_SIZE, "shards": state}, f)
+
+    return {"shards": len(signatures), "written": written}
+
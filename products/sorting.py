@@ -0,0 +1,43 @@
+# ==============================
+# Сортировка каталога
+# ==============================
+#
+# Каждой сортировке соответствует составной индекс
+# (category, is_active, <поле>, id) в Product.Meta.indexes: выборка
+# страницы категории — проход по диапазону индекса без сортировки в памяти.
+# id в конце делает порядок однозначным (нужно для keyset-пагинации).
+# Направление у поля и id всегда одно — индекс читается в обе стороны.
+
+SORTS = {
+    "new": ("Новинки", "created_at", True),
+    "price_asc": ("Сначала дешевле", "price", False),
+    "price_desc": ("Сначала дороже", "price", True),
+    "popular": ("Популярные", "popularity", True),
+}
+
+DEFAULT_SORT = "new"
+
+
+def parse_sort(params):
+    sort = params.get("sort")
+    return sort if sort in SORTS else DEFAULT_SORT
+
+
+def sort_field(sort):
+    """(поле, по убыванию)"""
+    _, field, descending = SORTS[sort]
+    return field, descending
+
+
+def ordering(sort, reverse=False):
+    field, descending = sort_field(sort)
+
+    if reverse:
+        descending = not descending
+
+    prefix = "-" if descending else ""
+    return f"{prefix}{field}", f"{prefix}id"
+
+
+def choices():
+    return [(key, label) for key, (label, _, _) in SORTS.items()]
@@ -0,0 +1,140 @@
+# Русский стеммер (алгоритм Snowball / Porter для русского языка)
+# http://snowball.tartarus.org/algorithms/russian/stemmer.html
+
+VOWELS = "аеиоуыэюя"
+
+# (окончание, нужна ли перед ним «а»/«я»)
+PERFECTIVE_GERUND = (
+    [(s, True) for s in ("в", "вши", "вшись")]
+    + [(s, False) for s in ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")]
+)
+
+ADJECTIVE = [(s, False) for s in (
+    "ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им",
+    "ым", "ом", "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая",
+    "яя", "ою", "ею",
+)]
+
+PARTICIPLE = (
+    [(s, True) for s in ("ем", "нн", "вш", "ющ", "щ")]
+    + [(s, False) for s in ("ивш", "ывш", "ующ")]
+)
+
+REFLEXIVE = [(s, False) for s in ("ся", "сь")]
+
+VERB = (
+    [(s, True) for s in (
+        "ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но",
+        "ет", "ют", "ны", "ть", "ешь", "нно",
+    )]
+    + [(s, False) for s in (
+        "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей",
+        "уй", "ил", "ыл", "им", "ым", "ен", "ило", "ыло", "ено", "ят", "ует",
+        "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю",
+    )]
+)
+
+NOUN = [(s, False) for s in (
+    "а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и",
+    "ией", "ей", "ой", "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о",
+    "у", "ах", "иях", "ях", "ы", "ь", "ию", "ью", "ю", "ия", "ья", "я",
+)]
+
+DERIVATIONAL = ("ость", "ост")
+SUPERLATIVE = ("ейше", "ейш")
+
+
+def _by_length(group):
+    return sorted(group, key=lambda item: len(item[0]), reverse=True)
+
+
+PERFECTIVE_GERUND = _by_length(PERFECTIVE_GERUND)
+ADJECTIVE = _by_length(ADJECTIVE)
+PARTICIPLE = _by_length(PARTICIPLE)
+REFLEXIVE = _by_length(REFLEXIVE)
+VERB = _by_length(VERB)
+NOUN = _by_length(NOUN)
+
+
+def _regions(word):
+    """Начало RV и R2 (индексы в слове)."""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(max(start, 1), len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(1)
+    r2 = next_region(r1 + 1)
+    return rv, r2
+
+
+def _strip(rv_part, group):
+    """Убрать самое длинное окончание группы; None если не найдено."""
+    for suffix, after_a in group:
+        if not rv_part.endswith(suffix):
+            continue
+
+        rest = rv_part[:-len(suffix)]
+
+        if after_a and not (rest and rest[-1] in "ая"):
+            continue
+
+        return rest
+
+    return None
+
+
+def stem(word):
+    word = word.lower().replace("ё", "е")
+    rv, r2 = _regions(word)
+    head, tail = word[:rv], word[rv:]
+
+    # Шаг 1
+    stripped = _strip(tail, PERFECTIVE_GERUND)
+
+    if stripped is None:
+        reflexive = _strip(tail, REFLEXIVE)
+        if reflexive is not None:
+            tail = reflexive
+
+        adjective = _strip(tail, ADJECTIVE)
+        if adjective is not None:
+            participle = _strip(adjective, PARTICIPLE)
+            stripped = participle if participle is not None else adjective
+        else:
+            stripped = _strip(tail, VERB)
+            if stripped is None:
+                stripped = _strip(tail, NOUN)
+
+    if stripped is not None:
+        tail = stripped
+
+    # Шаг 2
+    if tail.endswith("и"):
+        tail = tail[:-1]
+
+    # Шаг 3: словообразовательные окончания в R2
+    for suffix in DERIVATIONAL:
+        if tail.endswith(suffix) and len(head) + len(tail) - len(suffix) >= r2:
+            tail = tail[:-len(suffix)]
+            break
+
+    # Шаг 4
+    for suffix in SUPERLATIVE:
+        if tail.endswith(suffix):
+            tail = tail[:-len(suffix)]
+            break
+
+    if tail.endswith("нн"):
+        tail = tail[:-1]
+    elif tail.endswith("ь"):
+        tail = tail[:-1]
+
+    return head + tail
@@ -0,0 +1,47 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html
+
+from products import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def rendition_url(obj, size="card", ext="jpg"):
+    return images.rendition_url(obj, size, ext) or ""
+
+
+@register.simple_tag
+def resized_url(obj, width, height=0):
+    """URL ресайза по запросу: /media/r/<w>x<h>/<path>."""
+    if not obj or not obj.image:
+        return ""
+    return reverse("media_resize", args=[width, height, obj.image.name])
+
+
+@register.simple_tag
+def responsive_image(obj, size="card", alt="", css_class=""):
+    """
+    <picture> с WebP/JPEG srcset по сгенерированным копиям.
+    Пока копий нет — обычный <img> с оригиналом.
+    """
+    url = images.rendition_url(obj, size)
+
+    if not url:
+        return ""
+
+    if url == obj.image.url:
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="lazy">',
+            url, alt, css_class
+        )
+
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async">'
+        '</picture>',
+        images.srcset(obj, "webp"), images.SIZES[size],
+        url, images.srcset(obj, "jpg"), images.SIZES[size], alt, css_class
+    )
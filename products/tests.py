@@ -1,7 +1,24 @@
-from django.test import TestCase
+import csv
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from xml.etree import ElementTree
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import FileResponse
 from django.urls import reverse
-from django.db import IntegrityError
+from django.utils import timezone
+from django.db import IntegrityError, connection
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from .models import (
     Category,
@@ -9,8 +26,18 @@ from .models import (
     ProductImage,
     Variant,
     Color,
-    Size
+    Size,
+    SearchPosting,
+    RelatedProduct,
+    ProductSales,
+    StockMovement,
+    StockShard
 )
+from . import bestsellers, feeds, images, inventory, recommendations, resize, search, sitemaps
+from . import cache as catalog_cache
+from .feeds import absolute_url
+from .views import ProductListView
+from .stemmer import stem
 
 
 class ProductModelTestCase(TestCase):
@@ -220,4 +247,1762 @@ class ProductViewTestCase(TestCase):
         )
 
         self.assertEqual(response.status_code, 200)
-        self.assertTrue("is_paginated" in response.context)
\ No newline at end of file
+        self.assertTrue("is_paginated" in response.context)
+
+# =====================================================
+# CATALOG CACHE
+# =====================================================
+
+class CatalogCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(
+            name="Hats",
+            slug="hats"
+        )
+
+        self.product = Product.objects.create(
+            name="Cap",
+            slug="cap",
+            description="Summer cap",
+            price=700,
+            category=self.category,
+            is_active=True
+        )
+
+        self.variant = Variant.objects.create(
+            product=self.product,
+            stock=4
+        )
+
+    def test_warm_detail_page_without_sql(self):
+        url = reverse("product_detail", args=[self.product.slug])
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertContains(response, "Cap")
+
+    def test_warm_list_page_without_sql(self):
+        url = reverse("category_detail", args=[self.category.slug])
+        self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertContains(response, "Cap")
+
+    def test_warm_second_page_without_sql(self):
+        for i in range(12):
+            Product.objects.create(
+                name=f"Hat {i}", slug=f"hat-{i}", description="d",
+                price=500, category=self.category, is_active=True
+            )
+
+        url = reverse("category_detail", args=[self.category.slug]) + "?page=2"
+        first = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(response.context["page_obj"].number, 2)
+        self.assertEqual(response.context["paginator"].num_pages, 2)
+        self.assertEqual(
+            [p.pk for p in response.context["products"]],
+            [p.pk for p in first.context["products"]]
+        )
+
+    def test_product_save_invalidates_pages(self):
+        detail_url = reverse("product_detail", args=[self.product.slug])
+        list_url = reverse("category_detail", args=[self.category.slug])
+        self.client.get(detail_url)
+        self.client.get(list_url)
+
+        self.product.name = "Panama"
+        self.product.save()
+
+        self.assertContains(self.client.get(detail_url), "Panama")
+        self.assertContains(self.client.get(list_url), "Panama")
+
+    def test_variant_change_invalidates_detail(self):
+        url = reverse("product_detail", args=[self.product.slug])
+        self.assertContains(self.client.get(url), "4 шт.")
+
+        self.variant.stock = 2
+        self.variant.save()
+
+        self.assertContains(self.client.get(url), "Осталось 2 шт.")
+
+    def test_change_after_query_is_not_pinned(self):
+        url = reverse("product_detail", args=[self.product.slug])
+        set_cached = catalog_cache.set_cached
+
+        def change_then_cache(key, token, value):
+            # изменение зафиксировано между чтением карточки и записью в кэш
+            if key.startswith("catalog:product_slug:"):
+                inventory.adjust_stock({self.variant.pk: -2})
+                inventory.stock_changed([self.product.pk])
+            set_cached(key, token, value)
+
+        with patch.object(catalog_cache, "set_cached", change_then_cache):
+            self.assertContains(self.client.get(url), "4 шт.")
+
+        self.assertContains(self.client.get(url), "Осталось 2 шт.")
+
+    def test_deactivated_product_not_served_from_cache(self):
+        url = reverse("product_detail", args=[self.product.slug])
+        self.client.get(url)
+
+        self.product.is_active = False
+        self.product.save()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_product_moved_invalidates_old_category(self):
+        other = Category.objects.create(name="Bags", slug="bags")
+        url = reverse("category_detail", args=[self.category.slug])
+        self.client.get(url)
+
+        self.product.category = other
+        self.product.save()
+
+        self.assertNotContains(self.client.get(url), "Cap")
+
+
+# =====================================================
+# CURSOR PAGINATION
+# =====================================================
+
+@override_settings(CATALOG_CURSOR_PAGINATION=True)
+class CursorPaginationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(
+            name="Coats",
+            slug="coats"
+        )
+
+        for i in range(30):
+            Product.objects.create(
+                name=f"Coat {i:02d}",
+                slug=f"coat-{i}",
+                description="d",
+                price=100,
+                category=self.category,
+                is_active=True
+            )
+
+        self.url = reverse("category_detail", args=[self.category.slug])
+
+    def names(self, response):
+        return [p.name for p in response.context["products"]]
+
+    def test_pages_follow_cursor(self):
+        seen = []
+        response = self.client.get(self.url)
+
+        while True:
+            seen += self.names(response)
+            page = response.context["page_obj"]
+            if not page.has_next():
+                break
+            response = self.client.get(self.url, {"after": page.next_cursor})
+
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+        self.assertEqual(seen[0], "Coat 29")
+
+    def test_previous_link_returns_same_page(self):
+        first = self.client.get(self.url)
+        second = self.client.get(
+            self.url, {"after": first.context["page_obj"].next_cursor}
+        )
+        back = self.client.get(
+            self.url, {"before": second.context["page_obj"].previous_cursor}
+        )
+
+        self.assertEqual(self.names(back), self.names(first))
+        self.assertFalse(back.context["page_obj"].has_previous())
+
+    def test_no_count_query(self):
+        first = self.client.get(self.url)
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {"after": first.context["page_obj"].next_cursor})
+
+        self.assertFalse(any("COUNT(" in q["sql"] for q in ctx.captured_queries))
+
+    def test_invalid_cursor_404(self):
+        response = self.client.get(self.url, {"after": "broken"})
+        self.assertEqual(response.status_code, 404)
+
+
+# =====================================================
+# AVAILABLE STOCK
+# =====================================================
+
+class AvailableStockTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(
+            name="Scarves",
+            slug="scarves"
+        )
+
+        self.product = Product.objects.create(
+            name="Scarf",
+            slug="scarf",
+            description="Wool scarf",
+            price=900,
+            category=self.category,
+            is_active=True
+        )
+
+    def test_variant_changes_update_summary(self):
+        variant = Variant.objects.create(product=self.product, stock=3)
+        Variant.objects.create(product=self.product, size=Size.objects.create(name="L"), stock=2)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 5)
+
+        variant.stock = 0
+        variant.save()
+        variant.delete()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 2)
+
+    def test_listing_badge_without_per_card_queries(self):
+        Product.objects.create(
+            name="Sold out",
+            slug="sold-out",
+            description="d",
+            price=100,
+            category=self.category,
+            is_active=True
+        )
+        Variant.objects.create(product=self.product, stock=1)
+
+        with self.assertNumQueries(6):
+            # 1 category, 1 count, 1 products (с главным фото),
+            # 2 индекс фасетов (товары, варианты), 1 хиты продаж —
+            # не зависят от числа карточек
+            response = self.client.get(
+                reverse("category_detail", args=[self.category.slug])
+            )
+
+        self.assertContains(response, "Нет в наличии", count=1)
+
+    def test_stale_product_save_keeps_summary(self):
+        variant = Variant.objects.create(product=self.product, stock=5)
+        stale = Product.objects.get(pk=self.product.pk)
+
+        inventory.adjust_stock({variant.pk: -5})
+        inventory.stock_changed([self.product.pk])
+
+        stale.name = "Scarf 2"
+        stale.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Scarf 2")
+        self.assertEqual(self.product.available_stock, 0)
+
+    def test_deferred_product_save_skips_unloaded_fields(self):
+        partial = Product.objects.only("id", "name").get(pk=self.product.pk)
+        partial.name = "Scarf 2"
+
+        with CaptureQueriesContext(connection) as ctx:
+            partial.save()
+
+        # save() не дочитывает отложенные поля и обновляет только name
+        sql = [q["sql"] for q in ctx.captured_queries]
+        self.assertFalse(any('"products_product"."price"' in q for q in sql))
+        updates = [q for q in sql if q.startswith('UPDATE "products_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"price"', updates[0])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, "Scarf 2")
+        self.assertEqual(self.product.price, 900)
+
+    def test_reconcile_command_fixes_drift(self):
+        Variant.objects.create(product=self.product, stock=7)
+        Product.objects.filter(pk=self.product.pk).update(available_stock=0)
+
+        out = StringIO()
+        call_command("reconcile_stock", stdout=out)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 7)
+        self.assertIn("Исправлено товаров: 1", out.getvalue())
+
+    def test_reconcile_dry_run_changes_nothing(self):
+        Variant.objects.create(product=self.product, stock=7)
+        Product.objects.filter(pk=self.product.pk).update(available_stock=0)
+
+        call_command("reconcile_stock", "--dry-run", stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 0)
+
+
+class VariantMatrixTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(name="Shirts", slug="shirts")
+        self.product = Product.objects.create(
+            name="Shirt",
+            slug="shirt",
+            description="Cotton shirt",
+            price=1500,
+            category=self.category,
+            is_active=True
+        )
+
+        self.size_s = Size.objects.create(name="S")
+        self.size_m = Size.objects.create(name="M")
+        self.white = Color.objects.create(name="White", hex_code="#FFFFFF")
+        self.black = Color.objects.create(name="Black", hex_code="#000000")
+
+        self.s_white = Variant.objects.create(product=self.product, size=self.size_s, color=self.white, stock=0)
+        self.m_black = Variant.objects.create(product=self.product, size=self.size_m, color=self.black, stock=2)
+
+    def test_matrix_follows_variant_changes(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.variant_matrix, {
+            "sizes": [[self.size_s.id, "S"], [self.size_m.id, "M"]],
+            "colors": [[self.black.id, "Black", "#000000"], [self.white.id, "White", "#FFFFFF"]],
+            "variants": [[self.s_white.id, 0, 1, 0], [self.m_black.id, 1, 0, 2]],
+        })
+
+        Variant.objects.filter(pk=self.s_white.pk).update(stock=5)
+        inventory.stock_changed([self.product.pk])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.variant_matrix["variants"][0], [self.s_white.id, 0, 1, 5])
+
+    def test_stale_product_save_keeps_matrix(self):
+        stale = Product.objects.get(pk=self.product.pk)
+
+        inventory.adjust_stock({self.m_black.pk: -2})
+        inventory.stock_changed([self.product.pk])
+
+        stale.description = "Linen shirt"
+        stale.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.variant_matrix["variants"][1], [self.m_black.id, 1, 0, 0])
+
+    def test_dictionary_rename_and_delete(self):
+        self.white.name = "Milk"
+        self.white.save()
+
+        self.product.refresh_from_db()
+        self.assertIn([self.white.id, "Milk", "#FFFFFF"], self.product.variant_matrix["colors"])
+
+        self.size_s.delete()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.variant_matrix["sizes"], [[self.size_m.id, "M"]])
+        self.assertEqual(self.product.variant_matrix["variants"][0], [self.s_white.id, None, 1, 0])
+
+    def test_grid(self):
+        self.product.refresh_from_db()
+        grid = inventory.variant_grid(self.product.variant_matrix)
+
+        self.assertEqual([color["name"] for color in grid["colors"]], ["Black", "White"])
+        self.assertEqual(grid["rows"], [
+            {"size": "S", "cells": [None, {"id": self.s_white.id, "stock": 0}]},
+            {"size": "M", "cells": [{"id": self.m_black.id, "stock": 2}, None]},
+        ])
+        self.assertEqual(grid["first_available"], self.m_black.id)
+
+    def test_grid_without_colors(self):
+        variant = Variant.objects.create(product=self.product, stock=1)
+        Variant.objects.filter(pk__in=[self.s_white.pk, self.m_black.pk]).delete()
+        inventory.stock_changed([self.product.pk])
+
+        self.product.refresh_from_db()
+        grid = inventory.variant_grid(self.product.variant_matrix)
+
+        self.assertFalse(grid["show_colors"])
+        self.assertEqual(grid["rows"], [{"size": "", "cells": [{"id": variant.id, "stock": 1}]}])
+
+    def test_detail_page_without_variant_queries(self):
+        url = reverse("product_detail", args=[self.product.slug])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertFalse([q for q in queries if "products_variant" in q["sql"]])
+        self.assertContains(response, f'value="{self.m_black.id}"')
+        self.assertContains(response, 'data-stock="2"')
+        self.assertContains(response, "White")
+
+
+class StockLedgerTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        category = Category.objects.create(name="Socks", slug="socks")
+        self.product = Product.objects.create(
+            name="Socks",
+            slug="socks",
+            description="d",
+            price=200,
+            category=category,
+            is_active=True
+        )
+        self.variant = Variant.objects.create(product=self.product, stock=4)
+
+    def movements(self):
+        return list(self.variant.movements.order_by("id").values_list("kind", "quantity", "folded"))
+
+    def test_saved_stock_is_recorded(self):
+        self.variant.stock = 1
+        self.variant.save()
+
+        self.assertEqual(self.movements(), [
+            (StockMovement.KIND_RESTOCK, 4, True),
+            (StockMovement.KIND_ADJUSTMENT, -3, True),
+        ])
+
+    def test_save_does_not_reread_stock(self):
+        variant = Variant.objects.get(pk=self.variant.pk)
+        variant.stock = 6
+
+        with CaptureQueriesContext(connection) as queries:
+            variant.save()
+
+        self.assertFalse([
+            q for q in queries
+            if q["sql"].startswith('SELECT "products_variant"."stock"')
+        ])
+
+        variant.stock = 5
+        variant.save()
+        self.assertEqual(self.movements()[1:], [
+            (StockMovement.KIND_ADJUSTMENT, 2, True),
+            (StockMovement.KIND_ADJUSTMENT, -1, True),
+        ])
+
+    def test_pending_movements_count_as_available(self):
+        inventory.record_movements(StockMovement.KIND_CANCEL, {self.variant.pk: 2})
+        inventory.record_movements(StockMovement.KIND_RESTOCK, {self.variant.pk: 3})
+        inventory.stock_changed([self.product.pk])
+
+        self.variant.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.variant.stock, 4)
+        self.assertEqual(self.product.available_stock, 9)
+        self.assertEqual(self.product.variant_matrix["variants"][0][3], 9)
+
+    def test_compact_folds_in_batches(self):
+        other = Variant.objects.create(product=self.product, size=Size.objects.create(name="S"), stock=0)
+        inventory.record_movements(StockMovement.KIND_CANCEL, {self.variant.pk: 2, other.pk: 1})
+        inventory.record_movements(StockMovement.KIND_RESTOCK, {self.variant.pk: 3})
+
+        self.assertEqual(inventory.compact(batch_size=2), 3)
+        self.assertEqual(inventory.compact(), 0)
+
+        self.variant.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.variant.stock, 9)
+        self.assertEqual(other.stock, 1)
+        self.assertFalse(StockMovement.objects.filter(folded=False).exists())
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 10)
+
+
+class ShardedStockTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        category = Category.objects.create(name="Sale", slug="sale")
+        self.product = Product.objects.create(
+            name="Hot Tee",
+            slug="hot-tee",
+            description="d",
+            price=500,
+            category=category,
+            is_active=True
+        )
+        self.variant = Variant.objects.create(product=self.product, stock=10)
+
+        inventory.shard_stock([self.variant.pk], 4)
+        self.variant.refresh_from_db()
+
+    def shards(self):
+        return list(self.variant.shards.order_by("index").values_list("stock", flat=True))
+
+    def test_shard_stock_splits_and_folds_back(self):
+        self.assertEqual(self.variant.stock_shards, 4)
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+        self.assertEqual(self.variant.stock, 10)
+
+        StockShard.objects.filter(variant=self.variant, index=0).update(stock=0)
+        inventory.shard_stock([self.variant.pk], 0)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock_shards, 0)
+        self.assertEqual(self.variant.stock, 7)
+        self.assertFalse(self.variant.shards.exists())
+
+    def test_reserve_uses_own_shard(self):
+        key = 42
+        index = inventory.shard_index(4, key)
+
+        with self.assertNumQueries(1):
+            reserved = inventory.reserve_stock({self.variant.pk: 2}, {self.variant.pk: 4}, key=key)
+
+        self.assertEqual(reserved, {(self.variant.pk, index): 2})
+        self.assertEqual(sum(self.shards()), 8)
+
+    def test_reserve_sweeps_other_shards(self):
+        reserved = inventory.reserve_stock({self.variant.pk: 7}, {self.variant.pk: 4}, key=1)
+
+        self.assertEqual(sum(reserved.values()), 7)
+        self.assertEqual(sum(self.shards()), 3)
+
+        inventory.shards_changed([self.variant.pk])
+        self.variant.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.variant.stock, 3)
+        self.assertEqual(self.product.available_stock, 3)
+
+        inventory.release_stock(reserved)
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+
+    def test_reserve_out_of_stock_takes_nothing(self):
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve_stock({self.variant.pk: 11}, {self.variant.pk: 4}, key=1)
+
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+
+    def test_saved_stock_is_resplit(self):
+        self.variant.stock = 5
+        self.variant.save()
+
+        self.assertEqual(self.shards(), [2, 1, 1, 1])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 5)
+
+    def test_bulk_edit_compares_with_shard_total(self):
+        StockShard.objects.filter(variant=self.variant, index=0).update(stock=0)
+
+        # форма показывала устаревшую сводку
+        result = inventory.bulk_edit({self.variant.pk: (10, 20)}, {})
+        self.assertEqual(len(result["conflicts"]), 1)
+
+        result = inventory.bulk_edit({self.variant.pk: (7, 20)}, {})
+        self.assertEqual(result["variants"], 1)
+
+        inventory.compact()
+        self.assertEqual(sum(self.shards()), 20)
+
+        # убавка списывается из шардов сразу
+        result = inventory.bulk_edit({self.variant.pk: (20, 2)}, {})
+        self.assertEqual(result["variants"], 1)
+        self.assertEqual(sum(self.shards()), 2)
+
+
+class PrimaryImageTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(name="Belts", slug="belts")
+        self.product = Product.objects.create(
+            name="Belt",
+            slug="belt",
+            description="d",
+            price=600,
+            category=self.category,
+            is_active=True
+        )
+
+    def primary(self):
+        self.product.refresh_from_db()
+        return self.product.primary_image_id
+
+    def test_follows_image_order(self):
+        second = ProductImage.objects.create(product=self.product, image="products/b.jpg", order=1)
+        self.assertEqual(self.primary(), second.id)
+
+        first = ProductImage.objects.create(product=self.product, image="products/a.jpg", order=0)
+        self.assertEqual(self.primary(), first.id)
+
+        first.order = 2
+        first.save()
+        self.assertEqual(self.primary(), second.id)
+
+        second.delete()
+        self.assertEqual(self.primary(), first.id)
+
+        first.delete()
+        self.assertIsNone(self.primary())
+
+    def test_stale_product_save_keeps_primary_image(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        image = ProductImage.objects.create(product=self.product, image="products/a.jpg")
+
+        stale.price = 700
+        stale.save()
+
+        self.assertEqual(self.primary(), image.id)
+
+    def test_card_shows_primary_image(self):
+        ProductImage.objects.create(product=self.product, image="products/b.jpg", order=1)
+        ProductImage.objects.create(product=self.product, image="products/a.jpg", order=0)
+
+        response = self.client.get(reverse("category_detail", args=[self.category.slug]))
+
+        self.assertContains(response, "products/a.jpg")
+        self.assertNotContains(response, "products/b.jpg")
+
+
+# =====================================================
+# ADMIN
+# =====================================================
+
+class ProductAdminTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        from django.contrib.auth import get_user_model
+
+        self.admin = get_user_model().objects.create_superuser(
+            "admin@example.com", "Admin", "+996700000000", "secret-pass-1"
+        )
+        self.client.force_login(self.admin)
+
+        self.category = Category.objects.create(name="Coats", slug="coats")
+        self.products = [
+            Product.objects.create(
+                name=f"Coat {i}",
+                slug=f"coat-{i}",
+                description="d",
+                price=5000,
+                category=self.category,
+                is_active=True
+            )
+            for i in range(3)
+        ]
+        self.variants = [
+            Variant.objects.create(product=product, size=Size.objects.create(name=f"S{i}"), stock=1)
+            for i, product in enumerate(self.products)
+        ]
+
+    def test_changelist_joins_category(self):
+        url = reverse("admin:products_product_changelist")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        # категория строки — через JOIN, а не запросом на строку
+        self.assertFalse([
+            q for q in queries
+            if q["sql"].startswith('SELECT "products_category"') and "WHERE" in q["sql"]
+        ])
+
+    def test_estimated_paginator_counts_up_to_limit(self):
+        from .admin import EstimatedCountPaginator
+
+        paginator = EstimatedCountPaginator(Product.objects.order_by("id"), 2)
+        self.assertEqual(paginator.count, 3)
+
+        with patch.object(EstimatedCountPaginator, "exact_limit", 1):
+            paginator = EstimatedCountPaginator(Product.objects.order_by("id"), 2)
+            # на SQLite оценки нет — точный COUNT
+            self.assertEqual(paginator.count, 3)
+            self.assertEqual(len(paginator.page(2).object_list), 1)
+
+    def test_bulk_editor_renders(self):
+        response = self.client.get(reverse("admin:products_product_bulk_stock"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, f'name="stock-{self.variants[0].id}"')
+        self.assertContains(response, f'name="price-{self.products[0].id}"')
+
+    def test_bulk_editor_appends_restocks_in_one_insert(self):
+        data = {}
+        for variant in self.variants:
+            data[f"stock-{variant.id}"] = "10"
+            data[f"initial-stock-{variant.id}"] = "1"
+        data[f"price-{self.products[0].id}"] = "4500"
+        data[f"initial-price-{self.products[0].id}"] = "5000"
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("admin:products_product_bulk_stock"), data)
+
+        self.assertEqual(response.status_code, 302)
+
+        # прибавка — только приход в журнал, строки вариантов не обновляются
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "products_variant"')])
+        self.assertEqual(
+            len([q for q in queries if q["sql"].startswith('INSERT INTO "products_stockmovement"')]),
+            1
+        )
+
+        for product in self.products:
+            product.refresh_from_db()
+            self.assertEqual(product.available_stock, 10)
+            self.assertEqual(product.variant_matrix["variants"][0][3], 10)
+
+        self.assertEqual(self.products[0].price, 4500)
+
+        inventory.compact()
+        for variant in self.variants:
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, 10)
+
+    def test_bulk_editor_skips_concurrent_changes(self):
+        variant = self.variants[0]
+        Variant.objects.filter(pk=variant.pk).update(stock=0)
+
+        self.client.post(reverse("admin:products_product_bulk_stock"), {
+            f"stock-{variant.id}": "10",
+            f"initial-stock-{variant.id}": "1",
+        })
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 0)
+
+    def inline_data(self, product, variant, shown, new):
+        return {
+            "name": product.name,
+            "slug": product.slug,
+            "description": product.description,
+            "price": "5000",
+            "category": self.category.id,
+            "is_active": "on",
+            "images-TOTAL_FORMS": "0",
+            "images-INITIAL_FORMS": "0",
+            "variants-TOTAL_FORMS": "1",
+            "variants-INITIAL_FORMS": "1",
+            "variants-0-id": variant.id,
+            "variants-0-product": product.id,
+            "variants-0-size": variant.size_id,
+            "variants-0-available": str(new),
+            "variants-0-initial_available": str(shown),
+        }
+
+    def test_variant_inline_edits_available_stock(self):
+        product, variant = self.products[0], self.variants[0]
+        inventory.record_movements(StockMovement.KIND_RESTOCK, {variant.pk: 3})
+
+        url = reverse("admin:products_product_change", args=[product.id])
+        self.assertContains(self.client.get(url), 'name="variants-0-available" value="4"')
+
+        response = self.client.post(url, self.inline_data(product, variant, 4, 6))
+        self.assertEqual(response.status_code, 302)
+
+        # приход журнала не учитывается дважды
+        inventory.compact()
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 6)
+
+    def test_variant_inline_skips_concurrent_changes(self):
+        product, variant = self.products[0], self.variants[0]
+        Variant.objects.filter(pk=variant.pk).update(stock=0)
+
+        self.client.post(
+            reverse("admin:products_product_change", args=[product.id]),
+            self.inline_data(product, variant, 1, 10)
+        )
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 0)
+
+    def test_bulk_editor_rejects_invalid_values(self):
+        variant = self.variants[0]
+
+        self.client.post(reverse("admin:products_product_bulk_stock"), {
+            f"stock-{variant.id}": "-5",
+            f"initial-stock-{variant.id}": "1",
+        })
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 1)
+
+
+# =====================================================
+# SEARCH
+# =====================================================
+
+class StemmerTestCase(TestCase):
+
+    def test_word_forms_share_stem(self):
+        self.assertEqual(stem("рубашка"), stem("рубашки"))
+        self.assertEqual(stem("тёплая"), stem("теплые"))
+        self.assertEqual(stem("кроссовки"), "кроссовк")
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(
+            name="Рубашки",
+            slug="shirts"
+        )
+
+        self.shirt = Product.objects.create(
+            name="Льняная рубашка",
+            slug="linen-shirt",
+            description="Лёгкая летняя рубашка",
+            price=2500,
+            category=self.category,
+            is_active=True
+        )
+
+        self.chapan = Product.objects.create(
+            name="Чапан праздничный",
+            slug="chapan",
+            description="Тёплый чапан с вышивкой",
+            price=9000,
+            category=self.category,
+            is_active=True
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse("search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [p.slug for p in response.context["products"]]
+
+    def test_word_forms_match(self):
+        self.assertEqual(self.search("рубашки")[0], "linen-shirt")
+
+    def test_name_ranks_above_category(self):
+        # «рубашк» есть в категории обоих товаров, в названии — только у одного
+        self.assertEqual(self.search("рубашка"), ["linen-shirt", "chapan"])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.search("празничный"), ["chapan"])
+        self.assertEqual(self.search("рубвшка")[0], "linen-shirt")
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search("вышив"), ["chapan"])
+
+    def test_index_updated_on_save(self):
+        self.chapan.name = "Халат"
+        self.chapan.description = "Домашний"
+        self.chapan.save()
+
+        self.assertEqual(self.search("халат"), ["chapan"])
+        self.assertEqual(self.search("чапан"), [])
+
+    def test_inactive_product_removed(self):
+        self.chapan.is_active = False
+        self.chapan.save()
+
+        self.assertEqual(self.search("чапан"), [])
+
+    def test_category_rename_reindexes(self):
+        self.category.name = "Одежда"
+        self.category.save()
+
+        self.assertEqual(len(self.search("одежда")), 2)
+
+    def test_empty_query(self):
+        self.assertEqual(self.search(""), [])
+
+    def test_rebuild_command(self):
+        SearchPosting.objects.all().delete()
+        search.bump_version()
+
+        call_command("rebuild_search_index", stdout=StringIO())
+
+        self.assertEqual(self.search("чапан"), ["chapan"])
+
+
+# =====================================================
+# FACETS
+# =====================================================
+
+class FacetTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(name="Dresses", slug="dresses")
+        self.size_s = Size.objects.create(name="S")
+        self.size_m = Size.objects.create(name="M")
+        self.red = Color.objects.create(name="Красный")
+
+        self.cheap = self.make_product("cheap", 500)
+        self.mid = self.make_product("mid", 2000)
+        self.expensive = self.make_product("expensive", 12000)
+
+        Variant.objects.create(product=self.cheap, size=self.size_s, color=self.red, stock=2)
+        Variant.objects.create(product=self.mid, size=self.size_m, color=self.red, stock=1)
+        Variant.objects.create(product=self.mid, size=self.size_s, stock=0)
+        Variant.objects.create(product=self.expensive, size=self.size_m, stock=3)
+
+        self.url = reverse("category_detail", args=[self.category.slug])
+
+    def make_product(self, slug, price):
+        return Product.objects.create(
+            name=slug.title(),
+            slug=slug,
+            description="d",
+            price=price,
+            category=self.category,
+            is_active=True
+        )
+
+    def slugs(self, params):
+        response = self.client.get(self.url, params)
+        return {p.slug for p in response.context["products"]}, response.context["facets"]
+
+    def counts(self, facet_options):
+        return {o["label"]: o["count"] for o in facet_options}
+
+    def test_size_filter_uses_in_stock_variants(self):
+        slugs, facet_counts = self.slugs({"size": self.size_s.id})
+
+        self.assertEqual(slugs, {"cheap"})
+        self.assertEqual(self.counts(facet_counts["size"]), {"S": 1, "M": 2})
+
+    def test_size_facet_counts_pending_stock(self):
+        # остаток варианта пока только в журнале (отмена заказа)
+        variant = Variant.objects.get(product=self.mid, size=self.size_s)
+        inventory.record_movements(StockMovement.KIND_CANCEL, {variant.pk: 2})
+        inventory.stock_changed([self.mid.pk])
+
+        slugs, _ = self.slugs({"size": self.size_s.id})
+
+        self.assertEqual(slugs, {"cheap", "mid"})
+
+    def test_filters_intersect_across_facets(self):
+        slugs, facet_counts = self.slugs({"size": self.size_m.id, "color": self.red.id})
+
+        self.assertEqual(slugs, {"mid"})
+        self.assertEqual(self.counts(facet_counts["color"]), {"Красный": 1})
+
+    def test_values_within_facet_are_ored(self):
+        slugs, _ = self.slugs({"price": [0, 4]})
+        self.assertEqual(slugs, {"cheap", "expensive"})
+
+    def test_filtered_page_counts_from_memory(self):
+        self.client.get(self.url, {"size": self.size_m.id})
+
+        with self.assertNumQueries(1):
+            # 1 products с главным фото — категория и фасеты из кэша
+            self.client.get(self.url, {"size": self.size_m.id, "in_stock": 1})
+
+    def test_stock_change_rebuilds_category_facets(self):
+        self.slugs({"size": self.size_s.id})
+
+        Variant.objects.filter(product=self.mid, size=self.size_s).get().delete()
+        variant = Variant.objects.get(product=self.cheap)
+        variant.stock = 0
+        variant.save()
+
+        slugs, _ = self.slugs({"size": self.size_s.id})
+        self.assertEqual(slugs, set())
+
+    def test_invalid_params_ignored(self):
+        slugs, _ = self.slugs({"size": "abc"})
+        self.assertEqual(slugs, {"cheap", "mid", "expensive"})
+
+
+# =====================================================
+# IMAGE RENDITIONS
+# =====================================================
+
+class ImageRenditionTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_RENDITION_WORKERS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.category = Category.objects.create(name="Bags", slug="bags")
+        self.product = Product.objects.create(
+            name="Bag",
+            slug="bag",
+            description="d",
+            price=100,
+            category=self.category,
+            is_active=True
+        )
+
+    def upload(self, size, name="photo.jpg", mode="RGB", fmt="JPEG"):
+        buffer = BytesIO()
+        Image.new(mode, size, "red").save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_upload_generates_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(
+                product=self.product,
+                image=self.upload((2000, 1000))
+            )
+
+        image.refresh_from_db()
+        self.assertEqual(image.renditions["widths"], [160, 480, 960, 1600])
+
+        path = os.path.join(self.media_root, images.rendition_name(image.image.name, 480, "webp"))
+        with Image.open(path) as rendition:
+            self.assertEqual(rendition.size, (480, 240))
+
+    def test_small_image_not_upscaled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(
+                product=self.product,
+                image=self.upload((100, 100), name="small.png", mode="RGBA", fmt="PNG")
+            )
+
+        image.refresh_from_db()
+        self.assertEqual(image.renditions["widths"], [100])
+
+    def test_rotated_photo_not_upscaled(self):
+        # 1000×300 с Orientation=6 на экране выглядит как 300×1000
+        exif = Image.Exif()
+        exif[images.ORIENTATION_TAG] = 6
+        buffer = BytesIO()
+        Image.new("RGB", (1000, 300), "red").save(buffer, "JPEG", exif=exif)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(
+                product=self.product,
+                image=SimpleUploadedFile("rotated.jpg", buffer.getvalue())
+            )
+
+        image.refresh_from_db()
+        self.assertEqual(image.renditions["widths"], [160])
+
+        path = os.path.join(self.media_root, images.rendition_name(image.image.name, 160, "jpg"))
+        with Image.open(path) as rendition:
+            self.assertEqual(rendition.size, (160, 533))
+
+    def test_card_uses_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(
+                product=self.product,
+                image=self.upload((1200, 1200))
+            )
+
+        response = self.client.get(reverse("category_detail", args=[self.category.slug]))
+
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, "_480.webp 480w")
+
+    def test_original_until_rendered(self):
+        image = ProductImage.objects.create(
+            product=self.product,
+            image=self.upload((1200, 1200))
+        )
+
+        self.assertEqual(images.rendition_url(image, "card"), image.image.url)
+
+    def test_backfill_command(self):
+        image = ProductImage.objects.create(
+            product=self.product,
+            image=self.upload((800, 600))
+        )
+
+        call_command("generate_renditions", "--workers", "0", stdout=StringIO())
+
+        image.refresh_from_db()
+        self.assertEqual(image.renditions["widths"], [160, 480])
+
+
+class ResizeEndpointTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.media_root = tempfile.mkdtemp()
+        self.cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.cache_root, ignore_errors=True)
+
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_RESIZE_CACHE_DIR=self.cache_root,
+            IMAGE_RENDITION_WORKERS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        resize._usage["bytes"] = None
+        self.addCleanup(resize._usage.update, {"bytes": None})
+
+        self.name = self.save_original("products/photo.jpg")
+
+    def save_original(self, name, size=(1200, 800), color="blue"):
+        full_path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        Image.new("RGB", size, color).save(full_path, "JPEG")
+        return name
+
+    def test_resize_and_headers(self):
+        response = self.client.get(
+            reverse("media_resize", args=[320, 0, self.name]),
+            HTTP_ACCEPT="image/avif,image/webp,*/*"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("Accept", response["Vary"])
+
+        with Image.open(BytesIO(b"".join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (320, 213))
+
+    def test_jpeg_without_webp_support(self):
+        response = self.client.get(
+            reverse("media_resize", args=[160, 160, self.name]),
+            HTTP_ACCEPT="image/*"
+        )
+
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_invalid_requests(self):
+        self.save_original("secret/photo.jpg")
+
+        for width, height, path in (
+            (333, 0, self.name),
+            (0, 0, self.name),
+            (320, 0, "products/missing.jpg"),
+            (320, 0, "secret/photo.jpg"),
+            (320, 0, "products/../secret/photo.jpg"),
+        ):
+            response = self.client.get(f"/media/r/{width}x{height}/{path}")
+            self.assertEqual(response.status_code, 404, path)
+
+    def test_corrupt_original_is_404(self):
+        full_path = os.path.join(self.media_root, "products/broken.jpg")
+        with open(full_path, "wb") as f:
+            f.write(b"not an image")
+
+        response = self.client.get(reverse("media_resize", args=[320, 0, "products/broken.jpg"]))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(resize.scan(), [])
+
+    def test_evicted_copy_is_rendered_again(self):
+        get_resized = resize.get_resized
+        calls = []
+
+        def evicted(*args):
+            target = get_resized(*args)
+            # копию вытеснили, пока запрос до неё не дошёл
+            if not calls:
+                os.unlink(target)
+            calls.append(target)
+            return target
+
+        with patch.object(resize, "get_resized", evicted):
+            response = self.client.get(reverse("media_resize", args=[320, 0, self.name]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+    def test_second_request_served_from_cache(self):
+        url = reverse("media_resize", args=[320, 0, self.name])
+        self.client.get(url)
+
+        with patch.object(resize, "render") as render:
+            response = self.client.get(url)
+
+        render.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+
+    def test_identical_content_shares_file(self):
+        copy = self.save_original("products/copy.jpg")
+
+        first = resize.get_resized(self.name, 320, 0, "jpg")
+        second = resize.get_resized(copy, 320, 0, "jpg")
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(resize.scan()), 1)
+
+    def test_least_recently_used_evicted(self):
+        old = resize.get_resized(self.name, 320, 0, "jpg")
+        os.utime(old, (1, 1))
+
+        other = self.save_original("products/other.jpg", color="green")
+
+        size = os.path.getsize(old)
+        with override_settings(IMAGE_RESIZE_CACHE_MAX_BYTES=int(size * 1.5)):
+            new = resize.get_resized(other, 320, 0, "jpg")
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+
+class ImportCatalogTestCase(TestCase):
+
+    CSV = (
+        "slug,name,description,price,category,is_active,color,size,stock,images\n"
+        "tee,Футболка,Хлопок,1500,tops,1,Белый,M,3,products/tee.jpg|products/tee2.jpg\n"
+        "tee,Футболка,Хлопок,1500,tops,1,Белый,L,2,\n"
+        "cap,Кепка,,900,tops,1,,,5,\n"
+        "bad,Без категории,,100,nope,1,,,1,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(name="Верх", slug="tops")
+        self.size_m = Size.objects.create(name="M")
+
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out, err = StringIO(), StringIO()
+        call_command("import_catalog", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import(self):
+        out, err = self.run_import(self.write("catalog.csv", self.CSV), "--batch-size", "2")
+
+        tee = Product.objects.get(slug="tee")
+        self.assertEqual(tee.available_stock, 5)
+        self.assertEqual(tee.variants.count(), 2)
+        self.assertEqual(tee.variants.get(size__name="M").size, self.size_m)
+        self.assertEqual(tee.images.count(), 2)
+        self.assertEqual(tee.primary_image, tee.images.first())
+
+        self.assertEqual(Product.objects.get(slug="cap").available_stock, 5)
+        self.assertFalse(Product.objects.filter(slug="bad").exists())
+        self.assertEqual(Size.objects.filter(name="M").count(), 1)
+        self.assertIn("строка 5", err)
+
+        self.assertEqual(search.search_product_ids("футболки"), [tee.pk])
+
+    def test_reimport_updates_in_place(self):
+        path = self.write("catalog.csv", self.CSV)
+        self.run_import(path)
+
+        updated = self.CSV.replace("Белый,M,3", "Белый,M,10").replace("1500", "1700")
+        self.run_import(self.write("catalog.csv", updated))
+        self.run_import(path)
+
+        tee = Product.objects.get(slug="tee")
+        self.assertEqual(tee.price, 1700)
+        self.assertEqual(tee.available_stock, 12)
+        self.assertEqual(Variant.objects.filter(product=tee).count(), 2)
+        self.assertEqual(tee.images.count(), 2)
+        self.assertEqual(Variant.objects.filter(product__slug="cap").count(), 1)
+
+    def test_reimport_records_stock_in_ledger(self):
+        path = self.write("catalog.csv", self.CSV)
+        self.run_import(path)
+
+        variant = Variant.objects.get(product__slug="tee", size=self.size_m)
+        # возврат ещё не свёрнут — файл задаёт доступный остаток целиком
+        inventory.record_movements(StockMovement.KIND_CANCEL, {variant.pk: 4})
+
+        self.run_import(self.write("catalog.csv", self.CSV.replace("Белый,M,3", "Белый,M,5")))
+        inventory.compact()
+
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 5)
+        self.assertEqual(
+            sum(variant.movements.values_list("quantity", flat=True)),
+            5
+        )
+
+    def test_reimport_changes_sharded_stock_in_shards(self):
+        path = self.write("catalog.csv", self.CSV)
+        self.run_import(path)
+
+        variant = Variant.objects.get(product__slug="tee", size=self.size_m)
+        inventory.shard_stock([variant.pk], shards=2)
+
+        for stock, expected in (("1", 1), ("6", 6)):
+            self.run_import(self.write("catalog.csv", self.CSV.replace("Белый,M,3", f"Белый,M,{stock}")))
+            inventory.compact()
+            inventory.shards_changed([variant.pk])
+
+            variant.refresh_from_db()
+            self.assertEqual(variant.stock, expected)
+            self.assertEqual(sum(variant.shards.values_list("stock", flat=True)), expected)
+
+    def test_jsonl_import(self):
+        path = self.write("catalog.jsonl", "\n".join([
+            '{"slug": "scarf", "name": "Шарф", "price": 800, "category": "Верх", '
+            '"color": "Синий", "size": "M", "stock": 4, "images": ["products/scarf.jpg"]}',
+            "not json",
+        ]))
+
+        out, err = self.run_import(path)
+
+        scarf = Product.objects.get(slug="scarf")
+        self.assertEqual(scarf.category, self.category)
+        self.assertEqual(scarf.available_stock, 4)
+        self.assertEqual(scarf.images.get().image.name, "products/scarf.jpg")
+        self.assertIn("строка 2", err)
+
+    def test_dry_run_writes_nothing(self):
+        out, _ = self.run_import(self.write("catalog.csv", self.CSV), "--dry-run")
+
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Color.objects.exists())
+        self.assertIn("товаров новых: 2", out)
+        self.assertIn("вариантов: 3", out)
+
+
+class CatalogFeedTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.feeds_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.feeds_dir, ignore_errors=True)
+
+        settings_override = override_settings(FEEDS_DIR=self.feeds_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.category = Category.objects.create(name="Платья & юбки", slug="dresses")
+        self.color = Color.objects.create(name="Красный")
+        self.size = Size.objects.create(name="M")
+
+        self.dress = Product.objects.create(
+            name="Платье <летнее>",
+            slug="dress",
+            description="Лёгкое",
+            price=3200,
+            category=self.category,
+            is_active=True
+        )
+        self.variant = Variant.objects.create(
+            product=self.dress, color=self.color, size=self.size, stock=4
+        )
+
+        self.hidden = Product.objects.create(
+            name="Скрытый", slug="hidden", description="d", price=1,
+            category=self.category, is_active=False
+        )
+        Variant.objects.create(product=self.hidden, stock=1)
+
+    def read(self, name):
+        with open(feeds.feed_path(name), encoding="utf-8") as f:
+            return f.read()
+
+    def test_streaming_yml(self):
+        response = self.client.get(reverse("catalog_feed", args=["yml"]))
+
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content).decode()
+
+        ElementTree.fromstring(content)
+        self.assertIn(f'<offer id="{self.variant.pk}" group_id="{self.dress.pk}" available="true">', content)
+        self.assertIn("Платье &lt;летнее&gt;", content)
+        self.assertIn('<param name="Размер">M</param>', content)
+        self.assertIn("<count>4</count>", content)
+        self.assertNotIn("Скрытый", content)
+
+    def test_feed_exports_pending_stock(self):
+        # остаток пока только в журнале — в фиде он есть
+        Variant.objects.filter(pk=self.variant.pk).update(stock=0)
+        inventory.record_movements(StockMovement.KIND_CANCEL, {self.variant.pk: 2})
+        inventory.stock_changed([self.dress.pk])
+
+        response = self.client.get(reverse("catalog_feed", args=["yml"]))
+        content = b"".join(response.streaming_content).decode()
+
+        self.assertIn(f'<offer id="{self.variant.pk}" group_id="{self.dress.pk}" available="true">', content)
+        self.assertIn("<count>2</count>", content)
+
+    def test_generated_file_is_served(self):
+        call_command("generate_feeds", "--format", "xml", stdout=StringIO())
+
+        response = self.client.get(reverse("catalog_feed", args=["xml"]))
+
+        self.assertIsInstance(response, FileResponse)
+        ElementTree.fromstring(b"".join(response.streaming_content))
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse("catalog_feed", args=["json"]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_incremental_rerenders_only_changed(self):
+        other = Product.objects.create(
+            name="Юбка", slug="skirt", description="d", price=1500,
+            category=self.category, is_active=True
+        )
+        Variant.objects.create(product=other, size=self.size, stock=2)
+
+        self.assertEqual(feeds.write_feed("csv")["rendered"], 2)
+
+        Variant.objects.filter(pk=self.variant.pk).update(stock=0)
+        inventory.stock_changed([self.dress.pk])
+
+        stats = feeds.write_feed("csv")
+        self.assertEqual(stats, {"products": 2, "rendered": 1})
+
+        rows = list(csv.DictReader(StringIO(self.read("csv"))))
+        self.assertEqual(
+            [(row["group_id"], row["stock"]) for row in rows],
+            [(str(self.dress.pk), "0"), (str(other.pk), "2")]
+        )
+
+        other.delete()
+        feeds.write_feed("csv")
+        self.assertNotIn("Юбка", self.read("csv"))
+
+        self.assertEqual(feeds.write_feed("csv", full=True)["rendered"], 1)
+
+
+class SitemapTestCase(TestCase):
+
+    def setUp(self):
+        self.sitemap_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sitemap_dir, ignore_errors=True)
+
+        settings_override = override_settings(SITEMAP_DIR=self.sitemap_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.category = Category.objects.create(name="Обувь", slug="shoes")
+        self.product = Product.objects.create(
+            name="Кеды", slug="sneakers", description="d", price=100,
+            category=self.category, is_active=True
+        )
+        Product.objects.create(
+            name="Скрытые", slug="hidden", description="d", price=100,
+            category=self.category, is_active=False
+        )
+
+    def get(self, name):
+        response = self.client.get(f"/{name}")
+        self.assertEqual(response.status_code, 200)
+        return ElementTree.fromstring(b"".join(response.streaming_content))
+
+    def locations(self, root):
+        return [el.text for el in root.iter(f"{{{sitemaps.XMLNS}}}loc")]
+
+    def test_generated_files(self):
+        call_command("generate_sitemaps", stdout=StringIO())
+
+        shard = sitemaps.shard_name(self.product.pk // sitemaps.SHARD_SIZE)
+
+        self.assertEqual(
+            self.locations(self.get("sitemap.xml")),
+            [
+                absolute_url("/" + sitemaps.CATEGORIES_NAME),
+                absolute_url("/" + shard),
+            ]
+        )
+        self.assertEqual(
+            self.locations(self.get(shard)),
+            [absolute_url(self.product.get_absolute_url())]
+        )
+        self.assertEqual(
+            self.locations(self.get(sitemaps.CATEGORIES_NAME)),
+            [absolute_url(self.category.get_absolute_url())]
+        )
+
+    def test_missing_sitemap_is_404(self):
+        self.assertEqual(self.client.get("/sitemap.xml").status_code, 404)
+
+    def test_only_changed_shards_rewritten(self):
+        with patch.object(sitemaps, "SHARD_SIZE", 1):
+            other = Product.objects.create(
+                name="Ботинки", slug="boots", description="d", price=100,
+                category=self.category, is_active=True
+            )
+
+            self.assertEqual(sitemaps.write_sitemaps(), {"shards": 2, "written": 2})
+            self.assertEqual(sitemaps.write_sitemaps(), {"shards": 2, "written": 0})
+
+            other.name = "Ботинки зимние"
+            other.save()
+            self.assertEqual(sitemaps.write_sitemaps(), {"shards": 2, "written": 1})
+
+            removed = sitemaps.shard_name(other.pk)
+            other.delete()
+            self.assertEqual(sitemaps.write_sitemaps(), {"shards": 1, "written": 0})
+            self.assertFalse(os.path.exists(os.path.join(self.sitemap_dir, removed)))
+
+
+@override_settings(CATALOG_CURSOR_PAGINATION=True)
+class SortingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.category = Category.objects.create(name="Куртки", slug="jackets")
+        self.size = Size.objects.create(name="L")
+
+        self.products = {}
+        for name, price in (("a", 3000), ("b", 1000), ("c", 2000), ("d", 1000)):
+            product = Product.objects.create(
+                name=name, slug=name, description="d", price=price,
+                category=self.category, is_active=True
+            )
+            Variant.objects.create(product=product, size=self.size, stock=1)
+            self.products[name] = product
+
+        for name, popularity in (("a", 5), ("c", 9), ("d", 1)):
+            Product.objects.filter(pk=self.products[name].pk).update(popularity=popularity)
+
+        self.url = reverse("category_detail", args=[self.category.slug])
+
+    def names(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [p.name for p in response.context["products"]], response
+
+    def test_sort_orders(self):
+        self.assertEqual(self.names({})[0], ["d", "c", "b", "a"])
+        self.assertEqual(self.names({"sort": "price_asc"})[0], ["b", "d", "c", "a"])
+        self.assertEqual(self.names({"sort": "price_desc"})[0], ["a", "c", "d", "b"])
+        self.assertEqual(self.names({"sort": "popular"})[0], ["c", "a", "d", "b"])
+        self.assertEqual(self.names({"sort": "bogus"})[0], ["d", "c", "b", "a"])
+
+    def test_sort_with_filters(self):
+        params = {"sort": "price_desc", "size": self.size.pk}
+        self.assertEqual(self.names(params)[0], ["a", "c", "d", "b"])
+
+    def test_cursor_follows_sort(self):
+        seen = []
+        params = {"sort": "price_asc"}
+
+        with patch.object(ProductListView, "paginate_by", 3):
+            while True:
+                names, response = self.names(params)
+                seen += names
+                page = response.context["page_obj"]
+                if not page.has_next():
+                    break
+                params = {"sort": "price_asc", "after": page.next_cursor}
+
+            back, _ = self.names({"sort": "price_asc", "before": page.previous_cursor})
+
+        self.assertEqual(seen, ["b", "d", "c", "a"])
+        self.assertEqual(back, ["b", "d", "c"])
+
+    def test_cursor_from_other_sort_rejected(self):
+        with patch.object(ProductListView, "paginate_by", 2):
+            _, response = self.names({"sort": "price_asc"})
+
+        cursor = response.context["page_obj"].next_cursor
+        self.assertEqual(
+            self.client.get(self.url, {"sort": "popular", "after": cursor}).status_code,
+            404
+        )
+
+    def test_update_popularity(self):
+        from orders.models import Order, OrderItem
+        from users.models import User
+
+        user = User.objects.create_user(
+            email="pop@test.com", full_name="Pop", phone="1", password="password123"
+        )
+
+        recent = Order.objects.create(
+            user=user, name="n", phone="1", email="e@e.e", address="a", total_price=0
+        )
+        OrderItem.objects.create(order=recent, product=self.products["b"], quantity=2, price=1)
+
+        old = Order.objects.create(
+            user=user, name="n", phone="1", email="e@e.e", address="a", total_price=0
+        )
+        OrderItem.objects.create(order=old, product=self.products["a"], quantity=3, price=1)
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=20))
+
+        call_command("update_popularity", stdout=StringIO())
+
+        self.assertEqual(
+            dict(Product.objects.values_list("name", "popularity")),
+            {"a": 6.0, "b": 8.0, "c": 0.0, "d": 0.0}
+        )
+        self.assertEqual(self.names({"sort": "popular"})[0][:2], ["b", "a"])
+
+
+class RecommendationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        from orders.models import Order, OrderItem
+        from users.models import User
+
+        self.category = Category.objects.create(name="Аксессуары", slug="accessories")
+        self.products = {
+            name: Product.objects.create(
+                name=name, slug=name, description="d", price=100,
+                category=self.category, is_active=True
+            )
+            for name in ("hat", "scarf", "gloves", "belt", "bag")
+        }
+
+        user = User.objects.create_user(
+            email="rec@test.com", full_name="Rec", phone="1", password="password123"
+        )
+
+        def order(*names, status=Order.STATUS_NEW):
+            created = Order.objects.create(
+                user=user, name="n", phone="1", email="e@e.e", address="a",
+                total_price=0, status=status
+            )
+            for name in names:
+                OrderItem.objects.create(
+                    order=created, product=self.products[name], quantity=1, price=100
+                )
+
+        order("hat", "scarf")
+        order("hat", "scarf", "gloves")
+        order("hat", "scarf", "scarf")
+        order("belt")
+        order("hat", "bag", status=Order.STATUS_CANCELLED)
+
+    def related(self, name):
+        return list(
+            RelatedProduct.objects
+            .filter(product=self.products[name])
+            .values_list("related__slug", flat=True)
+        )
+
+    def test_build(self):
+        call_command("build_recommendations", stdout=StringIO())
+
+        self.assertEqual(self.related("hat"), ["scarf", "gloves"])
+        self.assertEqual(self.related("gloves"), ["hat", "scarf"])
+        self.assertEqual(self.related("belt"), [])
+        self.assertEqual(self.related("bag"), [])
+
+        score = RelatedProduct.objects.get(
+            product=self.products["hat"], related=self.products["scarf"]
+        ).score
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_inactive_products_excluded(self):
+        Product.objects.filter(pk=self.products["scarf"].pk).update(is_active=False)
+
+        recommendations.build_recommendations()
+
+        self.assertEqual(self.related("hat"), ["gloves"])
+        self.assertEqual(self.related("scarf"), [])
+
+    def test_min_support(self):
+        recommendations.build_recommendations(min_support=2)
+        self.assertEqual(self.related("hat"), ["scarf"])
+
+    def test_detail_page_shows_related(self):
+        recommendations.build_recommendations()
+        url = reverse("product_detail", args=["gloves"])
+
+        response = self.client.get(url)
+        self.assertEqual(
+            [p.slug for p in response.context["related_products"]],
+            ["hat", "scarf"]
+        )
+
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+
+class BestsellerTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.shirts = Category.objects.create(name="Рубашки", slug="shirts")
+        self.hats = Category.objects.create(name="Шапки", slug="hats")
+
+        self.products = {}
+        for name, category in (("s1", self.shirts), ("s2", self.shirts), ("h1", self.hats)):
+            self.products[name] = Product.objects.create(
+                name=name, slug=name, description="d", price=100,
+                category=category, is_active=True
+            )
+
+    def sell(self, name, quantity, days_ago=0):
+        product = self.products[name]
+        bestsellers.record_sales(
+            [(product.pk, product.category_id, quantity)],
+            day=timezone.localdate() - timedelta(days=days_ago)
+        )
+
+    def test_week_sales_rank_first(self):
+        self.sell("s1", 10, days_ago=20)
+        self.sell("s2", 1)
+        self.sell("s2", 1)
+        self.sell("h1", 5, days_ago=40)
+
+        ids = bestsellers.top_product_ids(self.shirts.pk)
+        self.assertEqual(ids, [self.products["s2"].pk, self.products["s1"].pk])
+        self.assertEqual(
+            bestsellers.top_product_ids(),
+            [self.products["s2"].pk, self.products["s1"].pk]
+        )
+
+    def test_pages_show_bestsellers_and_refresh_on_sale(self):
+        self.sell("s1", 2)
+
+        response = self.client.get(reverse("home"))
+        self.assertEqual([p.slug for p in response.context["bestsellers"]], ["s1"])
+
+        self.sell("h1", 5)
+
+        response = self.client.get(reverse("home"))
+        self.assertEqual([p.slug for p in response.context["bestsellers"]], ["h1", "s1"])
+
+        response = self.client.get(reverse("category_detail", args=["hats"]))
+        self.assertEqual([p.slug for p in response.context["bestsellers"]], ["h1"])
+
+    def test_rebuild(self):
+        from orders.models import Order, OrderItem
+        from users.models import User
+
+        user = User.objects.create_user(
+            email="best@test.com", full_name="Best", phone="1", password="password123"
+        )
+
+        for status, quantity in ((Order.STATUS_NEW, 2), (Order.STATUS_CANCELLED, 7)):
+            order = Order.objects.create(
+                user=user, name="n", phone="1", email="e@e.e", address="a",
+                total_price=0, status=status
+            )
+            OrderItem.objects.create(
+                order=order, product=self.products["s2"], quantity=quantity, price=1
+            )
+
+        self.sell("h1", 3, days_ago=60)
+
+        call_command("rebuild_bestsellers", stdout=StringIO())
+
+        self.assertEqual(
+            list(ProductSales.objects.values_list("product__slug", "units")),
+            [("s2", 2)]
+        )
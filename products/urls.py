@@ -1,8 +1,21 @@
-from django.urls import path
-from .views import CategoryListView, ProductListView, ProductDetailView
+from django.conf import settings
+from django.urls import path, re_path
+from .views import CategoryListView, ProductListView, ProductDetailView, SearchView, resize_image, catalog_feed, sitemap_file
 
 urlpatterns = [
     path('', CategoryListView.as_view(), name='home'),
     path('category/<slug:slug>/', ProductListView.as_view(), name='category_detail'),
     path('product/<slug:slug>/', ProductDetailView.as_view(), name='product_detail'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('feeds/catalog.<str:fmt>', catalog_feed, name='catalog_feed'),
+    re_path(
+        r'^(?P<name>sitemap(-categories|-products-\d+)?\.xml)$',
+        sitemap_file,
+        name='sitemap'
+    ),
+    path(
+        f"{settings.MEDIA_URL.lstrip('/')}r/<int:width>x<int:height>/<path:path>",
+        resize_image,
+        name='media_resize'
+    ),
 ]
\ No newline at end of file
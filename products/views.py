@@ -1,8 +1,65 @@
+import os
+
+from django.conf import settings
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_safe
 from django.views.generic import ListView, DetailView
 from django.shortcuts import get_object_or_404
 from django.db.models import Prefetch
 
-from .models import Category, Product, ProductImage, Variant
+from . import bestsellers
+from . import cache as catalog_cache
+from . import facets
+from . import feeds
+from . import inventory
+from . import resize
+from . import search
+from . import sitemaps
+from . import sorting
+from .pagination import CachedPagePaginator, paginate_by_cursor
+from .models import Category, Product, ProductImage, RelatedProduct
+
+
+# главное фото карточки — JOIN вместо загрузки всех фото товара
+CARD_IMAGE_FIELDS = ("primary_image__id", "primary_image__image", "primary_image__renditions")
+
+
+def load_product_cards(ids):
+    """Товары для карточек в порядке ids (одна страница)."""
+    products = (
+        Product.objects
+        .filter(id__in=ids, is_active=True)
+        .only(
+            "id", "name", "slug", "price",
+            "created_at", "category", "available_stock",
+            *CARD_IMAGE_FIELDS
+        )
+        .select_related("primary_image")
+        .in_bulk()
+    )
+
+    return [products[pk] for pk in ids if pk in products]
+
+
+def load_bestsellers(category_id=None, limit=bestsellers.TOP_N):
+    """Карточки хитов продаж (см. products.bestsellers)."""
+    # дата в ключе сдвигает окно раз в сутки
+    key = f"catalog:bestsellers:{category_id or 'all'}:{limit}:{timezone.localdate()}"
+    products = catalog_cache.get_cached(key)
+
+    if products is None:
+        token = catalog_cache.versions([(catalog_cache.SALES, category_id or "all")])
+
+        # с запасом: часть товаров могла стать неактивной
+        ids = bestsellers.top_product_ids(category_id, limit * 2)
+        token = catalog_cache.versions([(catalog_cache.PRODUCT, pk) for pk in ids], token)
+        products = load_product_cards(ids)[:limit]
+
+        catalog_cache.set_cached(key, token, products)
+
+    return products
 
 
 # ==============================
@@ -15,10 +72,26 @@ class CategoryListView(ListView):
     context_object_name = "categories"
     queryset = (
         Category.objects
-        .only("id", "name", "slug", "image")
+        .only("id", "name", "slug", "image", "renditions")
         .order_by("name")
     )
 
+    def get_queryset(self):
+        key = "catalog:category_list"
+        categories = catalog_cache.get_cached(key)
+
+        if categories is None:
+            token = catalog_cache.versions([])
+            categories = list(super().get_queryset())
+            catalog_cache.set_cached(key, token, categories)
+
+        return categories
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["bestsellers"] = load_bestsellers()
+        return context
+
 
 # ==============================
 # PRODUCT LIST (Category page)
@@ -30,28 +103,148 @@ class ProductListView(ListView):
     context_object_name = "products"
     paginate_by = 12
 
+    def get_category(self):
+        slug = self.kwargs["slug"]
+        key = f"catalog:category_slug:{slug}"
+        category = catalog_cache.get_cached(key)
+
+        if category is None:
+            # изменение категории сбрасывает и версию всего каталога
+            token = catalog_cache.versions([])
+            category = get_object_or_404(
+                Category.objects.only("id", "name", "slug"),
+                slug=slug
+            )
+            catalog_cache.set_cached(key, token, category)
+
+        return category
+
     def get_queryset(self):
-        self.category = get_object_or_404(
-            Category.objects.only("id", "name", "slug"),
-            slug=self.kwargs["slug"]
-        )
+        self.category = self.get_category()
+        self.filters = facets.parse_filters(self.request.GET)
+        self.sort = sorting.parse_sort(self.request.GET)
+
+        if self.filters:
+            # фильтры считаются по индексу фасетов — в БД не ходим
+            return self.get_facet_index().product_ids_for(self.filters, self.sort)
 
         return (
             Product.objects
             .filter(category=self.category, is_active=True)
-            .only("id", "name", "slug", "price", "created_at", "category")
-            .prefetch_related(
-                Prefetch(
-                    "images",
-                    queryset=ProductImage.objects.only("id", "product", "image", "order")
-                )
+            .only(
+                "id", "name", "slug", "price", "created_at",
+                "category", "available_stock", "popularity",
+                *CARD_IMAGE_FIELDS
+            )
+            .select_related("primary_image")
+            .order_by(*sorting.ordering(self.sort))
+        )
+
+    def use_cursor_pagination(self):
+        # ?after=/?before= вместо ?page= — включается в settings
+        return getattr(settings, "CATALOG_CURSOR_PAGINATION", False)
+
+    def get_facet_index(self):
+        if not hasattr(self, "_facet_index"):
+            self._facet_index = facets.get_facet_index(self.category.pk)
+        return self._facet_index
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.filters:
+            paginator, page, ids, is_paginated = super().paginate_queryset(
+                queryset, page_size
+            )
+            page.object_list = load_product_cards(ids)
+            return paginator, page, page.object_list, is_paginated
+
+        if self.use_cursor_pagination():
+            return self.paginate_cursor(queryset, page_size)
+
+        page_number = (
+            self.kwargs.get(self.page_kwarg)
+            or self.request.GET.get(self.page_kwarg)
+            or 1
+        )
+        key = f"catalog:category_page:{self.category.pk}:{self.sort}:{page_size}:{page_number}"
+        cached = catalog_cache.get_cached(key)
+
+        if cached is not None:
+            # страница и count из кэша — пагинатор не ходит в БД
+            object_list, count, number = cached
+            paginator = CachedPagePaginator(
+                object_list,
+                count,
+                page_size,
+                orphans=self.get_paginate_orphans(),
+                allow_empty_first_page=self.get_allow_empty(),
             )
-            .order_by("-created_at")
+            page = paginator.page(number)
+            return paginator, page, object_list, page.has_other_pages()
+
+        token = catalog_cache.versions([(catalog_cache.CATEGORY, self.category.pk)])
+        paginator, page, object_list, is_paginated = super().paginate_queryset(
+            queryset, page_size
         )
+        object_list = list(object_list)
+        page.object_list = object_list
+
+        catalog_cache.set_cached(key, token, (object_list, paginator.count, page.number))
+
+        return paginator, page, object_list, is_paginated
+
+    def paginate_cursor(self, queryset, page_size):
+        after = self.request.GET.get("after") or ""
+        before = self.request.GET.get("before") or ""
+        key = f"catalog:category_cursor:{self.category.pk}:{self.sort}:{page_size}:{after}:{before}"
+        page = catalog_cache.get_cached(key)
+
+        if page is None:
+            token = catalog_cache.versions([(catalog_cache.CATEGORY, self.category.pk)])
+            page = paginate_by_cursor(
+                queryset, page_size, after=after, before=before, sort=self.sort
+            )
+            catalog_cache.set_cached(key, token, page)
+
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["category"] = self.category
+        context["cursor_pagination"] = self.use_cursor_pagination() and not self.filters
+        context["facets"] = self.get_facet_index().counts(self.filters)
+        context["has_filters"] = bool(self.filters)
+        context["sort"] = self.sort
+        context["sort_choices"] = sorting.choices()
+        context["bestsellers"] = load_bestsellers(self.category.pk, limit=4)
+        return context
+
+
+# ==============================
+# SEARCH
+# ==============================
+
+class SearchView(ListView):
+    model = Product
+    template_name = "products/search.html"
+    context_object_name = "products"
+    paginate_by = 12
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()[:200]
+        return search.search_product_ids(self.query)
+
+    def paginate_queryset(self, queryset, page_size):
+        # пагинируем id, товары грузим только для текущей страницы
+        paginator, page, ids, is_paginated = super().paginate_queryset(
+            queryset, page_size
+        )
+
+        page.object_list = load_product_cards(ids)
+        return paginator, page, page.object_list, is_paginated
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
         return context
 
 
@@ -65,6 +258,7 @@ class ProductDetailView(DetailView):
     context_object_name = "product"
     slug_field = "slug"
     slug_url_kwarg = "slug"
+    related_limit = 4
 
     def get_queryset(self):
         return (
@@ -73,31 +267,122 @@ class ProductDetailView(DetailView):
             .only(
                 "id", "name", "slug",
                 "description", "price",
-                "category", "created_at"
+                "category", "created_at", "available_stock",
+                "variant_matrix"
             )
             .select_related("category")
             .prefetch_related(
                 Prefetch(
                     "images",
-                    queryset=ProductImage.objects.only("id", "product", "image", "order")
-                ),
-                Prefetch(
-                    "variants",
-                    queryset=Variant.objects.select_related("color", "size")
-                    .only("id", "product", "stock", "color", "size")
+                    queryset=ProductImage.objects.only("id", "product", "image", "order", "renditions")
                 )
             )
         )
 
+    def get_object(self, queryset=None):
+        key = f"catalog:product_slug:{self.kwargs[self.slug_url_kwarg]}"
+        product = catalog_cache.get_cached(key)
+
+        if product is None:
+            # версии товара — до чтения карточки: сначала id по slug
+            found = (
+                self.get_queryset()
+                .filter(**{self.slug_field: self.kwargs[self.slug_url_kwarg]})
+                .values_list("pk", "category_id")
+                .first()
+            )
+            if found is None:
+                raise Http404("Товар не найден")
+
+            token = catalog_cache.versions([
+                (catalog_cache.PRODUCT, found[0]),
+                (catalog_cache.CATEGORY, found[1]),
+            ])
+            product = super().get_object(self.get_queryset().filter(pk=found[0]))
+            catalog_cache.set_cached(key, token, product)
+
+        return product
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # без дополнительного SQL
-        variants = list(self.object.variants.all())
+        # варианты — из матрицы товара, без запросов к Variant
+        context["variant_grid"] = inventory.variant_grid(self.object.variant_matrix)
+        context["related_products"] = self.get_related_products()
 
-        context["first_available_variant"] = next(
-            (v for v in variants if v.stock > 0),
-            None
-        )
+        return context
+
+    def get_related_products(self):
+        key = f"catalog:related:{self.object.pk}"
+        products = catalog_cache.get_cached(key)
+
+        if products is None:
+            token = catalog_cache.versions([(catalog_cache.PRODUCT, self.object.pk)])
+
+            # top-N посчитан заранее (products.recommendations)
+            ids = list(
+                RelatedProduct.objects
+                .filter(product=self.object)
+                .values_list("related_id", flat=True)[:self.related_limit * 2]
+            )
+            token = catalog_cache.versions([(catalog_cache.PRODUCT, pk) for pk in ids], token)
+            products = load_product_cards(ids)[:self.related_limit]
+
+            catalog_cache.set_cached(key, token, products)
+
+        return products
+
+
+# ==============================
+# IMAGE RESIZE
+# ==============================
+
+@require_safe
+def resize_image(request, width, height, path):
+    ext = "webp" if "image/webp" in request.headers.get("Accept", "") else "jpg"
+
+    try:
+        file = resize.open_resized(path, width, height, ext)
+    except resize.InvalidResize:
+        raise Http404("Изображение не найдено")
+
+    response = FileResponse(file, content_type=resize.FORMATS[ext][1])
+    # адрес привязан к файлу оригинала — копия не меняется
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+# ==============================
+# FEEDS
+# ==============================
+
+@require_safe
+def catalog_feed(request, fmt):
+    if fmt not in feeds.FORMATS:
+        raise Http404("Неизвестный формат фида")
+
+    feed = feeds.get_format(fmt)
+    path = feeds.feed_path(fmt)
+
+    # готовый файл от manage.py generate_feeds, иначе — потоком из базы
+    if os.path.exists(path):
+        return FileResponse(open(path, "rb"), content_type=feed.content_type)
+
+    return StreamingHttpResponse(feeds.stream_feed(fmt), content_type=feed.content_type)
+
+
+# ==============================
+# SITEMAP
+# ==============================
+
+@require_safe
+def sitemap_file(request, name):
+    # файлы готовит manage.py generate_sitemaps; на проде их отдаёт веб-сервер
+    path = os.path.join(sitemaps.sitemap_dir(), name)
+
+    if not os.path.exists(path):
+        raise Http404("Sitemap не сгенерирован")
+
+    return FileResponse(open(path, "rb"), content_type="application/xml; charset=utf-8")
 
-        return context
\ No newline at end of file